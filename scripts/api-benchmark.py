@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+
+"""Measure how many API requests per second the server side can handle.
+
+This binds a small API to an in-process aiohttp test server and makes
+requests to it as fast as it can, with a few requests in flight at
+once, to see how much the per request overhead of the handlers made by
+subiquity.common.api.server.bind() costs:
+
+    PYTHONPATH=. python3 scripts/api-benchmark.py --requests 5000
+
+The endpoints do next to no work themselves, so the time is spent
+routing, binding the arguments, and serializing the results. Each kind
+of request is timed separately: a GET with no arguments, a GET with a
+path parameter and some query arguments, and a POST with a payload.
+"""
+
+import argparse
+import asyncio
+import itertools
+import time
+from typing import List, Optional
+
+import attr
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from subiquity.common.api.defs import Payload, api, path_parameter
+from subiquity.common.api.server import bind
+from subiquity.common.serialize import to_json
+
+
+@attr.s(auto_attribs=True)
+class Thing:
+    name: str
+    size: int
+    tags: List[str]
+    parent: Optional[str] = None
+
+
+@api
+class BenchAPI:
+    class ping:
+        def GET() -> str:
+            ...
+
+    class things:
+        @path_parameter
+        class thing:
+            def GET(size: int, tags: List[str], verbose: bool = False) -> Thing:
+                ...
+
+        def POST(thing: Payload[Thing]) -> int:
+            ...
+
+
+class BenchContext:
+    def child(self, name):
+        return self
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class BenchApp:
+    def __init__(self):
+        self.controllers_have_started = asyncio.Event()
+        self.controllers_have_started.set()
+
+
+class BenchController:
+    def __init__(self):
+        self.context = BenchContext()
+        self.app = BenchApp()
+
+    async def ping_GET(self) -> str:
+        return "pong"
+
+    async def things_thing_GET(
+        self, thing: str, size: int, tags: List[str], verbose: bool = False
+    ) -> Thing:
+        return Thing(name=thing, size=size, tags=tags)
+
+    async def things_POST(self, thing: Thing) -> int:
+        return thing.size
+
+
+async def run(nrequests, concurrency):
+    app = web.Application()
+    bind(app.router, BenchAPI, BenchController())
+    thing = Thing(name="thing", size=10, tags=["a", "b"])
+    tags = to_json(List[str], ["a", "b"])
+    # Concurrent identical GETs share a response, so make each one
+    # different to time the handling of every request.
+    counter = itertools.count()
+    requests = [
+        ("GET /ping", lambda client, i: client.get("/ping", params={"n": i})),
+        (
+            "GET /things/{thing}",
+            lambda client, i: client.get(
+                "/things/thing",
+                params={"size": str(i), "tags": tags, "verbose": "true"},
+            ),
+        ),
+        (
+            "POST /things",
+            lambda client, i: client.post(
+                "/things", data=to_json(Thing, thing).encode()
+            ),
+        ),
+    ]
+    async with TestClient(TestServer(app)) as client:
+        for name, request in requests:
+
+            async def worker(count):
+                for _ in range(count):
+                    async with request(client, next(counter)) as resp:
+                        assert resp.status == 200, await resp.text()
+                        await resp.read()
+
+            start = time.perf_counter()
+            await asyncio.gather(
+                *(worker(nrequests // concurrency) for _ in range(concurrency))
+            )
+            elapsed = time.perf_counter() - start
+            done = nrequests // concurrency * concurrency
+            print(
+                f"  {name:<20} {done / elapsed:8.0f} requests/s"
+                f"  {elapsed / done * 1e6:8.1f}us/request"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="requests in flight at once"
+    )
+    opts = parser.parse_args()
+    print(f"{opts.requests} requests, {opts.concurrency} at a time:")
+    asyncio.run(run(opts.requests, opts.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+
+"""Time the serializer on big storage API responses.
+
+This builds a StorageResponseV2 for a machine with many disks, each
+carrying a number of partitions, and a GuidedStorageResponseV2 with a
+couple of targets per disk, and times serializing them and
+deserializing the result, as the server and client do for every
+request:
+
+    PYTHONPATH=. python3 scripts/serializer-benchmark.py --disks 300
+
+or with --disks 50,100,200,400 to see how things scale.
+
+With --api, the responses are instead served over a unix socket and
+fetched with the API client, once as JSON and once as msgpack, to
+compare the size of the responses and the time each request takes.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from subiquity.common.api import wire
+from subiquity.common.api.client import make_client_for_conn
+from subiquity.common.api.defs import api
+from subiquity.common.api.server import bind
+from subiquity.common.serialize import Serializer
+from subiquity.common.types.storage import (
+    Disk,
+    Gap,
+    GapUsable,
+    GuidedCapability,
+    GuidedDisallowedCapability,
+    GuidedDisallowedCapabilityReason,
+    GuidedStorageResponseV2,
+    GuidedStorageTargetReformat,
+    GuidedStorageTargetUseGap,
+    Partition,
+    ProbeStatus,
+    StorageResponseV2,
+)
+
+GiB = 1 << 30
+
+
+def make_disks(ndisks, nparts):
+    disks = []
+    for i in range(ndisks):
+        partitions = [
+            Partition(
+                size=GiB,
+                number=j,
+                preserve=True,
+                wipe=None,
+                annotations=["existing", "already formatted as ext4"],
+                mount=None,
+                format="ext4",
+                offset=j * GiB,
+                path=f"/dev/sd{i}{j}",
+                name=f"part{j}",
+            )
+            for j in range(1, nparts + 1)
+        ]
+        gap = Gap(offset=(nparts + 1) * GiB, size=GiB, usable=GapUsable.YES)
+        disks.append(
+            Disk(
+                id=f"disk-sd{i}",
+                label=f"WDC_WD40EFRX_{i}",
+                type="local disk",
+                size=(nparts + 2) * GiB,
+                usage_labels=["existing", "already partitioned"],
+                partitions=partitions + [gap],
+                ok_for_guided=True,
+                ptable="gpt",
+                preserve=True,
+                path=f"/dev/sd{i}",
+                boot_device=False,
+                can_be_boot_device=True,
+                model="WDC WD40EFRX",
+                vendor="ATA",
+            )
+        )
+    return disks
+
+
+def make_storage_response(disks):
+    return StorageResponseV2(
+        status=ProbeStatus.DONE,
+        disks=disks,
+        need_root=True,
+        need_boot=True,
+        install_minimum_size=5 * GiB,
+    )
+
+
+def make_guided_response(disks):
+    disallowed = [
+        GuidedDisallowedCapability(
+            capability=GuidedCapability.CORE_BOOT_ENCRYPTED,
+            reason=GuidedDisallowedCapabilityReason.NOT_UEFI,
+        )
+    ]
+    allowed = [GuidedCapability.DIRECT, GuidedCapability.LVM]
+    targets = []
+    for disk in disks:
+        targets.append(
+            GuidedStorageTargetReformat(
+                disk_id=disk.id, allowed=allowed, disallowed=disallowed
+            )
+        )
+        targets.append(
+            GuidedStorageTargetUseGap(
+                disk_id=disk.id,
+                gap=disk.partitions[-1],
+                allowed=allowed,
+                disallowed=disallowed,
+            )
+        )
+    return GuidedStorageResponseV2(status=ProbeStatus.DONE, targets=targets)
+
+
+def timeit(func, repeat, setup=lambda: ()):
+    best = None
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run(ndisks, nparts, repeat):
+    disks = make_disks(ndisks, nparts)
+    serializer = Serializer()
+    print(f"{ndisks} disks with {nparts} partitions each:")
+    for annotation, value in [
+        (StorageResponseV2, make_storage_response(disks)),
+        (GuidedStorageResponseV2, make_guided_response(disks)),
+    ]:
+        serialized = json.dumps(serializer.serialize(annotation, value))
+        ser = timeit(lambda: serializer.serialize(annotation, value), repeat)
+        # Deserializing a Union can consume the $type keys, so each run
+        # gets a fresh copy.
+        deser = timeit(
+            lambda data: serializer.deserialize(annotation, data),
+            repeat,
+            setup=lambda: (json.loads(serialized),),
+        )
+        print(
+            f"  {annotation.__name__:<24} serialize {ser * 1000:8.2f}ms"
+            f"  deserialize {deser * 1000:8.2f}ms"
+        )
+
+
+@api
+class BenchAPI:
+    class storage:
+        class v2:
+            def GET() -> StorageResponseV2:
+                ...
+
+            class guided:
+                def GET() -> GuidedStorageResponseV2:
+                    ...
+
+
+class BenchController:
+    def __init__(self, storage, guided):
+        self.storage = storage
+        self.guided = guided
+        self.context = BenchContext()
+
+    async def storage_v2_GET(self) -> StorageResponseV2:
+        return self.storage
+
+    async def storage_v2_guided_GET(self) -> GuidedStorageResponseV2:
+        return self.guided
+
+
+class BenchContext:
+    def child(self, name):
+        return self
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+async def run_api(ndisks, nparts, repeat):
+    disks = make_disks(ndisks, nparts)
+    controller = BenchController(
+        make_storage_response(disks), make_guided_response(disks)
+    )
+    app = web.Application()
+    bind(app.router, BenchAPI, controller)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    with tempfile.TemporaryDirectory() as tdir:
+        socket_path = os.path.join(tdir, "socket")
+        await web.UnixSite(runner, socket_path).start()
+        print(f"{ndisks} disks with {nparts} partitions each:")
+        for name, get in [
+            ("v2", lambda client: client.storage.v2.GET()),
+            ("v2/guided", lambda client: client.storage.v2.guided.GET()),
+        ]:
+            for use_msgpack in False, True:
+                sizes = []
+
+                def resp_hook(resp):
+                    sizes.append(resp.content_length)
+                    return resp
+
+                conn = aiohttp.UnixConnector(socket_path)
+                client = make_client_for_conn(
+                    BenchAPI, conn, resp_hook, use_msgpack=use_msgpack
+                )
+                best = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    await get(client)
+                    elapsed = time.perf_counter() - start
+                    if best is None or elapsed < best:
+                        best = elapsed
+                await conn.close()
+                fmt = "msgpack" if use_msgpack else "json"
+                print(
+                    f"  {name:<10} {fmt:<8} {sizes[-1]:>9} bytes"
+                    f"  {best * 1000:8.2f}ms"
+                )
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--disks", default="300", help="number of disks, or a comma separated list"
+    )
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="report the best of this many runs"
+    )
+    parser.add_argument(
+        "--api",
+        action="store_true",
+        help="time requests over a unix socket rather than the serializer alone",
+    )
+    opts = parser.parse_args()
+    if opts.api and not wire.have_msgpack():
+        parser.error("--api needs the msgpack module")
+    for ndisks in opts.disks.split(","):
+        if opts.api:
+            asyncio.run(run_api(int(ndisks), opts.partitions, opts.repeat))
+        else:
+            run(int(ndisks), opts.partitions, opts.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+
+"""Time FilesystemModel operations on a machine with lots of disks.
+
+This generates synthetic probe data for a machine with many GPT disks,
+each carrying a number of partitions, loads it into a FilesystemModel
+and times some of the operations that the server performs a lot.
+
+The probe data can also be written out, e.g. for use with
+--machine-config in a dry run:
+
+    PYTHONPATH=.:curtin:probert python3 scripts/storage-model-benchmark.py \\
+        --disks 300 --partitions 8 --write many-disks.json
+
+or with --disks 50,100,200,400 to see how things scale. The gap queries
+are run on the first disk, so use e.g. --disks 1 --partitions 128 to see
+how they do on a disk with a full GPT.
+"""
+
+import argparse
+import json
+import sys
+import time
+import uuid
+
+from subiquity.common.filesystem import gaps
+from subiquity.models.filesystem import ActionRenderMode, FilesystemModel
+
+SECTOR = 512
+MiB = 1 << 20
+
+
+def disk_name(i):
+    name = ""
+    i += 1
+    while i > 0:
+        i, r = divmod(i - 1, 26)
+        name = chr(ord("a") + r) + name
+    return "sd" + name
+
+
+def make_probe_data(ndisks, nparts, part_size=MiB * 1024):
+    blockdev = {}
+    for i in range(ndisks):
+        name = disk_name(i)
+        path = f"/dev/{name}"
+        major, minor = 8 + (i // 16) * 57, (i % 16) * 16
+        ptable_uuid = str(uuid.UUID(int=i))
+        disk_size = (nparts + 2) * part_size
+        parts = []
+        for j in range(1, nparts + 1):
+            part_path = f"{path}{j}"
+            part_uuid = str(uuid.UUID(int=(i << 16) + j))
+            start = j * part_size // SECTOR
+            size = part_size // SECTOR
+            parts.append(
+                {
+                    "node": part_path,
+                    "size": size,
+                    "start": start,
+                    "type": "0FC63DAF-8483-4772-8E79-3D69D8477DE4",
+                    "uuid": part_uuid.upper(),
+                }
+            )
+            blockdev[part_path] = {
+                "DEVNAME": part_path,
+                "DEVPATH": f"/devices/virtual/block/{name}/{name}{j}",
+                "DEVTYPE": "partition",
+                "ID_PART_ENTRY_DISK": f"{major}:{minor}",
+                "ID_PART_ENTRY_NUMBER": str(j),
+                "ID_PART_ENTRY_OFFSET": str(start),
+                "ID_PART_ENTRY_SCHEME": "gpt",
+                "ID_PART_ENTRY_SIZE": str(size),
+                "ID_PART_ENTRY_TYPE": "0fc63daf-8483-4772-8e79-3d69d8477de4",
+                "ID_PART_ENTRY_UUID": part_uuid,
+                "ID_PART_TABLE_TYPE": "gpt",
+                "ID_PART_TABLE_UUID": ptable_uuid,
+                "ID_SERIAL": f"serial{i}",
+                "MAJOR": str(major),
+                "MINOR": str(minor + j),
+                "PARTN": str(j),
+                "SUBSYSTEM": "block",
+                "attrs": {
+                    "partition": str(j),
+                    "size": str(part_size),
+                    "start": str(start),
+                },
+            }
+        blockdev[path] = {
+            "DEVNAME": path,
+            "DEVPATH": f"/devices/virtual/block/{name}",
+            "DEVTYPE": "disk",
+            "ID_PART_TABLE_TYPE": "gpt",
+            "ID_PART_TABLE_UUID": ptable_uuid,
+            "ID_SERIAL": f"serial{i}",
+            "MAJOR": str(major),
+            "MINOR": str(minor),
+            "SUBSYSTEM": "block",
+            "attrs": {
+                "serial": f"serial{i}",
+                "size": str(disk_size),
+            },
+            "partitiontable": {
+                "device": path,
+                "firstlba": 34,
+                "id": ptable_uuid.upper(),
+                "label": "gpt",
+                "lastlba": disk_size // SECTOR - 34,
+                "partitions": parts,
+                "unit": "sectors",
+            },
+        }
+    return {
+        "bcache": {"backing": {}, "caching": {}},
+        "blockdev": blockdev,
+        "dasd": {},
+        "dmcrypt": {},
+        "filesystem": {},
+        "lvm": {},
+        "mount": [],
+        "multipath": {},
+        "raid": {},
+        "zfs": {"zpools": {}},
+    }
+
+
+def timeit(label, func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:40} {elapsed / repeat * 1000:10.3f} ms")
+
+
+def make_model(probe_data):
+    model = FilesystemModel(root="/", opt_supports_nvme_tcp_booting=False)
+    model.target = "/target"
+    model.load_probe_data(probe_data)
+    return model
+
+
+def benchmark(opts, ndisks):
+    probe_data = make_probe_data(ndisks, opts.partitions)
+    start = time.perf_counter()
+    model = make_model(probe_data)
+    elapsed = time.perf_counter() - start
+    print(f"{ndisks} disks, {len(model._actions)} actions, loaded in {elapsed:.3f} s")
+
+    parts = model._all(type="partition")
+    uuids = [p.uuid for p in parts[:: max(1, len(parts) // 100)]]
+    ids = [a.id for a in model._actions[:: max(1, len(model._actions) // 100)]]
+
+    timeit("all_disks()", model.all_disks, opts.repeat)
+    timeit("all_raids()", model.all_raids, opts.repeat)
+    timeit(
+        "partition_by_partuuid() x 100",
+        lambda: [model.partition_by_partuuid(u) for u in uuids],
+        opts.repeat,
+    )
+    timeit("_one(id=) x 100", lambda: [model._one(id=i) for i in ids], opts.repeat)
+    timeit("can_install()", model.can_install, opts.repeat)
+    timeit("get_orig_model()", model.get_orig_model, opts.repeat)
+
+    # As after POST /storage/v2/ensure_transaction.
+    model.start_transaction()
+
+    def edit_and_reset():
+        for part in parts[:10]:
+            model.add_filesystem(part, "ext4")
+        model.reset()
+
+    timeit("10 x add_filesystem() + reset()", edit_and_reset, opts.repeat)
+    disk = model.all_disks()[0]
+    offsets = [p.offset for p in disk.partitions()]
+
+    def gap_queries():
+        gaps.largest_gap(disk)
+        gaps.first_gap_with_size(disk, MiB)
+        for offset in offsets:
+            gaps.at_offset(disk, offset)
+            gaps.after(disk, offset)
+            gaps.includes(disk, offset)
+
+    def gap_queries_uncached():
+        # Any change to the model drops the cached gap layouts.
+        model._changed()
+        gap_queries()
+
+    label = f"gap queries x {3 * len(offsets) + 2}"
+    timeit(label, gap_queries_uncached, opts.repeat)
+    timeit(label + ", cached", gap_queries, opts.repeat)
+    timeit(
+        "_render_actions(FOR_API)",
+        lambda: model._render_actions_uncached(ActionRenderMode.FOR_API),
+        opts.repeat,
+    )
+    timeit(
+        "_render_actions(FOR_API), cached",
+        lambda: model._render_actions(ActionRenderMode.FOR_API),
+        opts.repeat,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--disks",
+        default="300",
+        help="number of disks, or a comma separated list to show scaling",
+    )
+    parser.add_argument("--partitions", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--write", metavar="FILE", help="write machine config to FILE and exit"
+    )
+    opts = parser.parse_args()
+    disk_counts = [int(n) for n in opts.disks.split(",")]
+
+    if opts.write:
+        probe_data = make_probe_data(disk_counts[0], opts.partitions)
+        with open(opts.write, "w") as fp:
+            json.dump({"storage": probe_data}, fp, indent=1)
+        return 0
+
+    for ndisks in disk_counts:
+        benchmark(opts, ndisks)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -28,6 +28,7 @@ import aiohttp
 
 from subiquity.client.controller import Confirm
 from subiquity.client.keycodes import KeyCodesFilter, NoOpKeycodesFilter
+from subiquity.common.api import wire
 from subiquity.common.api.client import make_client_for_conn
 from subiquity.common.apidef import API
 from subiquity.common.errorreport import ErrorReport, ErrorReporter
@@ -131,6 +132,9 @@ class SubiquityClient(TuiApplication):
     # Set default controllerset
     controllers = variant_to_controllers["server"]
 
+    # How many of the screens after the current one to make requests for.
+    prefetch_depth = 2
+
     def __init__(self, opts, about_msg=None):
         if is_linux_tty():
             self.input_filter = KeyCodesFilter()
@@ -151,6 +155,10 @@ class SubiquityClient(TuiApplication):
             self.our_tty = "not a tty"
 
         self.in_make_view_cvar = contextvars.ContextVar("in_make_view", default=False)
+        self.in_prefetch_cvar = contextvars.ContextVar("in_prefetch", default=False)
+        # Tasks making the requests for the screens after the current one,
+        # by controller name.
+        self.prefetch_tasks: Dict[str, asyncio.Task] = {}
 
         self.error_reporter = ErrorReporter(
             self.context.child("ErrorReporter"), self.opts.dry_run, self.root
@@ -207,7 +215,17 @@ class SubiquityClient(TuiApplication):
 
         os.execvpe(cmdline[0], cmdline, orig_environ(os.environ))
 
+    def request_headers(self):
+        if self.in_make_view_cvar.get():
+            return {"x-make-view-request": "yes"}
+        else:
+            return None
+
     def resp_hook(self, response):
+        if self.in_prefetch_cvar.get():
+            # Nothing is waiting for a prefetched response, so anything
+            # unusual about it is left for the request that uses it to see.
+            return response
         headers = response.headers
         if "x-updated" in headers:
             if self.server_updated is None:
@@ -329,14 +347,13 @@ class SubiquityClient(TuiApplication):
     async def start(self):
         conn = aiohttp.UnixConnector(self.opts.socket)
 
-        def header_func():
-            if self.in_make_view_cvar.get():
-                return {"x-make-view-request": "yes"}
-            else:
-                return None
-
         self.client = make_client_for_conn(
-            API, conn, self.resp_hook, header_func=header_func
+            API,
+            conn,
+            self.resp_hook,
+            header_func=self.request_headers,
+            use_msgpack=wire.have_msgpack(),
+            use_cache=True,
         )
         self.error_reporter.client = self.client
 
@@ -575,8 +592,36 @@ class SubiquityClient(TuiApplication):
             run_bg_task(self._start_answers_for_view(new, view))
         with open(self.state_path("last-screen"), "w") as fp:
             fp.write(new.name)
+        self.prefetch_after(self.controllers.index)
         return view
 
+    async def _prefetch(self, controller):
+        self.in_make_view_cvar.set(False)
+        self.in_prefetch_cvar.set(True)
+        results = await asyncio.gather(*controller.prefetch(), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                log.debug("prefetch for %s failed: %r", controller.name, result)
+
+    def prefetch_after(self, index):
+        """Start making the requests for the screens after the one at index.
+
+        Requests for screens that are no longer coming up next are
+        cancelled.
+        """
+        upcoming = self.controllers.instances[
+            index + 1 : index + 1 + self.prefetch_depth
+        ]
+        names = {controller.name for controller in upcoming}
+        for name in list(self.prefetch_tasks):
+            if name not in names:
+                self.prefetch_tasks.pop(name).cancel()
+        for controller in upcoming:
+            if controller.name not in self.prefetch_tasks:
+                self.prefetch_tasks[controller.name] = asyncio.create_task(
+                    self._prefetch(controller)
+                )
+
     def show_progress(self):
         if hasattr(self.controllers, "Progress"):
             self.ui.set_body(self.controllers.Progress.progress_view)
@@ -14,7 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from typing import Optional
+from typing import Awaitable, List, Optional
 
 from subiquitycore.tuicontroller import TuiController
 
@@ -33,3 +33,12 @@ class SubiquityTuiController(TuiController):
         self.answers = app.answers.get(self.name, {})
         if self.endpoint_name is not None:
             self.endpoint = getattr(self.app.client, self.endpoint_name)
+
+    def prefetch(self) -> List[Awaitable]:
+        """Return the read-only requests make_ui is going to make.
+
+        These are made while an earlier screen is being shown. The API
+        client keeps the responses, so when make_ui makes the same requests
+        the server only has to say that nothing has changed.
+        """
+        return []
@@ -28,6 +28,9 @@ log = logging.getLogger("subiquity.client.controllers.drivers")
 class DriversController(SubiquityTuiController):
     endpoint_name = "drivers"
 
+    def prefetch(self):
+        return [self.endpoint.GET()]
+
     async def make_ui(self) -> DriversView:
         response: DriversResponse = await self.endpoint.GET()
 
@@ -57,6 +57,13 @@ class FilesystemController(SubiquityTuiController, FilesystemManipulator):
         self.answers.setdefault("manual", [])
         self.current_view: Optional[BaseView] = None
 
+    def prefetch(self):
+        return [
+            self.endpoint.supports_nvme_tcp_booting.GET(wait=True),
+            self.endpoint.v2.guided.GET(),
+            self.endpoint.v2.GET(include_raid=True),
+        ]
+
     async def make_ui(self) -> Callable[[], BaseView]:
         def get_current_view() -> BaseView:
             assert self.current_view is not None
@@ -28,6 +28,9 @@ log = logging.getLogger("subiquity.client.controllers.mirror")
 class MirrorController(SubiquityTuiController):
     endpoint_name = "mirror"
 
+    def prefetch(self):
+        return [self.endpoint.GET()]
+
     async def make_ui(self):
         mirror_response: MirrorGet = await self.endpoint.GET()
         if not mirror_response.relevant:
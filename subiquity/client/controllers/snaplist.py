@@ -27,6 +27,9 @@ log = logging.getLogger("subiquity.client.controllers.snaplist")
 class SnapListController(SubiquityTuiController):
     endpoint_name = "snaplist"
 
+    def prefetch(self):
+        return [self.endpoint.GET()]
+
     async def make_ui(self):
         data = await self.endpoint.GET()
         if data.status == SnapCheckState.FAILED:
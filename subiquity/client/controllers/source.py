@@ -25,6 +25,9 @@ log = logging.getLogger("subiquity.client.controllers.source")
 class SourceController(SubiquityTuiController):
     endpoint_name = "source"
 
+    def prefetch(self):
+        return [self.endpoint.GET()]
+
     async def make_ui(self):
         sources = await self.endpoint.GET()
 
@@ -12,9 +12,20 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import os
+from typing import List
 from unittest.mock import Mock
 
+import aiohttp
+from aiohttp import web
+
 from subiquity.client.client import SubiquityClient
+from subiquity.common.api.client import make_client_for_conn
+from subiquity.common.api.defs import api
+from subiquity.common.api.server import bind
+from subiquity.server.server import NOPROBERARG, SubiquityServer
+from subiquitycore.context import Context
 from subiquitycore.tests import SubiTestCase
 
 
@@ -42,3 +53,139 @@ class TestClientVariantSupport(SubiTestCase):
             expected,
             "controllers changed unexpectedly during init",
         )
+
+
+class TestPrefetch(SubiTestCase):
+    async def asyncSetUp(self):
+        opts = Mock()
+        opts.dry_run = True
+        opts.output_base = self.tmp_dir()
+        opts.machine_config = "examples/machines/simple.json"
+        opts.answers = None
+        self.client = SubiquityClient(opts, None)
+        self.requests = []
+        self.client.controllers = Mock()
+        self.client.controllers.instances = [
+            self.make_controller(f"c{i}") for i in range(5)
+        ]
+
+    def make_controller(self, name):
+        async def get():
+            self.requests.append(
+                (
+                    name,
+                    self.client.in_prefetch_cvar.get(),
+                    self.client.in_make_view_cvar.get(),
+                )
+            )
+            await asyncio.Event().wait()
+
+        controller = Mock()
+        controller.name = name
+        controller.prefetch = lambda: [get()]
+        return controller
+
+    async def settle(self):
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    async def test_prefetch(self):
+        self.client.in_make_view_cvar.set(True)
+        self.client.prefetch_after(0)
+        await self.settle()
+        self.assertEqual(self.requests, [("c1", True, False), ("c2", True, False)])
+        tasks = dict(self.client.prefetch_tasks)
+
+        self.requests = []
+        self.client.prefetch_after(1)
+        await self.settle()
+        # c2 is still coming up, so is left alone.
+        self.assertEqual(self.requests, [("c3", True, False)])
+        self.assertIs(self.client.prefetch_tasks["c2"], tasks["c2"])
+        self.assertTrue(tasks["c1"].cancelled())
+        self.assertEqual(set(self.client.prefetch_tasks), {"c2", "c3"})
+
+        self.client.prefetch_after(4)
+        await self.settle()
+        self.assertEqual(self.client.prefetch_tasks, {})
+
+    def test_resp_hook_ignores_prefetch(self):
+        response = Mock()
+        response.headers = {"x-status": "skip"}
+        self.client.in_prefetch_cvar.set(True)
+        self.assertIs(self.client.resp_hook(response), response)
+
+
+@api
+class PrefetchAPI:
+    class things:
+        def GET() -> List[str]:
+            ...
+
+
+class PrefetchController:
+    def __init__(self):
+        self.app = Mock()
+        self.context = Context.new(self.app)
+        self.calls = 0
+
+    async def things_GET(self) -> List[str]:
+        self.calls += 1
+        return ["apple"]
+
+
+class TestPrefetchFromServer(SubiTestCase):
+    async def asyncSetUp(self):
+        server_opts = Mock()
+        server_opts.dry_run = True
+        server_opts.output_base = self.tmp_dir()
+        server_opts.machine_config = NOPROBERARG
+        server = SubiquityServer(server_opts, None)
+        self.controller = PrefetchController()
+        app = web.Application(middlewares=[server.middleware])
+        bind(app.router, PrefetchAPI, self.controller)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        self.addAsyncCleanup(runner.cleanup)
+        socket_path = os.path.join(self.tmp_dir(), "socket")
+        await web.UnixSite(runner, socket_path).start()
+
+        opts = Mock()
+        opts.dry_run = True
+        opts.output_base = self.tmp_dir()
+        opts.machine_config = "examples/machines/simple.json"
+        opts.answers = None
+        self.client = SubiquityClient(opts, None)
+        self.statuses = []
+
+        def resp_hook(response):
+            self.statuses.append(response.status)
+            return self.client.resp_hook(response)
+
+        conn = aiohttp.UnixConnector(socket_path)
+        self.addAsyncCleanup(conn.close)
+        self.api = make_client_for_conn(
+            PrefetchAPI,
+            conn,
+            resp_hook,
+            header_func=self.client.request_headers,
+            use_cache=True,
+        )
+
+    async def test_prefetch_then_get(self):
+        current = Mock()
+        current.name = "current"
+        upcoming = Mock()
+        upcoming.name = "upcoming"
+        upcoming.prefetch = lambda: [self.api.things.GET()]
+        self.client.controllers = Mock()
+        self.client.controllers.instances = [current, upcoming]
+
+        self.client.prefetch_after(0)
+        await self.client.prefetch_tasks["upcoming"]
+        self.client.in_make_view_cvar.set(True)
+        self.assertEqual(["apple"], await self.api.things.GET())
+        # The server answers the real request from the prefetched response.
+        self.assertEqual([200, 304], self.statuses)
+        self.assertEqual(2, self.controller.calls)
+        self.assertEqual("no", self.client.server_updated)
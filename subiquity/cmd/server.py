@@ -183,6 +183,15 @@ The maximum number of seconds to wait for block devices discovery (by default
         dest="block_probing_timeout",
         help="Wait indefinitely for block devices discovery. " "",
     )
+    parser.add_argument(
+        "--udev-quiet-window",
+        type=float,
+        default=0.5,
+        dest="udev_quiet_window",
+        help="""\
+The number of seconds without a new block device udev event to wait for
+before reprobing storage (by default 0.5 seconds).""",
+    )
 
     return parser
 
@@ -254,6 +263,8 @@ def main():
     async def run_with_loop():
         server = SubiquityServer(opts, block_log_dir)
         server.dr_cfg = dr_cfg
+        server.api_metrics_path = os.path.join(logdir, "api-metrics.json")
+        server.note_file_for_apport("APIMetrics", server.api_metrics_path)
         server.note_file_for_apport("InstallerServerLog", logfiles["debug"])
         server.note_file_for_apport("InstallerServerLogInfo", logfiles["info"])
         server.note_file_for_apport(
@@ -15,15 +15,22 @@
 
 import contextlib
 import inspect
+import json
 
 import aiohttp
 
 from subiquity.common.serialize import Serializer
 
+from . import wire
 from .defs import Payload
 
 
-def _wrap(make_request, path, meth, serializer, serialize_query_args):
+def _wrap(make_request, path, meth, serializer, serialize_query_args, use_msgpack):
+    compact_serializer = serializer.as_compact()
+    if use_msgpack:
+        payload_serializer = compact_serializer
+    else:
+        payload_serializer = serializer
     sig = inspect.signature(meth)
     meth_params = sig.parameters
     payload_arg = None
@@ -39,7 +46,7 @@ def _wrap(make_request, path, meth, serializer, serialize_query_args):
         data = None
         for arg_name, value in args.arguments.items():
             if arg_name == payload_arg:
-                data = serializer.serialize(payload_ann, value)
+                data = payload_serializer.serialize(payload_ann, value)
             else:
                 if serialize_query_args:
                     value = serializer.to_json(meth_params[arg_name].annotation, value)
@@ -48,13 +55,17 @@ def _wrap(make_request, path, meth, serializer, serialize_query_args):
             meth.__name__, path.format(**self.path_args), json=data, params=query_args
         ) as resp:
             resp.raise_for_status()
+            if use_msgpack and resp.content_type == wire.MSGPACK:
+                return compact_serializer.deserialize(
+                    r_ann, wire.unpack(await resp.read())
+                )
             return serializer.deserialize(r_ann, await resp.json())
 
     return impl
 
 
-def make_getitem(endpoint_cls, make_request, serializer):
-    cls = make_client_cls(endpoint_cls, make_request, serializer)
+def make_getitem(endpoint_cls, make_request, serializer, use_msgpack):
+    cls = make_client_cls(endpoint_cls, make_request, serializer, use_msgpack)
 
     def gi(self, item):
         new_args = self.path_args.copy()
@@ -70,7 +81,14 @@ def client_init(self, path_args=None):
     self.path_args = path_args
 
 
-def make_client_cls(endpoint_cls, make_request, serializer=None):
+def make_client_cls(endpoint_cls, make_request, serializer=None, use_msgpack=False):
+    """Make a client class for endpoint_cls.
+
+    If use_msgpack is true, payloads are serialized in the compact layout
+    and make_request must send them as msgpack and ask for msgpack back
+    (see wire.py). The server may still reply with JSON, so responses are
+    decoded according to their Content-Type.
+    """
     if serializer is None:
         serializer = Serializer()
 
@@ -79,9 +97,13 @@ def make_client_cls(endpoint_cls, make_request, serializer=None):
     for k, v in endpoint_cls.__dict__.items():
         if isinstance(v, type):
             if getattr(v, "__parameter__", False):
-                ns["__getitem__"] = make_getitem(v, make_request, serializer)
+                ns["__getitem__"] = make_getitem(
+                    v, make_request, serializer, use_msgpack
+                )
             else:
-                ns[k] = make_client(v, make_request, serializer)
+                ns[k] = make_client(
+                    v, make_request, serializer, use_msgpack=use_msgpack
+                )
         elif callable(v):
             ns[k] = _wrap(
                 make_request,
@@ -89,19 +111,58 @@ def make_client_cls(endpoint_cls, make_request, serializer=None):
                 v,
                 serializer,
                 endpoint_cls.serialize_query_args,
+                use_msgpack,
             )
 
     return type("ClientFor({})".format(endpoint_cls.__name__), (object,), ns)
 
 
-def make_client(endpoint_cls, make_request, serializer=None, path_args=None):
-    return make_client_cls(endpoint_cls, make_request, serializer)(path_args)
+def make_client(
+    endpoint_cls, make_request, serializer=None, path_args=None, *, use_msgpack=False
+):
+    return make_client_cls(endpoint_cls, make_request, serializer, use_msgpack)(
+        path_args
+    )
+
+
+class _CachedResponse:
+    """Stands in for a "304 Not Modified" response, with the body of the
+    earlier response it says is still current."""
+
+    def __init__(self, response, content_type, body):
+        self.headers = response.headers
+        self.content_type = content_type
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    async def read(self):
+        return self.body
+
+    async def json(self):
+        return json.loads(self.body)
 
 
 def make_client_for_conn(
-    endpoint_cls, conn, resp_hook=lambda r: r, serializer=None, header_func=None
+    endpoint_cls,
+    conn,
+    resp_hook=lambda r: r,
+    serializer=None,
+    header_func=None,
+    use_msgpack=False,
+    use_cache=False,
 ):
+    """Make a client for endpoint_cls that makes requests over conn.
+
+    If use_cache is true, the responses to GET requests are kept, keyed
+    on their path and query, along with the ETag the server sent. When
+    the same request is made again the ETag is sent back and if the
+    response would be the same the server says so rather than sending
+    it again.
+    """
     session = aiohttp.ClientSession(connector=conn, connector_owner=False)
+    cache = {}
 
     @contextlib.asynccontextmanager
     async def make_request(method, path, *, params, json):
@@ -115,9 +176,41 @@ def make_client_for_conn(
             headers = header_func()
         else:
             headers = None
+        data = None
+        if use_msgpack:
+            headers = {"Accept": wire.MSGPACK, **(headers or {})}
+            if json is not None:
+                headers["Content-Type"] = wire.MSGPACK
+                data, json = wire.pack(json), None
+        key = cached = None
+        if use_cache and method == "GET":
+            key = (path, tuple(sorted(params.items())), use_msgpack)
+            cached = cache.get(key)
+            if cached is not None:
+                headers = {"If-None-Match": cached[0], **(headers or {})}
         async with session.request(
-            method, url, json=json, params=params, headers=headers, timeout=0
+            method,
+            url,
+            json=json,
+            data=data,
+            params=params,
+            headers=headers,
+            timeout=0,
         ) as response:
-            yield resp_hook(response)
-
-    return make_client(endpoint_cls, make_request, serializer)
+            response = resp_hook(response)
+            if key is None:
+                yield response
+            elif response.status == 304 and cached is not None:
+                yield _CachedResponse(response, cached[1], cached[2])
+            else:
+                if response.status == 200 and response.headers.get("ETag"):
+                    cache[key] = (
+                        response.headers["ETag"],
+                        response.content_type,
+                        await response.read(),
+                    )
+                else:
+                    cache.pop(key, None)
+                yield response
+
+    return make_client(endpoint_cls, make_request, serializer, use_msgpack=use_msgpack)
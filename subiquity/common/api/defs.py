@@ -118,3 +118,12 @@ def allowed_before_start(fun):
     want this."""
     fun.allowed_before_start = True
     return fun
+
+
+def not_coalesced(fun):
+    """Concurrent identical GET requests share the response of a single
+    call to the implementation, unless the endpoint is marked as
+    not_coalesced. Endpoints whose response is meant to differ from one
+    call to the next need this."""
+    fun.not_coalesced = True
+    return fun
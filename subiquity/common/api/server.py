@@ -13,17 +13,22 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import hashlib
 import inspect
 import json
 import logging
 import os
+import time
 import traceback
+from typing import Optional
 
 from aiohttp import web
 
 from subiquity.common.api.recoverable_error import RecoverableError
 from subiquity.common.serialize import Serializer
 
+from . import wire
 from .defs import Payload
 
 log = logging.getLogger("subiquity.common.api.server")
@@ -135,38 +140,59 @@ def _make_handler(
             definition.__qualname__, check_def_sig, check_impl_sig
         )
 
-    async def handler(request):
+    bind_args = _make_binder(
+        definition,
+        impl_params,
+        data_arg,
+        data_annotation,
+        query_args_anns,
+        serializer,
+        serialize_query_args,
+    )
+    to_json = serializer.serializer_for(def_ret_ann)
+    to_compact = serializer.as_compact().serializer_for(def_ret_ann)
+    is_get = definition.__name__ == "GET"
+    # Once the controllers have started there is nothing to wait for, so
+    # this is cleared the first time a request finds they have.
+    must_wait = hasattr(controller, "app") and not getattr(
+        definition, "allowed_before_start", False
+    )
+
+    async def respond(request, **bind_kw):
+        nonlocal must_wait
         context = controller.context.child(implementation.__name__)
         with context:
             context.set("request", request)
-            args = {}
+            description = None
+            # How long each part of handling the request took, for
+            # subiquity.server.api_metrics.
+            timings = {}
             try:
-                if data_annotation is not None:
-                    args[data_arg] = serializer.from_json(
-                        data_annotation, await request.text()
-                    )
-                for arg, ann, default in query_args_anns:
-                    if arg in request.query:
-                        v = request.query[arg]
-                        if serialize_query_args:
-                            v = serializer.from_json(ann, v)
-                    elif default != inspect._empty:
-                        v = default
-                    else:
-                        raise TypeError('missing required argument "{}"'.format(arg))
-                    args[arg] = v
-                for param_name in definition.__path_params__:
-                    args[param_name] = request.match_info[param_name]
-                if "context" in impl_params:
-                    args["context"] = context
-                if "request" in impl_params:
-                    args["request"] = request
-                await check_controllers_started(definition, controller, request)
+                args = await bind_args(request, context, **bind_kw)
+                start = time.perf_counter()
+                if must_wait:
+                    await check_controllers_started(definition, controller, request)
+                    must_wait = not controller.app.controllers_have_started.is_set()
+                timings["wait_for_start"] = time.perf_counter() - start
+                start = time.perf_counter()
                 result = await implementation(**args)
-                resp = web.json_response(
-                    serializer.serialize(def_ret_ann, result),
-                    headers={"x-status": "ok"},
-                )
+                timings["implementation"] = time.perf_counter() - start
+                start = time.perf_counter()
+                if wire.accepts_msgpack(request):
+                    body = wire.pack(to_compact(result))
+                    resp = web.Response(
+                        body=body,
+                        content_type=wire.MSGPACK,
+                        headers={"x-status": "ok"},
+                    )
+                    description = f"({len(body)} bytes of msgpack)"
+                else:
+                    resp = web.json_response(
+                        to_json(result), headers={"x-status": "ok"}
+                    )
+                timings["serialization"] = time.perf_counter() - start
+                if is_get:
+                    resp.etag = hashlib.blake2b(resp.body, digest_size=16).hexdigest()
             except Exception as exc:
                 tb = traceback.TracebackException.from_exception(exc)
                 resp = web.Response(
@@ -182,14 +208,180 @@ def _make_handler(
                     },
                 )
                 resp["exception"] = exc
-            context.description = "{} {}".format(resp.status, trim(resp.text))
+            resp["timings"] = timings
+            if description is None:
+                description = trim(resp.text)
+            context.description = "{} {}".format(resp.status, description)
             return resp
 
+    handler = respond
+    if is_get:
+        if (
+            data_annotation is None
+            and "request" not in impl_params
+            and not getattr(definition, "not_coalesced", False)
+        ):
+            handler = _coalesced(handler)
+        handler = _conditional(handler)
+
     handler.controller = controller
 
     return handler
 
 
+# Passed as the payload to bind_args to read it from the request.
+_FROM_REQUEST = object()
+
+
+def _make_binder(
+    definition,
+    impl_params,
+    data_arg,
+    data_annotation,
+    query_args_anns,
+    serializer,
+    serialize_query_args,
+):
+    """Return a coroutine function that takes a request and its context
+    and returns the arguments to pass to the implementation of
+    definition.
+
+    The payload is read from the request unless it is passed, already
+    decoded from JSON, as payload, and the path parameters are taken from
+    match_info if it is passed (see subiquity.server.batch).
+
+    Everything that does not depend on the request, like which codec
+    decodes each argument, is worked out here, once."""
+    query_args = []
+    for name, annotation, default in query_args_anns:
+        if serialize_query_args:
+            decode = _json_decoder(serializer.deserializer_for(annotation))
+        else:
+            decode = None
+        query_args.append((name, decode, default))
+    path_params = definition.__path_params__
+    pass_context = "context" in impl_params
+    pass_request = "request" in impl_params
+    if data_annotation is not None:
+        payload_from_json = serializer.deserializer_for(data_annotation)
+        payload_from_compact = serializer.as_compact().deserializer_for(data_annotation)
+
+    async def bind_args(request, context, *, payload=_FROM_REQUEST, match_info=None):
+        args = {}
+        if data_annotation is not None:
+            if payload is not _FROM_REQUEST:
+                args[data_arg] = payload_from_json(payload)
+            elif request.content_type == wire.MSGPACK:
+                args[data_arg] = payload_from_compact(wire.unpack(await request.read()))
+            else:
+                args[data_arg] = payload_from_json(json.loads(await request.text()))
+        query = request.query
+        for name, decode, default in query_args:
+            if name in query:
+                value = query[name]
+                if decode is not None:
+                    value = decode(value)
+            elif default is not inspect.Parameter.empty:
+                value = default
+            else:
+                raise TypeError('missing required argument "{}"'.format(name))
+            args[name] = value
+        if path_params:
+            if match_info is None:
+                match_info = request.match_info
+            for name in path_params:
+                args[name] = match_info[name]
+        if pass_context:
+            args["context"] = context
+        if pass_request:
+            args["request"] = request
+        return args
+
+    return bind_args
+
+
+def _json_decoder(deserialize):
+    def decode(value):
+        return deserialize(json.loads(value))
+
+    return decode
+
+
+class SharedError:
+    """The failure behind the responses to coalesced requests.
+
+    Only the response to the request that started the call has the
+    exception in resp["exception"]; the others have this in
+    resp["shared_error"], so that the failure is reported once and every
+    response can refer to the same report."""
+
+    def __init__(self, exception: Exception):
+        self.exception = exception
+        # The x-error-report header, once the failure has been reported.
+        self.report_ref: Optional[str] = None
+
+
+def _coalesced(respond):
+    in_flight = {}
+
+    async def handler(request, **bind_kw):
+        # Identical requests that come in while one is being handled share
+        # its response.
+        key = (
+            request.path,
+            tuple(sorted(request.query.items())),
+            wire.accepts_msgpack(request),
+        )
+        task = in_flight.get(key)
+        started = task is None
+        if started:
+            task = in_flight[key] = asyncio.ensure_future(respond(request, **bind_kw))
+            task.add_done_callback(lambda t: in_flight.pop(key))
+        # The request that started the call going away should not stop the
+        # others getting the response.
+        return _copy_response(await asyncio.shield(task), started)
+
+    return handler
+
+
+def _conditional(respond):
+    async def handler(request, **bind_kw):
+        # A client that already has the response, going by its ETag, just
+        # gets told so.
+        resp = await respond(request, **bind_kw)
+        if resp.etag is None or resp.etag.value not in _if_none_match(request):
+            return resp
+        not_modified = web.Response(status=304, headers={"x-status": "ok"})
+        not_modified.etag = resp.etag
+        # Only the timings carry over: the 304 has no body, and a response
+        # with an ETag is not a failure.
+        not_modified["timings"] = resp["timings"]
+        return not_modified
+
+    return handler
+
+
+def _if_none_match(request):
+    if request.if_none_match is None:
+        return ()
+    return {etag.value for etag in request.if_none_match}
+
+
+def _copy_response(resp, started):
+    # Middleware modifies the response, so each request needs its own.
+    copy = web.Response(body=resp.body, status=resp.status, headers=resp.headers)
+    copy.update(resp)
+    exc = resp.get("exception")
+    if exc is not None:
+        shared = resp.get("shared_error")
+        if shared is None:
+            shared = resp["shared_error"] = SharedError(exc)
+        copy["shared_error"] = shared
+        if not started:
+            del copy["exception"]
+    return copy
+
+
 async def controller_for_request(request):
     match_info = await request.app.router.resolve(request)
     return getattr(match_info.handler, "controller", None)
@@ -15,19 +15,24 @@
 
 import contextlib
 import functools
+import os
+import tempfile
+import typing
 import unittest
 
 import aiohttp
 import attr
 from aiohttp import web
 
-from subiquity.common.api.client import make_client
+from subiquity.common.api import wire
+from subiquity.common.api.client import make_client, make_client_for_conn
 from subiquity.common.api.defs import (
     MultiplePathParameters,
     Payload,
     api,
     path_parameter,
 )
+from subiquity.common.api.server import bind
 
 from .test_server import ControllerBase, makeTestClient
 
@@ -36,11 +41,24 @@ def make_request(client, method, path, *, params, json):
     return client.request(method, path, params=params, json=json)
 
 
+def make_msgpack_request(client, method, path, *, params, json):
+    headers = {"Accept": wire.MSGPACK}
+    data = None
+    if json is not None:
+        headers["Content-Type"] = wire.MSGPACK
+        data = wire.pack(json)
+    return client.request(method, path, params=params, data=data, headers=headers)
+
+
 @contextlib.asynccontextmanager
-async def makeE2EClient(api, impl, *, middlewares=(), make_request=make_request):
+async def makeE2EClient(
+    api, impl, *, middlewares=(), make_request=make_request, use_msgpack=False
+):
+    if use_msgpack:
+        make_request = make_msgpack_request
     async with makeTestClient(api, impl, middlewares=middlewares) as client:
         mr = functools.partial(make_request, client)
-        yield make_client(api, mr)
+        yield make_client(api, mr, use_msgpack=use_msgpack)
 
 
 class TestEndToEnd(unittest.IsolatedAsyncioTestCase):
@@ -170,6 +188,35 @@ class TestEndToEnd(unittest.IsolatedAsyncioTestCase):
             out = await client.doubler.POST(In(3))
             self.assertEqual(out.doubled, 6)
 
+    @unittest.skipUnless(wire.have_msgpack(), "msgpack not available")
+    async def test_msgpack(self):
+        @attr.s(auto_attribs=True)
+        class In:
+            val: int
+            names: typing.List[str]
+
+        @attr.s(auto_attribs=True)
+        class Out:
+            doubled: int
+            names: typing.Dict[str, int]
+
+        @api
+        class API:
+            class doubler:
+                def POST(data: Payload[In], scale: int = 1) -> Out:
+                    ...
+
+        class Impl(ControllerBase):
+            async def doubler_POST(self, data: In, scale: int = 1) -> Out:
+                return Out(
+                    doubled=data.val * 2 * scale,
+                    names={n: i for i, n in enumerate(data.names)},
+                )
+
+        async with makeE2EClient(API, Impl(), use_msgpack=True) as client:
+            out = await client.doubler.POST(In(3, ["a", "b"]), scale=2)
+            self.assertEqual(out, Out(doubled=12, names={"a": 0, "b": 1}))
+
     async def test_middleware(self):
         @api
         class API:
@@ -270,3 +317,57 @@ class TestEndToEnd(unittest.IsolatedAsyncioTestCase):
             self.assertEqual(r, 3)
             with self.assertRaises(Abort):
                 await client.bad.GET(2)
+
+
+class TestClientCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        @api
+        class API:
+            def GET(arg: int) -> typing.List[int]:
+                ...
+
+        class Impl(ControllerBase):
+            value = [1, 2]
+
+            async def GET(self, arg: int) -> typing.List[int]:
+                return self.value + [arg]
+
+        self.API = API
+        self.impl = Impl()
+        app = web.Application()
+        bind(app.router, API, self.impl)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        self.addAsyncCleanup(runner.cleanup)
+        tdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tdir.cleanup)
+        self.socket_path = os.path.join(tdir.name, "socket")
+        await web.UnixSite(runner, self.socket_path).start()
+
+    async def make_client(self, **kw):
+        self.statuses = []
+
+        def resp_hook(resp):
+            self.statuses.append(resp.status)
+            return resp
+
+        conn = aiohttp.UnixConnector(self.socket_path)
+        self.addAsyncCleanup(conn.close)
+        return make_client_for_conn(self.API, conn, resp_hook, use_cache=True, **kw)
+
+    async def check_cache(self, client):
+        self.assertEqual(await client.GET(arg=3), [1, 2, 3])
+        self.assertEqual(await client.GET(arg=3), [1, 2, 3])
+        self.assertEqual(await client.GET(arg=4), [1, 2, 4])
+        self.assertEqual(self.statuses, [200, 304, 200])
+        self.impl.value = [5]
+        self.assertEqual(await client.GET(arg=3), [5, 3])
+        self.assertEqual(await client.GET(arg=3), [5, 3])
+        self.assertEqual(self.statuses, [200, 304, 200, 200, 304])
+
+    async def test_cache(self):
+        await self.check_cache(await self.make_client())
+
+    @unittest.skipUnless(wire.have_msgpack(), "msgpack not available")
+    async def test_cache_msgpack(self):
+        await self.check_cache(await self.make_client(use_msgpack=True))
@@ -13,14 +13,23 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import contextlib
 import unittest
 from unittest import mock
 
+import attr
 from aiohttp import web
 from aiohttp.test_utils import TestClient, TestServer
 
-from subiquity.common.api.defs import Payload, allowed_before_start, api, path_parameter
+from subiquity.common.api import wire
+from subiquity.common.api.defs import (
+    Payload,
+    allowed_before_start,
+    api,
+    not_coalesced,
+    path_parameter,
+)
 from subiquity.common.api.server import (
     MissingImplementationError,
     SignatureMisatchError,
@@ -154,6 +163,37 @@ class TestBind(unittest.IsolatedAsyncioTestCase):
         async with makeTestClient(API, Impl()) as client:
             await self.assertResponse(client.post("/", json="value"), "value")
 
+    @unittest.skipUnless(wire.have_msgpack(), "msgpack not available")
+    async def test_msgpack(self):
+        @attr.s(auto_attribs=True)
+        class In:
+            val: int
+
+        @attr.s(auto_attribs=True)
+        class Out:
+            doubled: int
+
+        @api
+        class API:
+            def POST(data: Payload[In]) -> Out:
+                ...
+
+        class Impl(ControllerBase):
+            async def POST(self, data: In) -> Out:
+                return Out(doubled=data.val * 2)
+
+        async with makeTestClient(API, Impl()) as client:
+            resp = await client.post(
+                "/",
+                data=wire.pack([3]),
+                headers={"Accept": wire.MSGPACK, "Content-Type": wire.MSGPACK},
+            )
+            self.assertEqual(resp.status, 200)
+            self.assertEqual(resp.content_type, wire.MSGPACK)
+            self.assertEqual(wire.unpack(await resp.read()), [6])
+            # JSON is still the default.
+            await self.assertResponse(client.post("/", json={"val": 3}), {"doubled": 6})
+
     def test_missing_method(self):
         @api
         class API:
@@ -322,3 +362,102 @@ class TestBind(unittest.IsolatedAsyncioTestCase):
         async with makeTestClient(API, impl) as client:
             await client.get("/must_not_be_used_early")
             impl.app.controllers_have_started.wait.assert_called_once()
+
+    async def test_coalesce(self):
+        @api
+        class API:
+            def GET(arg: int) -> int:
+                ...
+
+        class Impl(ControllerBase):
+            calls = 0
+
+            async def GET(self, arg: int) -> int:
+                self.calls += 1
+                await asyncio.sleep(0.01)
+                return arg
+
+        impl = Impl()
+        async with makeTestClient(API, impl) as client:
+            resps = await asyncio.gather(
+                client.get("/?arg=1"), client.get("/?arg=1"), client.get("/?arg=2")
+            )
+            self.assertEqual(impl.calls, 2)
+            self.assertEqual([await resp.json() for resp in resps], [1, 1, 2])
+            # Only requests that overlap share a call.
+            await self.assertResponse(client.get("/?arg=1"), 1)
+            self.assertEqual(impl.calls, 3)
+
+    async def test_coalesce_error(self):
+        @api
+        class API:
+            def GET():
+                ...
+
+        class Impl(ControllerBase):
+            calls = 0
+
+            async def GET(self):
+                self.calls += 1
+                await asyncio.sleep(0.01)
+                return 1 / 0
+
+        impl = Impl()
+        async with makeTestClient(API, impl) as client:
+            resps = await asyncio.gather(client.get("/"), client.get("/"))
+            self.assertEqual(impl.calls, 1)
+            for resp in resps:
+                self.assertEqual(resp.status, 500)
+                self.assertEqual(resp.headers["x-error-type"], "ZeroDivisionError")
+
+    async def test_not_coalesced(self):
+        @api
+        class API:
+            @not_coalesced
+            def GET() -> int:
+                ...
+
+        class Impl(ControllerBase):
+            calls = 0
+
+            async def GET(self) -> int:
+                self.calls += 1
+                call = self.calls
+                await asyncio.sleep(0.01)
+                return call
+
+        impl = Impl()
+        async with makeTestClient(API, impl) as client:
+            resps = await asyncio.gather(client.get("/"), client.get("/"))
+            self.assertEqual(impl.calls, 2)
+            self.assertEqual(sorted([await resp.json() for resp in resps]), [1, 2])
+
+    async def test_start_checked_until_started(self):
+        @api
+        class API:
+            def POST() -> None:
+                ...
+
+        class Impl(ControllerBase):
+            def __init__(self):
+                super().__init__()
+                self.app.controllers_have_started = mock.AsyncMock()
+                self.app.controllers_have_started.is_set = mock.Mock(return_value=False)
+
+            async def POST(self) -> None:
+                pass
+
+        impl = Impl()
+        started = impl.app.controllers_have_started
+        async with makeTestClient(API, impl) as client:
+            await client.post("/")
+            started.wait.assert_called_once()
+            await client.post("/")
+            self.assertEqual(started.wait.call_count, 2)
+            started.is_set.return_value = True
+            await client.post("/")
+            self.assertEqual(started.wait.call_count, 2)
+            # Once they have started, there is no need to look again.
+            started.is_set.reset_mock()
+            await client.post("/")
+            started.is_set.assert_not_called()
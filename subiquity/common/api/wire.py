@@ -0,0 +1,50 @@
+# Copyright 2025 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The binary wire format for the API.
+
+Requests and responses are JSON unless the client asks otherwise. A
+client that sends "Accept: application/msgpack" gets msgpack back, and
+a request body can be sent as msgpack by setting the Content-Type. In
+both cases values are serialized with a compact Serializer, so attr
+classes are sent as lists of their fields rather than as dicts.
+
+This is only available if the msgpack module is installed.
+"""
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK = "application/msgpack"
+
+
+def have_msgpack():
+    return msgpack is not None
+
+
+def accepts_msgpack(request):
+    return have_msgpack() and MSGPACK in request.headers.get("Accept", "")
+
+
+def pack(data):
+    return msgpack.packb(data)
+
+
+def unpack(data):
+    # JSON would have turned integer keys into strings, msgpack keeps
+    # them, so allow them back in.
+    return msgpack.unpackb(data, strict_map_key=False)
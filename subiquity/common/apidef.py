@@ -20,6 +20,7 @@ from subiquity.common.api.defs import (
     Payload,
     allowed_before_start,
     api,
+    not_coalesced,
     simple_endpoint,
 )
 from subiquity.common.types import (
@@ -50,6 +51,7 @@ from subiquity.common.types import (
     OEMResponse,
     PackageInstallState,
     RefreshStatus,
+    RouteMetrics,
     ShutdownMode,
     SnapInfo,
     SnapListResponse,
@@ -75,6 +77,7 @@ from subiquity.common.types.storage import (
     GuidedStorageResponseV2,
     ModifyPartitionV2,
     ReformatDisk,
+    RenderCacheStats,
     StorageResponse,
     StorageResponseV2,
 )
@@ -138,6 +141,12 @@ class API:
             def GET() -> Optional[List[str]]:
                 ...
 
+        class metrics:
+            @allowed_before_start
+            def GET() -> List[RouteMetrics]:
+                """Get histograms of the time spent handling requests to each
+                route and of the size of the responses."""
+
     class errors:
         class wait:
             def GET(error_ref: ErrorReportRef) -> ErrorReportRef:
@@ -322,9 +331,15 @@ class API:
                 ...
 
         class generate_recovery_key:
+            @not_coalesced
             def GET() -> str:
                 ...
 
+        class render_cache:
+            def GET() -> RenderCacheStats:
+                """Get how often rendering the storage config was answered
+                from the cache."""
+
         class supports_nvme_tcp_booting:
             def GET(wait: bool = False) -> Optional[bool]:
                 """Tells whether the firmware supports booting with NVMe/TCP.
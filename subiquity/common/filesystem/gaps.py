@@ -95,6 +95,35 @@ def parts_and_gaps(device, ignore_disk_fs=False):
     raise NotImplementedError(device)
 
 
+def _cached(func):
+    """Cache the result of func(device, ignore_disk_fs) in the device's model.
+
+    The layout of a device only changes when the model does, and every
+    change to the model (adding, removing or resizing a partition, changing
+    a ptable, ...) bumps its generation, so the whole cache is dropped when
+    the generation changes. Ephemeral copies of devices, which can be
+    changed without the model noticing, are not cached.
+    """
+
+    @functools.wraps(func)
+    def wrapper(device, ignore_disk_fs=False):
+        m = device._m
+        if m is None or m._actions.is_copy(device):
+            return func(device, ignore_disk_fs)
+        generation, cache = m._gaps_cache
+        if generation != m.generation:
+            cache = {}
+            m._gaps_cache = (m.generation, cache)
+        key = (device, ignore_disk_fs, m.storage_version)
+        result = cache.get(key)
+        if result is None:
+            result = cache[key] = func(device, ignore_disk_fs)
+        # Callers are free to modify the list they get.
+        return list(result)
+
+    return wrapper
+
+
 def remaining_primary_partitions(device, info):
     primaries = [p for p in device.partitions() if not p.is_logical]
     return info.primary_part_limit - len(primaries)
@@ -194,6 +223,7 @@ def find_disk_gaps_v2(device, info=None):
 
 @parts_and_gaps.register(Disk)
 @parts_and_gaps.register(Raid)
+@_cached
 def parts_and_gaps_disk(device, ignore_disk_fs=False):
     if device._fs is not None and not ignore_disk_fs:
         return []
@@ -206,6 +236,7 @@ def parts_and_gaps_disk(device, ignore_disk_fs=False):
 
 
 @parts_and_gaps.register(LVM_VolGroup)
+@_cached
 def _parts_and_gaps_vg(device, ignore_disk_fs=False):
     used = 0
     r = []
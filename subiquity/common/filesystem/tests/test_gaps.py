@@ -102,6 +102,55 @@ class TestGaps(unittest.TestCase):
         self.assertEqual([p1, p2, p3], gaps.parts_and_gaps(disk))
 
 
+class TestGapCache(unittest.TestCase):
+    def setUp(self):
+        self.model, self.disk = make_model_and_disk(storage_version=2, size=100 << 30)
+        self.part = make_partition(self.model, self.disk, size=10 << 30)
+        p = mock.patch.object(gaps, "find_disk_gaps_v2", wraps=gaps.find_disk_gaps_v2)
+        self.find_disk_gaps_v2 = p.start()
+        self.addCleanup(p.stop)
+
+    def test_cached(self):
+        pgs = gaps.parts_and_gaps(self.disk)
+        pgs.append("modified")
+        self.assertEqual(pgs[:-1], gaps.parts_and_gaps(self.disk))
+        gaps.largest_gap(self.disk)
+        gaps.at_offset(self.disk, pgs[1].offset)
+        self.find_disk_gaps_v2.assert_called_once()
+
+    def test_add_partition(self):
+        [_, gap] = gaps.parts_and_gaps(self.disk)
+        part = self.model.add_partition(self.disk, size=MiB, offset=gap.offset)
+        self.assertEqual(
+            [self.part, part, gap.split(MiB)[1]], gaps.parts_and_gaps(self.disk)
+        )
+
+    def test_remove_partition(self):
+        gaps.parts_and_gaps(self.disk)
+        self.model.remove_partition(self.part)
+        [gap] = gaps.parts_and_gaps(self.disk)
+        self.assertEqual(MiB, gap.offset)
+
+    def test_resize(self):
+        [_, gap1] = gaps.parts_and_gaps(self.disk)
+        self.part.size -= 5 << 30
+        [_, gap2] = gaps.parts_and_gaps(self.disk)
+        self.assertEqual(gap1.offset - (5 << 30), gap2.offset)
+
+    def test_storage_version(self):
+        self.model.storage_version = 1
+        gaps.parts_and_gaps(self.disk)
+        self.model.storage_version = 2
+        gaps.parts_and_gaps(self.disk)
+        self.find_disk_gaps_v2.assert_called_once()
+
+    def test_copies_not_cached(self):
+        gaps.parts_and_gaps(self.disk)
+        [gap] = gaps.parts_and_gaps(self.disk._reformatted())
+        self.assertEqual(MiB, gap.offset)
+        self.assertEqual(2, len(gaps.parts_and_gaps(self.disk)))
+
+
 class TestSplitGap(GapTestCase):
     def test_equal(self):
         [gap] = gaps.parts_and_gaps(make_disk())
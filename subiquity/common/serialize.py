@@ -15,6 +15,7 @@
 
 import datetime
 import enum
+import functools
 import inspect
 import json
 import typing
@@ -81,7 +82,38 @@ class SerializationContext:
 _enum_has_str_values = {}
 
 
+def _current(context):
+    return context.cur
+
+
+class _Mismatch(Exception):
+    """Raised by the fast codecs when a value does not fit its annotation."""
+
+
+def _fast_current(cur, metadata):
+    return cur
+
+
+def _fast_mismatch(cur, metadata):
+    raise _Mismatch
+
+
 class Serializer:
+    """Convert between instances of annotated types and JSON-able data.
+
+    The first time a type is met, it is compiled into a pair of functions
+    that (de)serialize a value of that type given its SerializationContext.
+    These are cached on the Serializer, so looking at an annotation only
+    happens once rather than for every value.
+
+    Keeping track of the path to the current value is only needed to
+    report errors, so each type is compiled a second time into functions
+    that just take the value (and field metadata) and raise _Mismatch
+    where the other version would report an error.  These are tried
+    first, and only if they fail is the value walked again with a
+    SerializationContext, to produce the error.
+    """
+
     def __init__(
         self, *, compact=False, ignore_unknown_fields=False, serialize_enums_by="name"
     ):
@@ -89,13 +121,21 @@ class Serializer:
         self.ignore_unknown_fields = ignore_unknown_fields
         assert serialize_enums_by in ("value", "name")
         self.serialize_enums_by = serialize_enums_by
-        self.typing_walkers = {
-            typing.Union: self._walk_Union,
-            list: self._walk_List,
-            typing.List: self._walk_List,
-            dict: self._walk_Dict,
-            typing.Dict: self._walk_Dict,
-            NonExhaustive: self._walk_NonExhaustive,
+        self.typing_compilers = {
+            typing.Union: self._compile_Union,
+            list: self._compile_List,
+            typing.List: self._compile_List,
+            dict: self._compile_Dict,
+            typing.Dict: self._compile_Dict,
+            NonExhaustive: self._compile_NonExhaustive,
+        }
+        self.fast_typing_compilers = {
+            typing.Union: self._compile_fast_Union,
+            list: self._compile_fast_List,
+            typing.List: self._compile_fast_List,
+            dict: self._compile_fast_Dict,
+            typing.Dict: self._compile_fast_Dict,
+            NonExhaustive: self._compile_fast_NonExhaustive,
         }
         self.type_serializers = {}
         self.type_deserializers = {}
@@ -106,6 +146,23 @@ class Serializer:
         self.type_deserializers[dict] = self._scalar
         self.type_serializers[datetime.datetime] = self._serialize_datetime
         self.type_deserializers[datetime.datetime] = self._deserialize_datetime
+        self._serializers = {}
+        self._deserializers = {}
+        self._fast_serializers = {}
+        self._fast_deserializers = {}
+        self._compact_serializer = None
+
+    def as_compact(self):
+        """Return a compact Serializer with the same options as this one."""
+        if self.compact:
+            return self
+        if self._compact_serializer is None:
+            self._compact_serializer = Serializer(
+                compact=True,
+                ignore_unknown_fields=self.ignore_unknown_fields,
+                serialize_enums_by=self.serialize_enums_by,
+            )
+        return self._compact_serializer
 
     def _ann_ok_as_dict_key(self, annotation):
         if annotation is str:
@@ -125,80 +182,184 @@ class Serializer:
         else:
             return False
 
+    def _codec(self, annotation, serializing):
+        codecs = self._serializers if serializing else self._deserializers
+        try:
+            return codecs[annotation]
+        except KeyError:
+            pass
+        except TypeError:
+            # Not hashable, so cannot be cached.
+            return self._compile(annotation, serializing)
+        try:
+            codec = self._compile(annotation, serializing)
+        except Exception:
+            # Only fail when a value of this type is actually met, as we
+            # would have if we had not looked at the annotation in advance.
+            def codec(context):
+                return self._compile(annotation, serializing)(context)
+
+        codecs[annotation] = codec
+        return codec
+
+    def _compile(self, annotation, serializing):
+        if annotation is None:
+
+            def codec(context):
+                context.assert_type(type(None))
+                return None
+
+            return codec
+        if annotation is inspect.Signature.empty or annotation is typing.Any:
+            return _current
+        if attr.has(annotation):
+            if serializing:
+                return self._compile_serialize_attr(annotation)
+            else:
+                return self._compile_deserialize_attr(annotation)
+        origin = getattr(annotation, "__origin__", None)
+        if origin is not None:
+            try:
+                compiler = self.typing_compilers[origin]
+            except KeyError:
+
+                def codec(context):
+                    raise KeyError(origin)
+
+                return codec
+            return compiler(annotation.__args__, serializing)
+        if isinstance(annotation, type) and issubclass(annotation, enum.Enum):
+            if serializing:
+                return self._compile_serialize_enum(annotation)
+            else:
+                return self._compile_deserialize_enum(annotation)
+        if serializing:
+            try:
+                serializer = self.type_serializers[annotation]
+            except KeyError:
+
+                def codec(context):
+                    context.error(f"do not know how to handle {annotation}")
+
+                return codec
+        else:
+            try:
+                serializer = self.type_deserializers[annotation]
+            except KeyError:
+
+                def codec(context):
+                    raise KeyError(annotation)
+
+                return codec
+        return functools.partial(serializer, annotation)
+
     def _scalar(self, annotation, context):
         context.assert_type(annotation)
         return context.cur
 
-    def _walk_Union(self, meth, args, context):
+    def _compile_Union(self, args, serializing):
         NoneType = type(None)
         if NoneType in args:
             args = [a for a in args if a is not NoneType]
             if len(args) == 1:
                 # I.e. Optional[thing]
-                if context.cur is None:
-                    return context.cur
-                return meth(args[0], context)
+                inner = self._codec(args[0], serializing)
+
+                def optional(context):
+                    if context.cur is None:
+                        return context.cur
+                    return inner(context)
+
+                return optional
         if all(attr.has(a) for a in args):
-            if context.serializing:
-                for a in args:
-                    if isinstance(context.cur, a):
-                        r = meth(a, context)
-                        if self.compact:
-                            r.insert(0, a.__name__)
-                        else:
-                            r["$type"] = a.__name__
-                        return r
-                context.error(f"type of {context.cur} not found in {args}")
+            codecs = [(a, a.__name__, self._codec(a, serializing)) for a in args]
+            compact = self.compact
+            if serializing:
+
+                def union(context):
+                    for a, name, codec in codecs:
+                        if isinstance(context.cur, a):
+                            r = codec(context)
+                            if compact:
+                                r.insert(0, name)
+                            else:
+                                r["$type"] = name
+                            return r
+                    context.error(f"type of {context.cur} not found in {args}")
+
             else:
-                if self.compact:
-                    n = context.cur.pop(0)
-                else:
-                    n = context.cur.pop("$type")
-                for a in args:
-                    if a.__name__ == n:
-                        return meth(a, context)
-                context.error(f"type {n} not found in {args}")
-        raise context.error(f"cannot serialize Union[{args}]")
-
-    def _walk_List(self, meth, args, context):
-        return [
-            meth(args[0], context.child(f"[{i}]", v)) for i, v in enumerate(context.cur)
-        ]
-
-    def _walk_Dict(self, meth, args, context):
+
+                def union(context):
+                    if compact:
+                        n = context.cur.pop(0)
+                    else:
+                        n = context.cur.pop("$type")
+                    for a, name, codec in codecs:
+                        if name == n:
+                            return codec(context)
+                    context.error(f"type {n} not found in {args}")
+
+            return union
+
+        def union(context):
+            raise context.error(f"cannot serialize Union[{args}]")
+
+        return union
+
+    def _compile_List(self, args, serializing):
+        item = self._codec(args[0], serializing)
+
+        def list_(context):
+            return [item(context.child(f"[{i}]", v)) for i, v in enumerate(context.cur)]
+
+        return list_
+
+    def _compile_Dict(self, args, serializing):
         k_ann, v_ann = args
-        if self._ann_ok_as_dict_key(k_ann):
-            input_items = context.cur.items()
-        elif context.serializing:
-            input_items = context.cur.items()
-        else:
-            input_items = context.cur
-        output_items = [
-            [
-                meth(k_ann, context.child(f"/{k}", k)),
-                meth(v_ann, context.child(f"[{k}]", v)),
+        key = self._codec(k_ann, serializing)
+        value = self._codec(v_ann, serializing)
+        key_ok = self._ann_ok_as_dict_key(k_ann)
+
+        def dict_(context):
+            if key_ok or serializing:
+                input_items = context.cur.items()
+            else:
+                input_items = context.cur
+            output_items = [
+                [
+                    key(context.child(f"/{k}", k)),
+                    value(context.child(f"[{k}]", v)),
+                ]
+                for k, v in input_items
             ]
-            for k, v in input_items
-        ]
-        if self._ann_ok_as_dict_key(k_ann):
-            return dict(output_items)
-        elif context.serializing:
-            return output_items
-        else:
-            return dict(output_items)
+            if key_ok or not serializing:
+                return dict(output_items)
+            else:
+                return output_items
+
+        return dict_
 
-    def _walk_NonExhaustive(self, meth, args, context):
+    def _compile_NonExhaustive(self, args, serializing):
         [enum_cls] = args
-        if context.serializing:
-            if isinstance(context.cur, enum_cls):
-                return meth(enum_cls, context)
-            else:
-                return context.cur
+        inner = self._codec(enum_cls, serializing)
+        if serializing:
+
+            def non_exhaustive(context):
+                if isinstance(context.cur, enum_cls):
+                    return inner(context)
+                else:
+                    return context.cur
+
         else:
-            if context.cur in (getattr(m, self.serialize_enums_by) for m in enum_cls):
-                return meth(enum_cls, context)
-            else:
-                return context.cur
+            known = [getattr(m, self.serialize_enums_by) for m in enum_cls]
+
+            def non_exhaustive(context):
+                if context.cur in known:
+                    return inner(context)
+                else:
+                    return context.cur
+
+        return non_exhaustive
 
     def _serialize_dict(self, annotation, context):
         context.assert_type(annotation)
@@ -214,53 +375,59 @@ class Serializer:
         else:
             return str(context.cur)
 
-    def _serialize_attr(self, annotation, context):
-        serialized = []
-        for field in attr.fields(annotation):
-            serialized.append(
-                (
-                    _field_name(field),
-                    self._serialize(
-                        field.type,
-                        context.child(
-                            f".{field.name}",
-                            getattr(context.cur, field.name),
-                            field.metadata,
-                        ),
-                    ),
-                )
-            )
-        if self.compact:
-            return [s[1] for s in serialized]
-        else:
-            return dict(serialized)
+    def _compile_serialize_attr(self, annotation):
+        # The fields are only looked at on first use, which lets a type
+        # refer to itself.
+        fields = None
+        compact = self.compact
+
+        def serialize_attr(context):
+            nonlocal fields
+            if fields is None:
+                fields = [
+                    (
+                        field.name,
+                        _field_name(field),
+                        f".{field.name}",
+                        field.metadata,
+                        self._codec(field.type, True),
+                    )
+                    for field in attr.fields(annotation)
+                ]
+            cur = context.cur
+            if compact:
+                return [
+                    codec(context.child(path, getattr(cur, name), metadata))
+                    for name, key, path, metadata, codec in fields
+                ]
+            else:
+                return {
+                    key: codec(context.child(path, getattr(cur, name), metadata))
+                    for name, key, path, metadata, codec in fields
+                }
 
-    def _serialize_enum(self, annotation, context):
-        context.assert_type(annotation)
-        return getattr(context.cur, self.serialize_enums_by)
+        return serialize_attr
+
+    def _compile_serialize_enum(self, annotation):
+        by = self.serialize_enums_by
+
+        def serialize_enum(context):
+            context.assert_type(annotation)
+            return getattr(context.cur, by)
+
+        return serialize_enum
 
     def _serialize(self, annotation, context):
-        if annotation is None:
-            context.assert_type(type(None))
-            return None
-        if annotation is inspect.Signature.empty or annotation is typing.Any:
-            return context.cur
-        if attr.has(annotation):
-            return self._serialize_attr(annotation, context)
-        origin = getattr(annotation, "__origin__", None)
-        if origin is not None:
-            args = annotation.__args__
-            return self.typing_walkers[origin](self._serialize, args, context)
-        if isinstance(annotation, type) and issubclass(annotation, enum.Enum):
-            return self._serialize_enum(annotation, context)
-        try:
-            serializer = self.type_serializers[annotation]
-        except KeyError:
-            context.error(f"do not know how to handle {annotation}")
-        else:
-            return serializer(annotation, context)
+        return self._codec(annotation, True)(context)
 
     def serialize(self, annotation, value):
+        try:
+            return self._fast_codec(annotation, True)(value, {})
+        except Exception:
+            pass
+        # Go round again, keeping track of where we are, to report the
+        # error (this is outside the except: block so the error is not
+        # chained to whatever the fast path tripped over).
         context = SerializationContext.new(value, serializing=True)
         return self._serialize(annotation, context)
 
@@ -270,62 +437,392 @@ class Serializer:
             context.error("cannot serialize datetime without format")
         return datetime.datetime.strptime(context.cur, fmt)
 
-    def _deserialize_attr(self, annotation, context):
-        if self.compact:
-            context.assert_type(list)
-            args = []
-            for field, value in zip(attr.fields(annotation), context.cur):
-                args.append(
-                    self._deserialize(
-                        field.type,
-                        context.child(f"[{field.name!r}]", value, field.metadata),
+    def _compile_deserialize_attr(self, annotation):
+        # See _compile_serialize_attr.
+        fields = None
+        compact = self.compact
+        ignore_unknown_fields = self.ignore_unknown_fields
+
+        def deserialize_attr(context):
+            nonlocal fields
+            if fields is None:
+                fields = {
+                    _field_name(field): (
+                        field.name,
+                        f"[{field.name!r}]" if compact else f"[{_field_name(field)!r}]",
+                        field.metadata,
+                        self._codec(field.type, False),
                     )
-                )
-            return annotation(*args)
-        else:
-            context.assert_type(dict)
-            args = {}
-            fields = {_field_name(field): field for field in attr.fields(annotation)}
-            for key, value in context.cur.items():
-                if key not in fields and (key == "$type" or self.ignore_unknown_fields):
-                    # Union types can contain a '$type' field that is not
-                    # actually one of the keys.  This happens if a object is
-                    # serialized as part of a Union, sent to an API caller,
-                    # then received back on a different endpoint that isn't a
-                    # Union.
-                    continue
-                field = fields[key]
-                args[field.name] = self._deserialize(
-                    field.type, context.child(f"[{key!r}]", value, field.metadata)
-                )
-            return annotation(**args)
-
-    def _deserialize_enum(self, annotation, context):
+                    for field in attr.fields(annotation)
+                }
+            if compact:
+                context.assert_type(list)
+                args = [
+                    codec(context.child(path, value, metadata))
+                    for (name, path, metadata, codec), value in zip(
+                        fields.values(), context.cur
+                    )
+                ]
+                return annotation(*args)
+            else:
+                context.assert_type(dict)
+                args = {}
+                for key, value in context.cur.items():
+                    if key not in fields and (key == "$type" or ignore_unknown_fields):
+                        # Union types can contain a '$type' field that is not
+                        # actually one of the keys.  This happens if a object
+                        # is serialized as part of a Union, sent to an API
+                        # caller, then received back on a different endpoint
+                        # that isn't a Union.
+                        continue
+                    name, path, metadata, codec = fields[key]
+                    args[name] = codec(context.child(path, value, metadata))
+                return annotation(**args)
+
+        return deserialize_attr
+
+    def _compile_deserialize_enum(self, annotation):
         if self.serialize_enums_by == "name":
-            return getattr(annotation, context.cur)
+
+            def deserialize_enum(context):
+                return getattr(annotation, context.cur)
+
         else:
-            return annotation(context.cur)
+
+            def deserialize_enum(context):
+                return annotation(context.cur)
+
+        return deserialize_enum
 
     def _deserialize(self, annotation, context):
+        return self._codec(annotation, False)(context)
+
+    def deserialize(self, annotation, value):
+        # The fast path does not modify value, so that this still sees
+        # what it was passed.
+        try:
+            return self._fast_codec(annotation, False)(value, {})
+        except Exception:
+            pass
+        context = SerializationContext.new(value, serializing=False)
+        return self._deserialize(annotation, context)
+
+    def serializer_for(self, annotation):
+        """Return a function that does what serialize(annotation, value)
+        does, without looking up the codec for annotation each time."""
+        fast = self._fast_codec(annotation, True)
+
+        def serialize(value):
+            try:
+                return fast(value, {})
+            except Exception:
+                pass
+            context = SerializationContext.new(value, serializing=True)
+            return self._serialize(annotation, context)
+
+        return serialize
+
+    def deserializer_for(self, annotation):
+        """Return a function that does what deserialize(annotation, value)
+        does, without looking up the codec for annotation each time."""
+        fast = self._fast_codec(annotation, False)
+
+        def deserialize(value):
+            try:
+                return fast(value, {})
+            except Exception:
+                pass
+            context = SerializationContext.new(value, serializing=False)
+            return self._deserialize(annotation, context)
+
+        return deserialize
+
+    # The fast codecs. These mirror the ones above, but take (value,
+    # metadata) rather than a SerializationContext and raise _Mismatch
+    # rather than calling context.error. Anything they do not handle just
+    # fails, and the error is then found by the codecs above.
+
+    def _fast_codec(self, annotation, serializing):
+        codecs = self._fast_serializers if serializing else self._fast_deserializers
+        try:
+            return codecs[annotation]
+        except KeyError:
+            pass
+        except TypeError:
+            return self._compile_fast(annotation, serializing)
+        try:
+            codec = self._compile_fast(annotation, serializing)
+        except Exception:
+            codec = _fast_mismatch
+        codecs[annotation] = codec
+        return codec
+
+    def _compile_fast(self, annotation, serializing):
         if annotation is None:
-            context.assert_type(type(None))
-            return None
+
+            def codec(cur, metadata):
+                if cur is not None:
+                    raise _Mismatch
+                return None
+
+            return codec
         if annotation is inspect.Signature.empty or annotation is typing.Any:
-            return context.cur
+            return _fast_current
         if attr.has(annotation):
-            return self._deserialize_attr(annotation, context)
+            if serializing:
+                return self._compile_fast_serialize_attr(annotation)
+            else:
+                return self._compile_fast_deserialize_attr(annotation)
         origin = getattr(annotation, "__origin__", None)
         if origin is not None:
-            return self.typing_walkers[origin](
-                self._deserialize, annotation.__args__, context
-            )
+            compiler = self.fast_typing_compilers.get(origin)
+            if compiler is None:
+                return _fast_mismatch
+            return compiler(annotation.__args__, serializing)
         if isinstance(annotation, type) and issubclass(annotation, enum.Enum):
-            return self._deserialize_enum(annotation, context)
-        return self.type_deserializers[annotation](annotation, context)
+            if serializing:
+                by = self.serialize_enums_by
+                values = {m: getattr(m, by) for m in annotation}
 
-    def deserialize(self, annotation, value):
-        context = SerializationContext.new(value, serializing=False)
-        return self._deserialize(annotation, context)
+                def serialize_enum(cur, metadata):
+                    if type(cur) is not annotation:
+                        raise _Mismatch
+                    return values[cur]
+
+                return serialize_enum
+            elif self.serialize_enums_by == "name":
+
+                def deserialize_enum(cur, metadata):
+                    return getattr(annotation, cur)
+
+                return deserialize_enum
+            else:
+
+                def deserialize_enum(cur, metadata):
+                    return annotation(cur)
+
+                return deserialize_enum
+        if serializing:
+            table = self.type_serializers
+        else:
+            table = self.type_deserializers
+        serializer = table.get(annotation)
+        if serializer is None:
+            return _fast_mismatch
+        if serializer == self._scalar:
+
+            def scalar(cur, metadata):
+                if type(cur) is not annotation:
+                    raise _Mismatch
+                return cur
+
+            return scalar
+        if serializer == self._serialize_dict:
+
+            def serialize_dict(cur, metadata):
+                if type(cur) is not annotation:
+                    raise _Mismatch
+                for k in cur:
+                    if type(k) is not str:
+                        raise _Mismatch
+                return cur
+
+            return serialize_dict
+        if serializer == self._serialize_datetime:
+
+            def serialize_datetime(cur, metadata):
+                if type(cur) is not annotation:
+                    raise _Mismatch
+                fmt = metadata.get("time_fmt")
+                if fmt is not None:
+                    return cur.strftime(fmt)
+                else:
+                    return str(cur)
+
+            return serialize_datetime
+        if serializer == self._deserialize_datetime:
+
+            def deserialize_datetime(cur, metadata):
+                fmt = metadata.get("time_fmt")
+                if fmt is None:
+                    raise _Mismatch
+                return datetime.datetime.strptime(cur, fmt)
+
+            return deserialize_datetime
+
+        # Something added to the tables after construction: give it a
+        # context to work with.
+        def codec(cur, metadata):
+            context = SerializationContext(cur, cur, "", metadata, serializing)
+            return serializer(annotation, context)
+
+        return codec
+
+    def _compile_fast_Union(self, args, serializing):
+        NoneType = type(None)
+        if NoneType in args:
+            args = [a for a in args if a is not NoneType]
+            if len(args) == 1:
+                inner = self._fast_codec(args[0], serializing)
+
+                def optional(cur, metadata):
+                    if cur is None:
+                        return cur
+                    return inner(cur, metadata)
+
+                return optional
+        if not all(attr.has(a) for a in args):
+            return _fast_mismatch
+        codecs = [(a, a.__name__, self._fast_codec(a, serializing)) for a in args]
+        compact = self.compact
+        if serializing:
+
+            def union(cur, metadata):
+                for a, name, codec in codecs:
+                    if isinstance(cur, a):
+                        r = codec(cur, metadata)
+                        if compact:
+                            r.insert(0, name)
+                        else:
+                            r["$type"] = name
+                        return r
+                raise _Mismatch
+
+        else:
+
+            def union(cur, metadata):
+                # Unlike the slow path, leave the type tag where it is: the
+                # attr codec skips it in a dict.
+                if compact:
+                    n = cur[0]
+                    cur = cur[1:]
+                else:
+                    n = cur["$type"]
+                for a, name, codec in codecs:
+                    if name == n:
+                        return codec(cur, metadata)
+                raise _Mismatch
+
+        return union
+
+    def _compile_fast_List(self, args, serializing):
+        item = self._fast_codec(args[0], serializing)
+
+        def list_(cur, metadata):
+            return [item(v, metadata) for v in cur]
+
+        return list_
+
+    def _compile_fast_Dict(self, args, serializing):
+        k_ann, v_ann = args
+        key = self._fast_codec(k_ann, serializing)
+        value = self._fast_codec(v_ann, serializing)
+        key_ok = self._ann_ok_as_dict_key(k_ann)
+
+        def dict_(cur, metadata):
+            if key_ok or serializing:
+                input_items = cur.items()
+            else:
+                input_items = cur
+            output_items = [
+                [key(k, metadata), value(v, metadata)] for k, v in input_items
+            ]
+            if key_ok or not serializing:
+                return dict(output_items)
+            else:
+                return output_items
+
+        return dict_
+
+    def _compile_fast_NonExhaustive(self, args, serializing):
+        [enum_cls] = args
+        inner = self._fast_codec(enum_cls, serializing)
+        if serializing:
+
+            def non_exhaustive(cur, metadata):
+                if isinstance(cur, enum_cls):
+                    return inner(cur, metadata)
+                else:
+                    return cur
+
+        else:
+            known = [getattr(m, self.serialize_enums_by) for m in enum_cls]
+
+            def non_exhaustive(cur, metadata):
+                if cur in known:
+                    return inner(cur, metadata)
+                else:
+                    return cur
+
+        return non_exhaustive
+
+    def _compile_fast_serialize_attr(self, annotation):
+        fields = None
+        compact = self.compact
+
+        def serialize_attr(cur, metadata):
+            nonlocal fields
+            if fields is None:
+                fields = [
+                    (
+                        field.name,
+                        _field_name(field),
+                        field.metadata,
+                        self._fast_codec(field.type, True),
+                    )
+                    for field in attr.fields(annotation)
+                ]
+            if compact:
+                return [
+                    codec(getattr(cur, name), md) for name, key, md, codec in fields
+                ]
+            else:
+                return {
+                    key: codec(getattr(cur, name), md)
+                    for name, key, md, codec in fields
+                }
+
+        return serialize_attr
+
+    def _compile_fast_deserialize_attr(self, annotation):
+        fields = None
+        compact = self.compact
+        ignore_unknown_fields = self.ignore_unknown_fields
+
+        def deserialize_attr(cur, metadata):
+            nonlocal fields
+            if fields is None:
+                fields = {
+                    _field_name(field): (
+                        field.name,
+                        field.metadata,
+                        self._fast_codec(field.type, False),
+                    )
+                    for field in attr.fields(annotation)
+                }
+            if compact:
+                if type(cur) is not list:
+                    raise _Mismatch
+                args = [
+                    codec(value, md)
+                    for (name, md, codec), value in zip(fields.values(), cur)
+                ]
+                return annotation(*args)
+            else:
+                if type(cur) is not dict:
+                    raise _Mismatch
+                args = {}
+                for key, value in cur.items():
+                    field = fields.get(key)
+                    if field is None:
+                        if key == "$type" or ignore_unknown_fields:
+                            continue
+                        raise _Mismatch
+                    name, md, codec = field
+                    args[name] = codec(value, md)
+                return annotation(**args)
+
+        return deserialize_attr
 
     def to_json(self, annotation, value):
         return json.dumps(self.serialize(annotation, value))
@@ -20,11 +20,13 @@ import random
 import string
 import typing
 import unittest
+from unittest import mock
 
 import attr
 
 from subiquity.common.serialize import (
     NonExhaustive,
+    SerializationContext,
     SerializationError,
     Serializer,
     named_field,
@@ -288,6 +290,83 @@ class TestSerializer(CommonSerializerTests, unittest.TestCase):
             self.serializer.deserialize(Type, {"field-1": 1, "field2": 2})
         self.assertEqual(catcher.exception.path, "['field-1']")
 
+    def test_error_paths_in_list(self):
+        data = [{"field1": "a", "field2": 1}, {"field1": "b", "field2": "2"}]
+        with self.assertRaises(SerializationError) as catcher:
+            self.serializer.deserialize(typing.List[Data], data)
+        self.assertEqual(catcher.exception.path, "[1]['field2']")
+        self.assertEqual(
+            str(catcher.exception),
+            f"processing {data}: at [1]['field2'], '2' is not a <class 'int'>",
+        )
+
+    def test_codecs_cached(self):
+        serializer = Serializer()
+        container = Container.make_random()
+        serialized = serializer.serialize(Container, container)
+        serializer.deserialize(Container, serialized)
+        with mock.patch.object(serializer, "_compile") as compile:
+            with mock.patch.object(serializer, "_compile_fast") as compile_fast:
+                self.assertEqual(serialized, serializer.serialize(Container, container))
+                self.assertEqual(
+                    container, serializer.deserialize(Container, serialized)
+                )
+        compile.assert_not_called()
+        compile_fast.assert_not_called()
+
+    def test_serializer_for(self):
+        serializer = Serializer()
+        container = Container.make_random()
+        to_data = serializer.serializer_for(Container)
+        from_data = serializer.deserializer_for(Container)
+        serialized = to_data(container)
+        self.assertEqual(serialized, serializer.serialize(Container, container))
+        self.assertEqual(from_data(serialized), container)
+        with self.assertRaises(SerializationError) as catcher:
+            serializer.deserializer_for(int)("1")
+        self.assertEqual(catcher.exception.path, "")
+
+    def test_as_compact(self):
+        serializer = Serializer(ignore_unknown_fields=True, serialize_enums_by="value")
+        compact = serializer.as_compact()
+        self.assertTrue(compact.compact)
+        self.assertTrue(compact.ignore_unknown_fields)
+        self.assertEqual(compact.serialize_enums_by, "value")
+        self.assertIs(compact, serializer.as_compact())
+        self.assertIs(compact, compact.as_compact())
+
+    def test_no_context_on_success(self):
+        container = Container.make_random()
+        with mock.patch.object(SerializationContext, "new") as new:
+            serialized = self.serializer.serialize(Container, container)
+            self.serializer.deserialize(Container, serialized)
+        new.assert_not_called()
+
+    def test_error_paths_in_union(self):
+        # The fast path must leave the $type key alone, or going round
+        # again to find the error would fail to find it.
+        data = [{"field1": "a", "field2": "b", "$type": "Data"}]
+        with self.assertRaises(SerializationError) as catcher:
+            self.serializer.deserialize(
+                typing.List[typing.Union[Data, Container]], data
+            )
+        self.assertEqual(
+            str(catcher.exception),
+            "processing [{'field1': 'a', 'field2': 'b'}]: "
+            "at [0]['field2'], 'b' is not a <class 'int'>",
+        )
+
+    def test_unknown_type_only_fails_when_met(self):
+        serializer = Serializer()
+        self.assertIsNone(serializer.serialize(typing.Optional[object], None))
+        with self.assertRaises(SerializationError) as catcher:
+            serializer.serialize(typing.Optional[object], object())
+        self.assertEqual(
+            catcher.exception.message, "do not know how to handle <class 'object'>"
+        )
+        with self.assertRaises(KeyError):
+            serializer.deserialize(typing.Optional[object], 1)
+
     def test_serialize_dict_enumkeys_name(self):
         self.assertSerialization(
             typing.Dict[MyEnum, str], {MyEnum.name: "b"}, {"name": "b"}
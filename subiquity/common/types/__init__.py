@@ -111,6 +111,38 @@ class ApplicationStatus:
     event_syslog_id: str
 
 
+@attr.s(auto_attribs=True)
+class ContextEvent:
+    context_id: str
+    parent_id: Optional[str]
+    name: str
+    description: Optional[str]
+    level: str
+    result: Optional[str] = None
+
+
+@attr.s(auto_attribs=True)
+class Histogram:
+    # counts[i] is the number of values no bigger than bounds[i], and the
+    # last of the counts is the number of values bigger than all of them.
+    bounds: List[float]
+    counts: List[int]
+    count: int
+    total: float
+    max: float
+
+
+@attr.s(auto_attribs=True)
+class RouteMetrics:
+    method: str
+    path: str
+    # Times are in seconds, sizes in bytes.
+    wait_for_start: Histogram
+    implementation: Histogram
+    serialization: Histogram
+    response_size: Histogram
+
+
 class PasswordKind(enum.Enum):
     NONE = enum.auto()
     KNOWN = enum.auto()
@@ -562,6 +594,11 @@ class MirrorSelectionFallback(enum.Enum):
     OFFLINE_INSTALL = "offline-install"
 
 
+class MirrorSelectionStrategy(enum.Enum):
+    CONCURRENT = "concurrent"
+    SEQUENTIAL = "sequential"
+
+
 @attr.s(auto_attribs=True)
 class AdConnectionInfo:
     admin_name: str = ""
@@ -401,3 +401,11 @@ class ReformatDisk:
 class EntropyResponse:
     entropy: float
     minimum_required: float
+
+
+@attr.s(auto_attribs=True)
+class RenderCacheStats:
+    # How many times the storage actions were rendered (misses) and how many
+    # times an earlier rendering was reused because the model was unchanged.
+    hits: int
+    misses: int
@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
 import collections
 import copy
 import enum
@@ -49,6 +50,7 @@ from probert.storage import StorageInfo
 
 from subiquity.common.types.storage import (
     Bootloader,
+    GuidedChoiceV2,
     OsProber,
     RecoveryKey,
     StorageResponse,
@@ -177,7 +179,10 @@ def _set_backlinks(obj):
                 break
             i += 1
         obj.id = val
-    obj._m._all_ids.add(obj.id)
+    m = obj._m
+    if obj.id not in m._all_ids:
+        m._all_ids.add(obj.id)
+        m._log_undo(m._all_ids.discard, obj.id)
     for field in attr.fields(type(obj)):
         backlink = field.metadata.get("backlink")
         if backlink is None:
@@ -191,13 +196,17 @@ def _set_backlinks(obj):
             b = getattr(vv, backlink, None)
             if isinstance(b, list):
                 b.append(obj)
+                m._log_undo(b.remove, obj)
             elif isinstance(b, set):
-                b.add(obj)
+                if obj not in b:
+                    b.add(obj)
+                    m._log_undo(b.discard, obj)
             else:
                 setattr(vv, backlink, obj)
 
 
 def _remove_backlinks(obj):
+    m = obj._m
     for field in attr.fields(type(obj)):
         backlink = field.metadata.get("backlink")
         if backlink is None:
@@ -210,9 +219,12 @@ def _remove_backlinks(obj):
         for vv in v:
             b = getattr(vv, backlink, None)
             if isinstance(b, list):
-                b.remove(obj)
+                i = b.index(obj)
+                del b[i]
+                m._log_undo(b.insert, i, obj)
             elif isinstance(b, set):
                 b.remove(obj)
+                m._log_undo(b.add, obj)
             else:
                 setattr(vv, backlink, None)
 
@@ -249,6 +261,15 @@ def _do_post_inits(obj):
         fn(obj)
 
 
+def _fsobj_setattr(obj, attribute, value):
+    # Keep the model's action index, generation and undo log in step with
+    # attribute assignments.
+    m = getattr(obj, "_m", None)
+    if m is not None:
+        m._field_changed(obj, attribute.name, value)
+    return value
+
+
 def fsobj(typ):
     def wrapper(c):
         c.__attrs_post_init__ = _do_post_inits
@@ -263,7 +284,13 @@ def fsobj(typ):
         c.__annotations__["id"] = str
         c.__annotations__["_m"] = "FilesystemModel"
         c.__annotations__["type"] = str
-        c = attr.s(eq=False, repr=False, auto_attribs=True, kw_only=True)(c)
+        c = attr.s(
+            eq=False,
+            repr=False,
+            auto_attribs=True,
+            kw_only=True,
+            on_setattr=_fsobj_setattr,
+        )(c)
         c.__repr__ = fsobj__repr
         _type_to_cls[typ] = c
         return c
@@ -1532,6 +1559,499 @@ class ActionRenderMode(enum.Enum):
         return self in [ActionRenderMode.FOR_API]
 
 
+class _ActionList(list):
+    """The list of actions in a FilesystemModel, indexed for lookups.
+
+    FilesystemModel._one and _all get called a lot, and scanning every
+    action each time gets slow on machines with hundreds of disks and
+    thousands of partitions. This keeps each action in buckets by type,
+    by id and, for each type, by the values of the fields in
+    INDEXED_FIELDS. Buckets are kept in list order so lookups return
+    the same results, in the same order, as a scan would.
+
+    The type and id buckets are updated as the list is changed. The field
+    buckets are also updated when a field of an action in the list is
+    assigned to (see _fsobj_setattr). on_change, if passed, is called
+    after every change to the list. on_undo, if passed, is called with a
+    function and arguments that would undo each change (see
+    FilesystemModel.checkpoint).
+    """
+
+    INDEXED_FIELDS = ("device_id", "name", "path", "serial", "uuid")
+
+    def __init__(self, actions=(), *, on_change=None, on_undo=None):
+        super().__init__(actions)
+        self._on_change = on_change
+        self._on_undo = on_undo
+        self._reindex()
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change()
+
+    def _log_undo(self, func, *args):
+        if self._on_undo is not None:
+            self._on_undo(func, *args)
+
+    def _reindex(self):
+        self._seq = {}
+        self._next_seq = 0
+        self._by_type = collections.defaultdict(list)
+        self._by_id = collections.defaultdict(list)
+        self._by_field = collections.defaultdict(lambda: collections.defaultdict(list))
+        for action in self:
+            self._index(action)
+
+    def _indexed_fields(self, action):
+        fields = attr.fields_dict(type(action))
+        return [name for name in self.INDEXED_FIELDS if name in fields]
+
+    def _buckets(self, action):
+        yield self._by_type[action.type]
+        yield self._by_id[action.id]
+        for name in self._indexed_fields(action):
+            value = getattr(action, name)
+            yield self._by_field[action.type, name][value]
+
+    def _index(self, action, seq=None):
+        if seq is None:
+            # Appending, so the action goes at the end of every bucket.
+            self._seq[action] = self._next_seq
+            self._next_seq += 1
+            for bucket in self._buckets(action):
+                bucket.append(action)
+        else:
+            # Putting back an action that was removed, at its old place.
+            self._seq[action] = seq
+            for bucket in self._buckets(action):
+                bisect.insort(bucket, action, key=self._seq.__getitem__)
+
+    def _unindex(self, action):
+        for bucket in self._buckets(action):
+            bucket.remove(action)
+        return self._seq.pop(action)
+
+    def _field_changed(self, action, name, value):
+        if action not in self._seq:
+            return
+        if name == "id":
+            buckets = self._by_id
+        elif name in self.INDEXED_FIELDS:
+            buckets = self._by_field.get((action.type, name))
+            if buckets is None:
+                return
+        else:
+            return
+        buckets[getattr(action, name)].remove(action)
+        bisect.insort(buckets[value], action, key=self._seq.__getitem__)
+
+    def is_copy(self, action):
+        """Whether action is not in the list but has the id of one that is.
+
+        This is true of the ephemeral copies of devices that attr.evolve
+        makes, e.g. in Disk._reformatted.
+        """
+        return action not in self._seq and bool(self._by_id.get(action.id))
+
+    def candidates(self, kw):
+        """Return a list of actions that includes all those matching kw.
+
+        The result is in list order and may include actions that do not
+        match; it is up to the caller to check.
+        """
+        best = self
+        typ = kw.get("type")
+        if typ is not None:
+            best = self._by_type.get(typ, [])
+        if "id" in kw:
+            bucket = self._by_id.get(kw["id"], [])
+            if len(bucket) < len(best):
+                best = bucket
+        for name in self.INDEXED_FIELDS:
+            if name not in kw:
+                continue
+            buckets = self._by_field.get((typ, name))
+            if buckets is None:
+                continue
+            bucket = buckets.get(kw[name], [])
+            if len(bucket) < len(best):
+                best = bucket
+        return best
+
+    def append(self, action):
+        super().append(action)
+        self._index(action)
+        self._log_undo(self._unappend, action)
+        self._changed()
+
+    def _unappend(self, action):
+        if self and self[-1] is action:
+            super().pop()
+        else:
+            super().remove(action)
+        self._unindex(action)
+        self._changed()
+
+    def extend(self, actions):
+        for action in actions:
+            self.append(action)
+
+    def __iadd__(self, actions):
+        self.extend(actions)
+        return self
+
+    def remove(self, action):
+        self.pop(self.index(action))
+
+    def pop(self, index=-1):
+        if index < 0:
+            index += len(self)
+        action = super().pop(index)
+        seq = self._unindex(action)
+        self._log_undo(self._unpop, index, action, seq)
+        self._changed()
+        return action
+
+    def _unpop(self, index, action, seq):
+        super().insert(index, action)
+        self._index(action, seq)
+        self._changed()
+
+    # Anything that can reorder the list is rare enough to just rebuild
+    # the index afterwards.
+
+    def _reordered(self, previous):
+        self._reindex()
+        self._log_undo(self._unreorder, previous)
+        self._changed()
+
+    def _unreorder(self, previous):
+        super().__setitem__(slice(None), previous)
+        self._reindex()
+        self._changed()
+
+    def clear(self):
+        previous = list(self)
+        super().clear()
+        self._reordered(previous)
+
+    def insert(self, index, action):
+        previous = list(self)
+        super().insert(index, action)
+        self._reordered(previous)
+
+    def __setitem__(self, index, value):
+        previous = list(self)
+        super().__setitem__(index, value)
+        self._reordered(previous)
+
+    def __delitem__(self, index):
+        previous = list(self)
+        super().__delitem__(index)
+        self._reordered(previous)
+
+    def sort(self, *args, **kw):
+        previous = list(self)
+        super().sort(*args, **kw)
+        self._reordered(previous)
+
+    def reverse(self):
+        previous = list(self)
+        super().reverse()
+        self._reordered(previous)
+
+
+# Devices with these filesystem types are the building blocks of RAIDs,
+# volume groups, encrypted devices and so on, which probert describes
+# separately from the block devices they are made of.
+_STACKED_FS_TYPES = {
+    "LVM2_member",
+    "bcache",
+    "crypto_LUKS",
+    "linux_raid_member",
+    "mpath_member",
+    "zfs_member",
+}
+
+# Probe data for these devices refers to, or is referred to by, entries
+# outside the blockdev and filesystem sections.
+_STACKED_DEVICE_PREFIXES = ("bcache", "dasd", "dm-", "md", "nvme", "zd")
+
+
+def merge_device_probe_data(
+    probe_data: dict, partial: dict, paths: Set[str]
+) -> Optional[Tuple[dict, Set[str]]]:
+    """Merge the result of probing only some block devices into probe_data.
+
+    partial is probe data from probing just the disks in paths, the disks
+    of the partitions in paths and the partitions on all those disks (see
+    Prober.get_storage_for_devices). Returns the merged probe data along with
+    the paths of the disks whose entries were replaced, or None if the
+    devices involved are not plain disks and partitions, in which case
+    everything needs probing again.
+    """
+    old = probe_data["blockdev"]
+    new = partial["blockdev"]
+
+    majmin_to_path = {}
+    for blockdevs in old, new:
+        for path, entry in blockdevs.items():
+            majmin_to_path[f"{entry.get('MAJOR')}:{entry.get('MINOR')}"] = path
+
+    def disk_of(blockdevs, path):
+        entry = blockdevs.get(path)
+        if entry is None or entry.get("DEVTYPE") != "partition":
+            return path
+        return majmin_to_path.get(entry.get("ID_PART_ENTRY_DISK"), path)
+
+    disks = {disk_of(new if path in new else old, path) for path in paths | set(new)}
+    replaced = {
+        path for path in old if path in paths or disk_of(old, path) in disks
+    } | set(new)
+
+    for path in replaced:
+        if os.path.basename(path).startswith(_STACKED_DEVICE_PREFIXES):
+            return None
+        for blockdevs in old, new:
+            if blockdevs.get(path, {}).get("ID_FS_TYPE") in _STACKED_FS_TYPES:
+                return None
+
+    merged = dict(probe_data)
+    for key in "blockdev", "filesystem":
+        section = {}
+        # Keep the order of the existing entries, as the order of the
+        # actions in the model follows it.
+        for path, entry in probe_data.get(key, {}).items():
+            if path not in replaced:
+                section[path] = entry
+            elif path in partial.get(key, {}):
+                section[path] = partial[key][path]
+        for path, entry in partial.get(key, {}).items():
+            section.setdefault(path, entry)
+        merged[key] = section
+    if "mount" in partial:
+        merged["mount"] = partial["mount"]
+    return merged, disks
+
+
+class _FrozenDict(dict):
+    """A dict that cannot be changed, for the curtin config of the probed
+    storage (see _freeze_config)."""
+
+    def _readonly(self, *args, **kw):
+        raise TypeError(f"{type(self).__name__} cannot be changed")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _freeze_config(value):
+    """Return a read-only copy of value, with dicts made into _FrozenDicts
+    and lists into tuples.
+
+    The curtin config of the probed storage (FilesystemModel._orig_config)
+    is shared by a model, its clones and the probe snapshot, so none of
+    them may change it."""
+    if isinstance(value, (_FrozenDict, tuple)):
+        return value
+    if isinstance(value, dict):
+        return _FrozenDict({k: _freeze_config(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze_config(v) for v in value)
+    return value
+
+
+def _thaw_config(value):
+    """Return a copy of value that can be changed, undoing _freeze_config."""
+    if isinstance(value, dict):
+        return {k: _thaw_config(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_thaw_config(v) for v in value]
+    return value
+
+
+# The order curtin's extract_storage_config puts actions of each type in.
+# Within a type, actions follow the order of the probe data they come from.
+_EXTRACTED_TYPE_ORDER = (
+    "nvme_controller",
+    "dasd",
+    "disk",
+    "partition",
+    "format",
+    "lvm_volgroup",
+    "lvm_partition",
+    "raid",
+    "dm_crypt",
+    "mount",
+    "bcache",
+    "zpool",
+    "zfs",
+)
+
+
+def _config_refs(action: dict) -> List[str]:
+    refs = [v for v in action.values() if isinstance(v, str)]
+    for v in action.values():
+        if isinstance(v, (list, tuple)):
+            refs.extend(vv for vv in v if isinstance(vv, str))
+    return refs
+
+
+def _config_ids_on_disks(config: List[dict], disks: Set[str]) -> Set[str]:
+    """The ids of the actions in config for the disks with paths in disks
+    and everything on them, mounts aside."""
+    # Dependencies always come before the actions that use them, so one
+    # pass finds everything.
+    ids = set()
+    for action in config:
+        if action["type"] == "mount":
+            continue
+        if (action["type"] == "disk" and action.get("path") in disks) or any(
+            ref in ids for ref in _config_refs(action)
+        ):
+            ids.add(action["id"])
+    return ids
+
+
+def _partial_probe_data(probe_data: dict, disks: Set[str]) -> dict:
+    """The part of probe_data that extract_storage_config needs to produce
+    the config for the disks with paths in disks and for all the mounts.
+
+    The mounts follow the whole mount table, so the disks the mounted
+    devices are on are included too."""
+    blockdevs = probe_data["blockdev"]
+    majmin_to_path = {
+        f"{entry.get('MAJOR')}:{entry.get('MINOR')}": path
+        for path, entry in blockdevs.items()
+    }
+
+    def disk_of(path):
+        entry = blockdevs[path]
+        if entry.get("DEVTYPE") != "partition":
+            return path
+        return majmin_to_path.get(entry.get("ID_PART_ENTRY_DISK"), path)
+
+    wanted = set(disks)
+    mounts = list(probe_data.get("mount", []))
+    while mounts:
+        mount = mounts.pop(0)
+        mounts.extend(mount.get("children", []))
+        if mount.get("source") in blockdevs:
+            wanted.add(disk_of(mount["source"]))
+    partial = {}
+    for key in "blockdev", "filesystem":
+        partial[key] = {
+            path: entry
+            for path, entry in probe_data.get(key, {}).items()
+            if path in blockdevs and disk_of(path) in wanted
+        }
+    if "mount" in probe_data:
+        partial["mount"] = probe_data["mount"]
+    return partial
+
+
+def _sort_extracted_config(config: List[dict], probe_data: dict) -> List[dict]:
+    """Sort config in the order extract_storage_config(probe_data) would
+    have produced it in."""
+    blockdev_order = {path: i for i, path in enumerate(probe_data["blockdev"])}
+    filesystem_order = {
+        path: i for i, path in enumerate(probe_data.get("filesystem", {}))
+    }
+    paths = {action["id"]: action.get("path") for action in config}
+
+    def sort_key(action):
+        kind = action["type"]
+        if kind in _EXTRACTED_TYPE_ORDER:
+            rank = _EXTRACTED_TYPE_ORDER.index(kind)
+        else:
+            rank = len(_EXTRACTED_TYPE_ORDER)
+        if kind in ("disk", "partition"):
+            return rank, blockdev_order.get(action.get("path"), 0)
+        if kind == "format":
+            path = paths.get(action.get("volume"))
+            return rank, filesystem_order.get(path, 0)
+        return rank, 0
+
+    return sorted(config, key=sort_key)
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class _ProbeSnapshot:
+    """The state of a FilesystemModel just after processing probe data.
+
+    Turning probe data into actions means running curtin's
+    extract_storage_config and building every object again, which is slow
+    on big machines. Instead, this keeps a private copy of the resulting
+    object graph that is never modified, and restore() copies it into a
+    model. That copy is a full one, so still takes time in proportion to
+    the number of objects, but it does not extract or parse anything. The
+    StorageInfo objects, which hold the bulk of the probe data and are
+    never modified, and the frozen curtin config are shared rather than
+    copied.
+    """
+
+    # The probe data this snapshot was taken from.
+    probe_data: dict
+    # The model the actions in the snapshot refer to as their _m.
+    owner: "FilesystemModel"
+    actions: Tuple
+    # Frozen by _freeze_config.
+    orig_config: Tuple[dict, ...]
+    all_ids: frozenset
+
+    @staticmethod
+    def _memo(owner, model, actions):
+        memo = {id(owner): model}
+        for action in actions:
+            info = getattr(action, "_info", None)
+            if info is not None:
+                memo[id(info)] = info
+        return memo
+
+    @classmethod
+    def take(cls, model: "FilesystemModel") -> "_ProbeSnapshot":
+        actions = list(model._actions)
+        return cls(
+            probe_data=model._probe_data,
+            owner=model,
+            actions=tuple(copy.deepcopy(actions, cls._memo(model, model, actions))),
+            orig_config=model._orig_config,
+            all_ids=frozenset(model._all_ids),
+        )
+
+    def restore(self, model: "FilesystemModel") -> None:
+        memo = self._memo(self.owner, model, self.actions)
+        model._orig_config = self.orig_config
+        model._all_ids = set(self.all_ids)
+        model._actions = copy.deepcopy(list(self.actions), memo)
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class _Checkpoint:
+    # How much of the undo log to keep when rolling back to this checkpoint.
+    position: int
+    swap: Optional[dict]
+    grub: Optional[dict]
+    guided_configuration: Optional[GuidedChoiceV2]
+
+
+# The checkpoint for a transaction on the v2 storage API, which reset()
+# rolls back to (see FilesystemModel.start_transaction).
+PROBE_CHECKPOINT = "probe"
+
+
 class FilesystemModel:
     target = None
 
@@ -1569,6 +2089,113 @@ class FilesystemModel:
         else:
             return True
 
+    @property
+    def _actions(self) -> _ActionList:
+        return self._action_list
+
+    @_actions.setter
+    def _actions(self, actions) -> None:
+        previous = getattr(self, "_action_list", None)
+        self._action_list = _ActionList(
+            actions, on_change=self._changed, on_undo=self._log_undo
+        )
+        if previous is not None:
+            self._log_undo(self._restore_action_list, previous)
+        self._changed()
+
+    def _restore_action_list(self, actions: _ActionList) -> None:
+        # Fields of these actions may have been assigned to, and then
+        # changed back, while they were not the model's actions.
+        actions._reindex()
+        self._action_list = actions
+        self._changed()
+
+    @property
+    def generation(self) -> int:
+        """A counter that goes up whenever the actions in the model change."""
+        return self._generation
+
+    def _changed(self) -> None:
+        self._generation += 1
+
+    def _field_changed(self, obj, name, value) -> None:
+        if self._actions.is_copy(obj):
+            # Ephemeral copies are not part of the model.
+            return
+        self._changed()
+        if self._checkpoints:
+            self._log_undo(setattr, obj, name, getattr(obj, name))
+        self._actions._field_changed(obj, name, value)
+
+    def _log_undo(self, func, *args) -> None:
+        # Record that func(*args) undoes a change that is being made.
+        if self._checkpoints and not self._rolling_back:
+            self._undo_log.append((func, args))
+
+    def checkpoint(self, name: str) -> None:
+        """Remember the current state of the model as name.
+
+        While there are checkpoints, every change to the actions (and
+        their fields) is recorded along with how to undo it, so that
+        rollback(name) can get back here by undoing just the changes made
+        since, rather than rebuilding everything from the probe data.
+        """
+        self._checkpoints[name] = _Checkpoint(
+            position=len(self._undo_log),
+            swap=self.swap,
+            grub=self.grub,
+            guided_configuration=self.guided_configuration,
+        )
+
+    def rollback(self, name: str) -> None:
+        """Undo all changes made since checkpoint(name).
+
+        Checkpoints taken after name are discarded; name itself is kept so
+        it can be rolled back to again.
+        """
+        checkpoint = self._checkpoints[name]
+        self._rolling_back = True
+        try:
+            while len(self._undo_log) > checkpoint.position:
+                func, args = self._undo_log.pop()
+                func(*args)
+        finally:
+            self._rolling_back = False
+        self._checkpoints = {
+            n: c
+            for n, c in self._checkpoints.items()
+            if c.position <= checkpoint.position
+        }
+        self.swap = checkpoint.swap
+        self.grub = checkpoint.grub
+        self.guided_configuration = checkpoint.guided_configuration
+
+    def discard_checkpoint(self, name: str) -> None:
+        del self._checkpoints[name]
+        if not self._checkpoints:
+            self._undo_log = []
+
+    def has_checkpoint(self, name: str) -> bool:
+        return name in self._checkpoints
+
+    def start_transaction(self) -> None:
+        """Take the PROBE_CHECKPOINT that reset() rolls back to, if the
+        model has not been changed since the probe data was loaded.
+
+        Changes are only recorded from then on, until end_transaction().
+        Without the checkpoint, reset() restores the probe snapshot, which
+        takes time in proportion to the size of the machine.
+        """
+        if self.has_checkpoint(PROBE_CHECKPOINT) or self._probe_data is None:
+            return
+        if self._generation == self._probe_generation:
+            self.checkpoint(PROBE_CHECKPOINT)
+
+    def end_transaction(self) -> None:
+        """Stop recording changes for reset(), see start_transaction()."""
+        if self.has_checkpoint(PROBE_CHECKPOINT):
+            self.discard_checkpoint(PROBE_CHECKPOINT)
+
     def _probe_bootloader(self):
         # This will at some point change to return a list so that we can
         # configure BIOS _and_ UEFI on amd64 systems.
@@ -1591,6 +2218,14 @@ class FilesystemModel:
     ):
         if bootloader is None:
             bootloader = self._probe_bootloader()
+        self._generation = 0
+        # Rendered actions for each ActionRenderMode, along with the
+        # generation they were rendered at.
+        self._render_cache: Dict[ActionRenderMode, Tuple[int, List[dict]]] = {}
+        self.render_cache_hits = 0
+        self.render_cache_misses = 0
+        # The generation and the layouts computed by gaps.parts_and_gaps.
+        self._gaps_cache: Tuple[int, dict] = (-1, {})
         self.bootloader = bootloader
         self.root = root
         self.opt_supports_nvme_tcp_booting: bool | None = opt_supports_nvme_tcp_booting
@@ -1599,20 +2234,72 @@ class FilesystemModel:
         )
         self.storage_version = 1
         self._probe_data = None
+        self._probe_snapshot: Optional[_ProbeSnapshot] = None
+        # Functions and arguments to undo each change made since the oldest
+        # checkpoint, see checkpoint() and rollback().
+        self._undo_log: List[Tuple[Callable, tuple]] = []
+        self._checkpoints: Dict[str, _Checkpoint] = {}
+        self._rolling_back = False
+        self._probe_generation = -1
         self.dd_target: Optional[Disk] = None
         self.reset_partition: Optional[Partition] = None
         self.reset()
 
     def reset(self):
+        snapshot = self._probe_snapshot
+        has_snapshot = snapshot is not None and snapshot.probe_data is self._probe_data
+        if has_snapshot and self.has_checkpoint(PROBE_CHECKPOINT):
+            # Undoing the changes made since the probe data was processed
+            # is much cheaper than copying everything again.
+            self.rollback(PROBE_CHECKPOINT)
+            self._reset_settings()
+            return
+        self._undo_log = []
+        self._checkpoints = {}
         self._all_ids = set()
-        if self._probe_data is not None:
+        if has_snapshot:
+            snapshot.restore(self)
+        elif self._probe_data is not None:
             self.process_probe_data()
+            self._probe_snapshot = _ProbeSnapshot.take(self)
         else:
             self._orig_config = []
             self._actions = []
+        self._reset_settings()
+
+    def _reset_settings(self):
         self.swap = None
         self.grub = None
         self.guided_configuration = None
+        # The model is now as probed, see start_transaction().
+        self._probe_generation = self._generation
+
+    def clone(self) -> "FilesystemModel":
+        """Return a copy of the model that can be changed independently.
+
+        As with _ProbeSnapshot, StorageInfo objects are shared rather than
+        copied. Checkpoints are not copied."""
+        clone = FilesystemModel(
+            self.bootloader,
+            root=self.root,
+            opt_supports_nvme_tcp_booting=self.opt_supports_nvme_tcp_booting,
+            detected_supports_nvme_tcp_booting=self.detected_supports_nvme_tcp_booting,
+        )
+        clone.target = self.target
+        clone.storage_version = self.storage_version
+        clone._probe_data = self._probe_data
+        clone._probe_snapshot = self._probe_snapshot
+        clone._orig_config = self._orig_config
+        clone._all_ids = set(self._all_ids)
+        actions = list(self._actions)
+        memo = _ProbeSnapshot._memo(self, clone, actions)
+        clone._actions = copy.deepcopy(actions, memo)
+        clone.swap = copy.deepcopy(self.swap, memo)
+        clone.grub = copy.deepcopy(self.grub, memo)
+        clone.guided_configuration = self.guided_configuration
+        clone.dd_target = copy.deepcopy(self.dd_target, memo)
+        clone.reset_partition = copy.deepcopy(self.reset_partition, memo)
+        return clone
 
     def get_orig_model(self):
         # The purpose of this is to be able to answer arbitrary questions about
@@ -1627,7 +2314,12 @@ class FilesystemModel:
         )
 
         orig_model.target = self.target
-        if self._probe_data is not None:
+        snapshot = self._probe_snapshot
+        if snapshot is not None and snapshot.probe_data is self._probe_data:
+            orig_model._probe_data = self._probe_data
+            orig_model._probe_snapshot = snapshot
+            orig_model.reset()
+        elif self._probe_data is not None:
             orig_model.load_probe_data(self._probe_data)
         return orig_model
 
@@ -1640,18 +2332,89 @@ class FilesystemModel:
         return self.detected_supports_nvme_tcp_booting
 
     def process_probe_data(self):
-        self._orig_config = storage_config.extract_storage_config(self._probe_data)[
-            "storage"
-        ]["config"]
+        self._orig_config = _freeze_config(
+            storage_config.extract_storage_config(self._probe_data)["storage"]["config"]
+        )
         self._actions = self._actions_from_config(
             self._orig_config,
             blockdevs=self._probe_data["blockdev"],
             is_probe_data=True,
         )
+        self._process_probed_actions(self._actions)
 
+    def process_probe_data_for_disks(self, snapshot: _ProbeSnapshot, disks: Set[str]):
+        """Process the probe data again, only rebuilding the objects for
+        the disks whose paths are in disks and everything on them.
+
+        The objects for all other devices are taken from snapshot, which
+        must have been taken from probe data that only differs in the
+        entries for those disks and their partitions, and in the mounts.
+        """
+        self._undo_log = []
+        self._checkpoints = {}
+        self._all_ids = set()
+        snapshot.restore(self)
+
+        # Only the config for the disks, and for the mounts, needs
+        # extracting again.
+        extracted = storage_config.extract_storage_config(
+            _partial_probe_data(self._probe_data, disks)
+        )["storage"]["config"]
+        fresh_ids = _config_ids_on_disks(extracted, disks)
+        stale_ids = _config_ids_on_disks(snapshot.orig_config, disks)
+        config = [action for action in extracted if action["id"] in fresh_ids]
+        mounts = [action for action in extracted if action["type"] == "mount"]
+        kept_config = [
+            action
+            for action in snapshot.orig_config
+            if action["id"] not in stale_ids and action["type"] != "mount"
+        ]
+        self._orig_config = _freeze_config(
+            _sort_extracted_config(kept_config + config + mounts, self._probe_data)
+        )
+
+        # Dependencies always come before the actions that use them, so
+        # one pass finds everything that was on the disks.
+        stale = set()
+        kept = []
+        for action in self._actions:
+            if (action.type == "disk" and action.path in disks) or any(
+                dep in stale for dep in dependencies(action)
+            ):
+                stale.add(action)
+            else:
+                kept.append(action)
+        self._all_ids -= {action.id for action in stale}
+        fresh = self._actions_from_config(
+            config, blockdevs=self._probe_data["blockdev"], is_probe_data=True
+        )
+        self._actions = kept + fresh
+        # What is mounted may have changed for the kept devices too, so
+        # work out what is in use again for everything.
+        for action in kept:
+            if getattr(action, "_is_in_use", False):
+                action._is_in_use = False
+            if getattr(action, "_has_in_use_partition", False):
+                action._has_in_use_partition = False
+        self._process_probed_actions(list(self._actions))
+
+        # Put the actions back in the order process_probe_data would have
+        # created them in. The swap filesystems _process_probed_actions
+        # adds are not in the config and come last.
+        order = {action["id"]: i for i, action in enumerate(self._orig_config)}
+
+        def sort_key(action):
+            if action.id in order:
+                return order[action.id]
+            volume = getattr(action, "volume", None)
+            return len(order) + order.get(getattr(volume, "id", None), 0)
+
+        self._actions = sorted(self._actions, key=sort_key)
+
+    def _process_probed_actions(self, objs):
         majmin_to_dev = {}
 
-        for obj in self._actions:
+        for obj in objs:
             if not hasattr(obj, "_info"):
                 continue
             major = obj._info.raw.get("MAJOR")
@@ -1693,7 +2456,7 @@ class FilesystemModel:
         # the partition will show up as having a filesystem. Casper should
         # preferentially mount it as a partition though and if it looks like
         # that has happened, we ignore the filesystem on the drive itself.
-        for disk in self._all(type="disk"):
+        for disk in [obj for obj in objs if obj.type == "disk"]:
             if disk._fs is None:
                 continue
             if not disk._partitions:
@@ -1705,7 +2468,7 @@ class FilesystemModel:
                 if p1._is_in_use and not disk._is_in_use:
                     self.remove_filesystem(disk._fs)
 
-        for o in self._actions:
+        for o in objs:
             if o.type == "partition" and o.flag == "swap":
                 if o._fs is None:
                     self._actions.append(
@@ -1996,7 +2759,8 @@ class FilesystemModel:
                     elif f.metadata.get("reflist", False):
                         kw[n] = [byid[id] for id in v]
                     else:
-                        kw[n] = v
+                        # The config may be the frozen _orig_config.
+                        kw[n] = _thaw_config(v)
                 except KeyError:
                     # If a dependency of the current action has been
                     # ignored, we need to ignore the current action too
@@ -2016,15 +2780,105 @@ class FilesystemModel:
         return objs
 
     def _render_actions(self, mode: ActionRenderMode = ActionRenderMode.DEFAULT):
+        # Rendering is only redone if the model has changed since the last
+        # time the actions were rendered in this mode. Every caller gets the
+        # same list, so must copy it before making any change to it.
+        cached = self._render_cache.get(mode)
+        if cached is not None and cached[0] == self._generation:
+            self.render_cache_hits += 1
+        else:
+            self.render_cache_misses += 1
+            actions = self._render_actions_uncached(mode)
+            # Rendering can itself change the model (see
+            # DM_Crypt.serialize_recovery_key), so look at the generation
+            # after rendering.
+            cached = self._render_cache[mode] = (self._generation, actions)
+        return cached[1]
+
+    def _render_actions_uncached(self, mode: ActionRenderMode):
         # The curtin storage config has the constraint that an action must be
-        # preceded by all the things that it depends on.  We handle this by
-        # repeatedly iterating over all actions and checking if we can emit
-        # each action by checking if all of the actions it depends on have been
-        # emitted.  Eventually this will either emit all actions or stop making
+        # preceded by all the things that it depends on: the actions it
+        # refers to, any lower numbered partitions on the same device and the
+        # mounts of any parent directory of a mount point. We treat these as
+        # the edges of a graph and keep a count of the unemitted
+        # prerequisites of each action, Kahn's algorithm style, so deciding
+        # if an action can be emitted is cheap.
+        #
+        # To keep the output stable, actions are visited in rounds in the
+        # same order that the original implementation of this method
+        # visited them: each round visits the actions that could not be
+        # emitted in the previous one, with any prerequisites that have not
+        # been seen yet queued just before the action that needs them.
+        # Eventually this will either emit all actions or stop making
         # progress -- which means there is a cycle in the definitions,
         # something the UI should have prevented <wink>.
         r = []
-        emitted_ids = set()
+        emitted = set()
+        seen = set()
+        devices_seen = set()
+        # Indices into the counts in "unmet".
+        ORDER, DEPS, MOUNTS = range(3)
+        unmet = {}
+        deps_of = {}
+        dependents = collections.defaultdict(list)
+        partitions_by_number = {}
+
+        mountlikes = self.all_mountlikes()
+        mountpoints = {m.path: m.id for m in mountlikes}
+        mountlikes_by_id = {m.id: m for m in mountlikes}
+        log.debug("mountpoints %s", mountpoints)
+
+        def lower_partitions(part):
+            # The partitions on the same device with the next lowest
+            # number. As those can only be emitted after any lower numbered
+            # partitions, waiting for them is the same as waiting for all
+            # lower numbered partitions.
+            device = part.device
+            parts = partitions_by_number.get(device)
+            if parts is None:
+                parts = partitions_by_number[device] = sorted(
+                    device.partitions(), key=lambda p: p.number
+                )
+            i = bisect.bisect_left(parts, part.number, key=lambda p: p.number)
+            if i == 0:
+                return []
+            j = bisect.bisect_left(parts, parts[i - 1].number, key=lambda p: p.number)
+            return parts[j:i]
+
+        def parent_mounts(obj):
+            if obj.type not in MountlikeNames or obj.path is None:
+                return []
+            parents = []
+            for parent in pathlib.Path(obj.path).parents:
+                parent = str(parent)
+                if parent in mountpoints:
+                    parents.append(mountlikes_by_id[mountpoints[parent]])
+            return parents
+
+        def see(obj):
+            seen.add(obj)
+            next_work.append(obj)
+            add_node(obj)
+
+        def add_node(obj):
+            counts = unmet[obj] = [0, 0, 0]
+            deps = deps_of[obj] = list(dependencies(obj))
+            prereqs = [(DEPS, dep) for dep in set(deps)]
+            if obj.type == "partition":
+                prereqs.extend((ORDER, p) for p in lower_partitions(obj))
+            prereqs.extend((MOUNTS, m) for m in parent_mounts(obj))
+            for kind, prereq in prereqs:
+                if prereq not in emitted:
+                    counts[kind] += 1
+                    dependents[prereq].append((obj, kind))
+
+        def ensure_partitions(dev):
+            if dev in devices_seen:
+                return
+            devices_seen.add(dev)
+            for part in dev.partitions():
+                if part not in seen:
+                    see(part)
 
         def emit(obj):
             if isinstance(obj, Raid):
@@ -2035,51 +2889,42 @@ class FilesystemModel:
                     obj.size,
                 )
             r.append(asdict(obj, for_api=mode.is_api()))
-            emitted_ids.add(obj.id)
-
-        def ensure_partitions(dev):
-            for part in dev.partitions():
-                if part.id not in emitted_ids:
-                    if part not in work and part not in next_work:
-                        next_work.append(part)
+            emitted.add(obj)
+            for dependent, kind in dependents.pop(obj, []):
+                unmet[dependent][kind] -= 1
 
         def can_emit(obj):
+            counts = unmet[obj]
             if obj.type == "partition":
                 ensure_partitions(obj.device)
-                for p in obj.device.partitions():
-                    if p.number < obj.number and p.id not in emitted_ids:
-                        return False
-            for dep in dependencies(obj):
-                if dep.id not in emitted_ids:
-                    if dep not in work and dep not in next_work:
-                        next_work.append(dep)
-                        if dep.type in ["disk", "raid"]:
-                            ensure_partitions(dep)
+                if counts[ORDER]:
                     return False
-            if obj.type in MountlikeNames and obj.path is not None:
-                # Any mount actions for a parent of this one have to be emitted
-                # first.
-                for parent in pathlib.Path(obj.path).parents:
-                    parent = str(parent)
-                    if parent in mountpoints:
-                        if mountpoints[parent] not in emitted_ids:
-                            log.debug(
-                                "cannot emit action to mount %s until that "
-                                "for %s is emitted",
-                                obj.path,
-                                parent,
-                            )
-                            return False
+            if counts[DEPS]:
+                for dep in deps_of[obj]:
+                    if dep not in emitted:
+                        if dep not in seen:
+                            see(dep)
+                            if dep.type in ["disk", "raid"]:
+                                ensure_partitions(dep)
+                        return False
+            if counts[MOUNTS]:
+                log.debug(
+                    "cannot emit action to mount %s until those for its "
+                    "parents are emitted",
+                    obj.path,
+                )
+                return False
             return True
 
-        mountpoints = {m.path: m.id for m in self.all_mountlikes()}
-        log.debug("mountpoints %s", mountpoints)
-
         if mode.include_all():
             work = list(self._actions)
         else:
             work = [a for a in self._actions if not getattr(a, "preserve", False)]
 
+        seen.update(work)
+        for obj in work:
+            add_node(obj)
+
         while work:
             next_work = []
             for obj in work:
@@ -2139,7 +2984,14 @@ class FilesystemModel:
             config["grub"] = self.grub
         return config
 
-    def load_probe_data(self, probe_data):
+    def load_probe_data(self, probe_data, *, disks: Optional[Set[str]] = None):
+        """Load probe data, discarding any changes made to the model.
+
+        If disks is passed, probe_data must only differ from the probe
+        data last loaded in the entries for the disks with those paths and
+        their partitions (see merge_device_probe_data), and only the
+        objects for those disks are built again.
+        """
         for devname, devdata in probe_data["blockdev"].items():
             if int(devdata["attrs"]["size"]) != 0:
                 continue
@@ -2156,11 +3008,22 @@ class FilesystemModel:
             size = blocksize * blocks_per_track * tracks_per_cylinder * cylinders
             log.debug("computing size on unformatted dasd from %s as %s", data, size)
             devdata["attrs"]["size"] = str(size)
+        snapshot = self._probe_snapshot
+        if snapshot is None or snapshot.probe_data is not self._probe_data:
+            snapshot = None
         self._probe_data = probe_data
-        self.reset()
+        self._probe_snapshot = None
+        if disks is not None and snapshot is not None:
+            self.process_probe_data_for_disks(snapshot, disks)
+            self._probe_snapshot = _ProbeSnapshot.take(self)
+            # The model already has the actions of the new snapshot, so
+            # there is no need to restore it as reset() would.
+            self._reset_settings()
+        else:
+            self.reset()
 
     def _matcher(self, kw):
-        for a in self._actions:
+        for a in self._actions.candidates(kw):
             for k, v in kw.items():
                 if getattr(a, k) != v:
                     break
@@ -2256,7 +3119,8 @@ class FilesystemModel:
             partition_name=partition_name,
         )
         if boot.is_bootloader_partition(p):
-            device._partitions.insert(0, device._partitions.pop())
+            # Assign rather than reorder in place, so this can be undone.
+            device._partitions = device._partitions[-1:] + device._partitions[:-1]
         device.ptable = device.ptable_for_new_partition()
         dasd = device.dasd()
         if dasd is not None:
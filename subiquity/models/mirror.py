@@ -89,7 +89,7 @@ from curtin.commands.apt_config import (
 )
 from curtin.config import merge_config
 
-from subiquity.common.types import MirrorSelectionFallback
+from subiquity.common.types import MirrorSelectionFallback, MirrorSelectionStrategy
 
 try:
     from curtin.distro import get_architecture
@@ -270,6 +270,8 @@ class MirrorModel(object):
 
         # What to do if automatic mirror-selection fails.
         self.fallback = MirrorSelectionFallback.OFFLINE_INSTALL
+        # How to go through the candidates when looking for a usable mirror.
+        self.selection_strategy = MirrorSelectionStrategy.CONCURRENT
 
     def _default_primary_entries(self) -> List[PrimaryEntry]:
         return [
@@ -312,6 +314,10 @@ class MirrorModel(object):
                 for section in mirror_selection["primary"]:
                     entry = PrimaryEntry.from_config(section, parent=self)
                     primary_candidates.append(entry)
+            if "strategy" in mirror_selection:
+                self.selection_strategy = MirrorSelectionStrategy(
+                    mirror_selection["strategy"]
+                )
         self.primary_candidates = primary_candidates
         if "fallback" in data:
             self.fallback = MirrorSelectionFallback(data.pop("fallback"))
@@ -448,6 +454,8 @@ class MirrorModel(object):
         else:
             primary = [c.serialize_for_ai() for c in self.primary_candidates]
             config["mirror-selection"] = {"primary": primary}
+            if self.selection_strategy != MirrorSelectionStrategy.CONCURRENT:
+                config["mirror-selection"]["strategy"] = self.selection_strategy.value
         config["fallback"] = self.fallback.value
 
         return config
@@ -13,6 +13,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import copy
+import json
 import pathlib
 import unittest
 from typing import Optional
@@ -26,22 +29,34 @@ from subiquity.common.filesystem import gaps
 from subiquity.common.types.storage import RecoveryKey
 from subiquity.models.filesystem import (
     LVM_CHUNK_SIZE,
+    PROBE_CHECKPOINT,
     ZFS,
     ActionRenderMode,
     Bootloader,
     Disk,
     Filesystem,
     FilesystemModel,
+    MountlikeNames,
     NotFinalPartitionError,
     NVMeController,
     Partition,
     RecoveryKeyHandler,
     ZPool,
+    _freeze_config,
+    _FrozenDict,
+    _partial_probe_data,
+    _ProbeSnapshot,
+    _sort_extracted_config,
+    _thaw_config,
     align_down,
+    asdict,
     dehumanize_size,
+    dependencies,
     get_canmount,
     get_raid_size,
     humanize_size,
+    merge_device_probe_data,
+    storage_config,
 )
 from subiquitycore.tests import SubiTestCase
 from subiquitycore.tests.parameterized import parameterized
@@ -519,6 +534,56 @@ class TestFilesystemModel(unittest.TestCase):
             m_renumber.assert_not_called()
 
 
+class TestActionIndex(unittest.TestCase):
+    def test_one_by_id(self):
+        model, disk = make_model_and_disk()
+        part = make_partition(model, disk)
+        self.assertIs(model._one(id=part.id), part)
+        self.assertIs(model._one(type="disk", id=disk.id), disk)
+        self.assertIsNone(model._one(type="partition", id=disk.id))
+
+    def test_all_keeps_action_order(self):
+        model = make_model()
+        disks = [make_disk(model) for _ in range(4)]
+        model._actions.remove(disks[1])
+        model._actions.append(disks[1])
+        self.assertEqual(
+            [disks[0], disks[2], disks[3], disks[1]], model._all(type="disk")
+        )
+
+    def test_removed_action_not_found(self):
+        model, part = make_model_and_partition()
+        part.uuid = "uuid1"
+        model.remove_partition(part)
+        self.assertIsNone(model.partition_by_partuuid("uuid1"))
+        self.assertIsNone(model._one(id=part.id))
+
+    def test_lookup_follows_assignment(self):
+        model, disk = make_model_and_disk()
+        p1 = make_partition(model, disk, uuid="uuid1")
+        p2 = make_partition(model, disk)
+        self.assertIs(model.partition_by_partuuid("uuid1"), p1)
+        p2.uuid = "uuid1"
+        p1.uuid = "uuid2"
+        self.assertIs(model.partition_by_partuuid("uuid1"), p2)
+        self.assertIs(model.partition_by_partuuid("uuid2"), p1)
+        p1.uuid = "uuid1"
+        self.assertEqual([p1, p2], model._all(type="partition", uuid="uuid1"))
+
+    def test_assigning_actions_reindexes(self):
+        model, disk = make_model_and_disk(serial="s1")
+        model._actions = []
+        self.assertIsNone(model._one(type="disk", serial="s1"))
+        model._actions = [disk]
+        self.assertIs(model._one(type="disk", serial="s1"), disk)
+
+    def test_property_lookup(self):
+        # Raid.path is a property, not a field, so is not indexed.
+        model, raid = make_model_and_raid()
+        raid.path = "/dev/md/foo"
+        self.assertIs(model._one(type="raid", path="/dev/md/foo"), raid)
+
+
 def fake_up_blockdata_disk(disk, **kw):
     model = disk._m
     if model._probe_data is None:
@@ -1319,6 +1384,643 @@ class TestAutoInstallConfig(unittest.TestCase):
         self.assertTrue(disk2p1.id in rendered_ids)
 
 
+def legacy_render_order(model, mode):
+    # The implementation of FilesystemModel._render_actions from before it
+    # kept track of dependencies as a graph, which the current one has to
+    # produce identical output to.
+    r = []
+    emitted_ids = set()
+
+    def emit(obj):
+        r.append(asdict(obj, for_api=mode.is_api()))
+        emitted_ids.add(obj.id)
+
+    def ensure_partitions(dev):
+        for part in dev.partitions():
+            if part.id not in emitted_ids:
+                if part not in work and part not in next_work:
+                    next_work.append(part)
+
+    def can_emit(obj):
+        if obj.type == "partition":
+            ensure_partitions(obj.device)
+            for p in obj.device.partitions():
+                if p.number < obj.number and p.id not in emitted_ids:
+                    return False
+        for dep in dependencies(obj):
+            if dep.id not in emitted_ids:
+                if dep not in work and dep not in next_work:
+                    next_work.append(dep)
+                    if dep.type in ["disk", "raid"]:
+                        ensure_partitions(dep)
+                return False
+        if obj.type in MountlikeNames and obj.path is not None:
+            for parent in pathlib.Path(obj.path).parents:
+                parent = str(parent)
+                if parent in mountpoints:
+                    if mountpoints[parent] not in emitted_ids:
+                        return False
+        return True
+
+    mountpoints = {m.path: m.id for m in model.all_mountlikes()}
+
+    if mode.include_all():
+        work = list(model._actions)
+    else:
+        work = [a for a in model._actions if not getattr(a, "preserve", False)]
+
+    while work:
+        next_work = []
+        for obj in work:
+            if can_emit(obj):
+                emit(obj)
+            else:
+                next_work.append(obj)
+        if {a.id for a in next_work} == {a.id for a in work}:
+            raise Exception("no progress")
+        work = next_work
+
+    return r
+
+
+class TestRenderOrder(unittest.TestCase):
+    modes = [
+        ActionRenderMode.DEFAULT,
+        ActionRenderMode.FOR_API,
+        ActionRenderMode.FOR_API_CLIENT,
+    ]
+
+    def assertSameAsLegacy(self, model):
+        for mode in self.modes:
+            with self.subTest(mode=mode):
+                self.assertEqual(
+                    json.dumps(legacy_render_order(model, mode), default=str),
+                    json.dumps(model._render_actions(mode), default=str),
+                )
+
+    def add_changes(self, model):
+        # Add a new partition to every disk with space for one, format
+        # them and mount them, with children added before their parents.
+        parts = []
+        for disk in model.all_disks():
+            if disk._fs is not None or disk.ptable == "unsupported":
+                continue
+            gap = gaps.largest_gap(disk)
+            if gap is None or gap.size < (1 << 30):
+                continue
+            parts.append(model.add_partition(disk, size=1 << 30, offset=gap.offset))
+        paths = ["/", "/srv"] + [f"/srv/{i}" for i in range(len(parts))]
+        for part, path in reversed(list(zip(parts, paths))):
+            fs = model.add_filesystem(part, "ext4")
+            model.add_mount(fs, path)
+
+    @parameterized.expand(
+        [(p.name,) for p in sorted(pathlib.Path("examples/machines").glob("*.json"))]
+    )
+    def test_machine(self, name):
+        with open(f"examples/machines/{name}") as fp:
+            probe_data = json.load(fp)["storage"]
+        model = make_model()
+        model.target = "/target"
+        model.load_probe_data(probe_data)
+        self.assertSameAsLegacy(model)
+        self.add_changes(model)
+        self.assertSameAsLegacy(model)
+
+    def test_partitions_out_of_order(self):
+        model, disk = make_model_and_disk()
+        parts = [make_partition(model, disk, size=1 << 30) for _ in range(4)]
+        model._actions.sort(key=lambda a: -getattr(a, "number", 0))
+        for part in parts:
+            model.add_mount(model.add_filesystem(part, "ext4"), f"/{part.number}")
+        self.assertSameAsLegacy(model)
+
+
+class TestRenderCache(unittest.TestCase):
+    def test_unchanged_model_hits_cache(self):
+        model, part = make_model_and_partition()
+        first = model._render_actions()
+        self.assertEqual(1, model.render_cache_misses)
+        self.assertEqual(first, model._render_actions())
+        self.assertEqual(1, model.render_cache_hits)
+        self.assertEqual(1, model.render_cache_misses)
+
+    def test_modes_cached_separately(self):
+        model, part = make_model_and_partition()
+        model._render_actions(ActionRenderMode.DEFAULT)
+        model._render_actions(ActionRenderMode.FOR_API)
+        self.assertEqual(0, model.render_cache_hits)
+        self.assertEqual(2, model.render_cache_misses)
+
+    def test_mutation_invalidates(self):
+        model, part = make_model_and_partition()
+        model._render_actions()
+        generation = model.generation
+        fs = model.add_filesystem(part, "ext4")
+        self.assertGreater(model.generation, generation)
+        self.assertIn(fs.id, [a["id"] for a in model._render_actions()])
+        self.assertEqual(2, model.render_cache_misses)
+
+    def test_assignment_invalidates(self):
+        model, part = make_model_and_partition()
+        model._render_actions()
+        part.wipe = "superblock"
+        [rendered] = [a for a in model._render_actions() if a["id"] == part.id]
+        self.assertEqual("superblock", rendered["wipe"])
+        self.assertEqual(0, model.render_cache_hits)
+
+    def test_result_is_shared(self):
+        model, part = make_model_and_partition()
+        # A hit costs nothing: every caller gets the same rendering.
+        self.assertIs(model._render_actions(), model._render_actions())
+
+    def test_ephemeral_copies_do_not_invalidate(self):
+        model, part = make_model_and_partition()
+        generation = model.generation
+        part.device._reformatted()
+        part.device._excluding_partition(part)
+        self.assertEqual(generation, model.generation)
+
+
+class TestClone(unittest.TestCase):
+    def test_clone(self):
+        model, disk = make_model_and_disk(Bootloader.UEFI)
+        part = make_partition(model, disk, size=1 << 30, offset=1 << 20)
+        model.grub = {"install_devices": [disk.id]}
+        model.dd_target = disk
+        clone = model.clone()
+        self.assertEqual(model._render_actions(), clone._render_actions())
+        self.assertEqual(model.grub, clone.grub)
+        [clone_disk] = clone._all(type="disk")
+        self.assertIs(clone_disk, clone.dd_target)
+        self.assertIsNot(disk, clone_disk)
+        self.assertIs(disk._info, clone_disk._info)
+        for action in clone._actions:
+            self.assertIs(clone, action._m)
+
+        clone.add_filesystem(clone_disk.partitions()[0], "ext4")
+        clone.add_partition(clone_disk, size=1 << 30, offset=2 << 30)
+        self.assertIsNone(part._fs)
+        self.assertEqual([part], disk.partitions())
+
+
+class TestProbeSnapshot(unittest.TestCase):
+    def test_restore(self):
+        model = make_model()
+        disk = make_disk(model, preserve=True)
+        make_partition(model, disk, preserve=True, offset=1 << 20, size=1 << 30)
+        make_partition(model, disk, preserve=True, offset=2 << 30, size=1 << 30)
+        make_raid(model)
+        before = model._render_actions(ActionRenderMode.FOR_API)
+        snapshot = _ProbeSnapshot.take(model)
+
+        model.add_filesystem(disk.partitions()[0], "ext4")
+        model.remove_partition(disk.partitions()[1])
+        snapshot.restore(model)
+
+        self.assertEqual(before, model._render_actions(ActionRenderMode.FOR_API))
+        [new_disk] = model._all(type="disk", id=disk.id)
+        self.assertIsNot(disk, new_disk)
+        self.assertIs(model, new_disk._m)
+        self.assertIs(disk._info, new_disk._info)
+        self.assertEqual(2, len(new_disk.partitions()))
+
+    def test_restore_into_other_model(self):
+        model, disk = make_model_and_disk()
+        snapshot = _ProbeSnapshot.take(model)
+        other = make_model()
+        snapshot.restore(other)
+        [other_disk] = other._all(type="disk")
+        self.assertIs(other, other_disk._m)
+        make_partition(other, other_disk)
+        self.assertEqual([], disk.partitions())
+
+    def test_orig_config_shared_and_frozen(self):
+        model = make_model()
+        make_raid(model)
+        model._orig_config = _freeze_config(model._render_actions())
+        snapshot = _ProbeSnapshot.take(model)
+        other = make_model()
+        snapshot.restore(other)
+        self.assertIs(model._orig_config, other._orig_config)
+        self.assertIs(model._orig_config, model.clone()._orig_config)
+        action = other._orig_config[0]
+        with self.assertRaises(TypeError):
+            action["id"] = "changed"
+        with self.assertRaises(AttributeError):
+            other._orig_config.append({})
+
+    def test_objects_from_frozen_config(self):
+        model = make_model()
+        make_zpool(model=model, mountpoint="/", fs_properties=dict(canmount="on"))
+        model._orig_config = _freeze_config(model._render_actions())
+        with mock.patch("subiquity.models.filesystem.StorageInfo"):
+            model._actions = model._actions_from_config(
+                model._orig_config,
+                blockdevs=collections.defaultdict(dict),
+                is_probe_data=False,
+            )
+        [zpool] = model._all(type="zpool")
+        # The fields of an object never share the frozen config.
+        self.assertIs(dict, type(zpool.fs_properties))
+        zpool.fs_properties["canmount"] = "off"
+
+    def test_probe_data_processed_once(self):
+        with open("examples/machines/existing-partitions.json") as fp:
+            probe_data = json.load(fp)["storage"]
+        model = make_model()
+        model.target = "/target"
+        with mock.patch.object(
+            storage_config,
+            "extract_storage_config",
+            wraps=storage_config.extract_storage_config,
+        ) as extract:
+            model.load_probe_data(probe_data)
+            expected = model._render_actions(ActionRenderMode.FOR_API)
+            orig_model = model.get_orig_model()
+            model.reset()
+            extract.assert_called_once()
+        self.assertEqual(expected, orig_model._render_actions(ActionRenderMode.FOR_API))
+        self.assertEqual(expected, model._render_actions(ActionRenderMode.FOR_API))
+        for action in orig_model._actions:
+            self.assertIs(orig_model, action._m)
+
+    def test_load_probe_data_for_disks(self):
+        with open("examples/machines/existing-partitions.json") as fp:
+            probe_data = json.load(fp)["storage"]
+        model = make_model()
+        model.target = "/target"
+        model.load_probe_data(probe_data)
+        partial = {
+            "blockdev": {
+                path: data
+                for path, data in probe_data["blockdev"].items()
+                if path.startswith("/dev/vdb") and path != "/dev/vdb6"
+            },
+            "filesystem": {},
+        }
+        vdb = partial["blockdev"]["/dev/vdb"] = copy.deepcopy(
+            partial["blockdev"]["/dev/vdb"]
+        )
+        del vdb["partitiontable"]["partitions"][-1]
+        merged, disks = merge_device_probe_data(probe_data, partial, {"/dev/vdb6"})
+        model.grub = {"install_devices": []}
+
+        model.load_probe_data(merged, disks=disks)
+
+        expected = make_model()
+        expected.target = "/target"
+        expected.load_probe_data(merged)
+        self.assertEqual(
+            expected._render_actions(ActionRenderMode.FOR_API),
+            model._render_actions(ActionRenderMode.FOR_API),
+        )
+        self.assertEqual(expected._all_ids, model._all_ids)
+        self.assertEqual(expected._orig_config, model._orig_config)
+        self.assertIsNone(model.grub)
+        for action in model._actions:
+            self.assertIs(model, action._m)
+
+    def test_load_probe_data_for_disks_work(self):
+        with open("examples/machines/existing-partitions.json") as fp:
+            probe_data = json.load(fp)["storage"]
+        model = make_model()
+        model.target = "/target"
+        model.load_probe_data(probe_data)
+        partial = {
+            "blockdev": {
+                path: data
+                for path, data in probe_data["blockdev"].items()
+                if path.startswith("/dev/vdb")
+            },
+            "filesystem": {},
+        }
+        merged, disks = merge_device_probe_data(probe_data, partial, {"/dev/vdb"})
+
+        with mock.patch.object(
+            storage_config,
+            "extract_storage_config",
+            wraps=storage_config.extract_storage_config,
+        ) as extract, mock.patch.object(
+            _ProbeSnapshot, "restore", autospec=True, side_effect=_ProbeSnapshot.restore
+        ) as restore:
+            model.load_probe_data(merged, disks=disks)
+        # Only the changed disk, and the disk with the mounted install
+        # media, are extracted again.
+        [call] = extract.call_args_list
+        self.assertEqual(
+            {"/dev/vda", "/dev/vdb"},
+            {path.rstrip("0123456789") for path in call.args[0]["blockdev"]},
+        )
+        restore.assert_called_once()
+
+    def test_load_probe_data_for_disks_mounts(self):
+        # The in use state of devices that were not probed again follows
+        # the new mount table too.
+        with open("examples/machines/existing-partitions.json") as fp:
+            probe_data = json.load(fp)["storage"]
+        model = make_model()
+        model.target = "/target"
+        model.load_probe_data(probe_data)
+        [vda2] = model._all(path="/dev/vda2")
+        self.assertFalse(vda2._is_in_use)
+        vda2_data = probe_data["blockdev"]["/dev/vda2"]
+        partial = {
+            "blockdev": {
+                path: data
+                for path, data in probe_data["blockdev"].items()
+                if path.startswith("/dev/vdb")
+            },
+            "filesystem": {},
+            "mount": probe_data["mount"]
+            + [
+                {
+                    "source": "/dev/vda2",
+                    "target": "/mnt",
+                    "fstype": "ext4",
+                    "options": "rw",
+                    "maj:min": f"{vda2_data['MAJOR']}:{vda2_data['MINOR']}",
+                }
+            ],
+        }
+        merged, disks = merge_device_probe_data(probe_data, partial, {"/dev/vdb"})
+
+        model.load_probe_data(merged, disks=disks)
+
+        [vda2] = model._all(path="/dev/vda2")
+        self.assertTrue(vda2._is_in_use)
+        expected = make_model()
+        expected.target = "/target"
+        expected.load_probe_data(merged)
+        self.assertEqual(
+            expected._render_actions(ActionRenderMode.FOR_API),
+            model._render_actions(ActionRenderMode.FOR_API),
+        )
+        self.assertEqual(expected._orig_config, model._orig_config)
+
+
+class TestFreezeConfig(unittest.TestCase):
+    def test_freeze_thaw(self):
+        config = [{"id": "md0", "type": "raid", "devices": ["a", "b"]}]
+        frozen = _freeze_config(config)
+        self.assertIsInstance(frozen, tuple)
+        self.assertIsInstance(frozen[0], _FrozenDict)
+        self.assertEqual(("a", "b"), frozen[0]["devices"])
+        for change in (
+            lambda d: d.update(id="md1"),
+            lambda d: d.pop("id"),
+            lambda d: d.clear(),
+            lambda d: d.__delitem__("id"),
+            lambda d: d.setdefault("name", "md1"),
+        ):
+            with self.assertRaises(TypeError):
+                change(frozen[0])
+        self.assertIs(frozen, _freeze_config(frozen))
+        self.assertIs(frozen[0], copy.deepcopy(frozen[0]))
+        self.assertEqual(json.dumps(config), json.dumps(frozen))
+        thawed = _thaw_config(frozen)
+        self.assertEqual(config, thawed)
+        self.assertIs(dict, type(thawed[0]))
+
+
+class TestPartialProbeData(unittest.TestCase):
+    def setUp(self):
+        with open("examples/machines/existing-partitions.json") as fp:
+            self.probe_data = json.load(fp)["storage"]
+
+    def test_partial_probe_data(self):
+        partial = _partial_probe_data(self.probe_data, {"/dev/vdb"})
+        # /dev/vda is mounted on /cdrom, so is needed for the mounts.
+        vda = ["/dev/vda", "/dev/vda1", "/dev/vda2"]
+        vdb = [f"/dev/vdb{n}" for n in ["", 1, 2, 3, 4, 5, 6]]
+        self.assertEqual(vda + vdb, list(partial["blockdev"]))
+        self.assertEqual(
+            vda + ["/dev/vdb2", "/dev/vdb4", "/dev/vdb5", "/dev/vdb6"],
+            list(partial["filesystem"]),
+        )
+        self.assertIs(self.probe_data["mount"], partial["mount"])
+        self.assertEqual({"blockdev", "filesystem", "mount"}, set(partial))
+
+    def test_sort_extracted_config(self):
+        config = [
+            {"type": "mount", "id": "mount-0", "device": "format-1"},
+            {"type": "format", "id": "format-1", "volume": "partition-vda2"},
+            {"type": "partition", "id": "partition-vda2", "path": "/dev/vda2"},
+            {"type": "format", "id": "format-0", "volume": "partition-vda1"},
+            {"type": "partition", "id": "partition-vda1", "path": "/dev/vda1"},
+            {"type": "disk", "id": "disk-vdb", "path": "/dev/vdb"},
+            {"type": "disk", "id": "disk-vda", "path": "/dev/vda"},
+        ]
+        self.assertEqual(
+            [
+                "disk-vda",
+                "disk-vdb",
+                "partition-vda1",
+                "partition-vda2",
+                "format-0",
+                "format-1",
+                "mount-0",
+            ],
+            [
+                action["id"]
+                for action in _sort_extracted_config(config, self.probe_data)
+            ],
+        )
+
+
+class TestMergeDeviceProbeData(unittest.TestCase):
+    def setUp(self):
+        with open("examples/machines/existing-partitions.json") as fp:
+            self.probe_data = json.load(fp)["storage"]
+
+    def partial(self, *paths):
+        partial = {"blockdev": {}, "filesystem": {}}
+        for key in partial:
+            for path, data in self.probe_data[key].items():
+                if path in paths:
+                    partial[key][path] = copy.deepcopy(data)
+        return partial
+
+    def test_replace_disk(self):
+        vdb = [f"/dev/vdb{n}" for n in ["", 1, 2, 3, 4, 5]]
+        partial = self.partial(*vdb)
+        partial["filesystem"]["/dev/vdb5"]["TYPE"] = "xfs"
+        merged, disks = merge_device_probe_data(
+            self.probe_data, partial, {"/dev/vdb5", "/dev/vdb6"}
+        )
+        self.assertEqual({"/dev/vdb"}, disks)
+        expected = list(self.probe_data["blockdev"])
+        expected.remove("/dev/vdb6")
+        self.assertEqual(expected, list(merged["blockdev"]))
+        self.assertNotIn("/dev/vdb6", merged["filesystem"])
+        self.assertEqual("xfs", merged["filesystem"]["/dev/vdb5"]["TYPE"])
+        self.assertEqual("ext4", self.probe_data["filesystem"]["/dev/vdb5"]["TYPE"])
+        self.assertIs(self.probe_data["raid"], merged["raid"])
+
+    def test_new_disk(self):
+        partial = self.partial("/dev/vdb")
+        vdz = partial["blockdev"]["/dev/vdz"] = partial["blockdev"].pop("/dev/vdb")
+        vdz["MINOR"] = "200"
+        merged, disks = merge_device_probe_data(self.probe_data, partial, {"/dev/vdz"})
+        self.assertEqual({"/dev/vdz"}, disks)
+        self.assertEqual(
+            list(self.probe_data["blockdev"]) + ["/dev/vdz"], list(merged["blockdev"])
+        )
+
+    def test_removed_disk(self):
+        merged, disks = merge_device_probe_data(
+            self.probe_data, self.partial(), {"/dev/vdb"}
+        )
+        self.assertEqual({"/dev/vdb"}, disks)
+        self.assertEqual([], [p for p in merged["blockdev"] if "vdb" in p])
+
+    @parameterized.expand([("/dev/vdc1",), ("/dev/vde",), ("/dev/md127",)])
+    def test_stacked(self, path):
+        self.assertIsNone(
+            merge_device_probe_data(self.probe_data, self.partial(path), {path})
+        )
+
+
+class TestCheckpoint(unittest.TestCase):
+    def make_model(self):
+        model = make_model(Bootloader.UEFI)
+        disk = make_disk(model, preserve=True)
+        make_partition(model, disk, preserve=True, offset=1 << 20, size=1 << 30)
+        make_partition(model, disk, preserve=True, offset=2 << 30, size=1 << 30)
+        make_raid(model)
+        return model, disk
+
+    def test_no_undo_log_without_checkpoints(self):
+        model, disk = self.make_model()
+        model.add_filesystem(disk.partitions()[0], "ext4")
+        self.assertEqual([], model._undo_log)
+
+    def test_rollback(self):
+        model, disk = self.make_model()
+        before = model._render_actions(ActionRenderMode.FOR_API)
+        partitions = disk.partitions()
+        all_ids = set(model._all_ids)
+        model.checkpoint("start")
+
+        fs = model.add_filesystem(partitions[0], "ext4")
+        model.add_mount(fs, "/")
+        model.remove_partition(partitions[1])
+        other = make_disk(model)
+        part = model.add_partition(other, size=1 << 30, offset=1 << 20)
+        esp = model.add_partition(other, size=1 << 30, offset=2 << 30, flag="boot")
+        self.assertEqual([esp, part], other._partitions)
+        model.add_dm_crypt(part, key="passw0rd")
+        model.grub = {"install_devices": [disk.id]}
+        generation = model.generation
+
+        model.rollback("start")
+
+        self.assertNotEqual(generation, model.generation)
+        self.assertEqual(before, model._render_actions(ActionRenderMode.FOR_API))
+        self.assertEqual(partitions, disk.partitions())
+        self.assertEqual(all_ids, model._all_ids)
+        self.assertIsNone(partitions[0]._fs)
+        self.assertIsNone(model._one(id=other.id))
+        self.assertEqual([], model._all(type="dm_crypt"))
+        self.assertIsNone(model.grub)
+
+    def test_rollback_nested(self):
+        model, disk = self.make_model()
+        [p1, p2] = disk.partitions()
+        model.checkpoint("a")
+        model.add_filesystem(p1, "ext4")
+        model.checkpoint("b")
+        model.add_filesystem(p2, "ext4")
+
+        model.rollback("b")
+        self.assertIsNotNone(p1._fs)
+        self.assertIsNone(p2._fs)
+
+        model.rollback("a")
+        self.assertIsNone(p1._fs)
+        with self.assertRaises(KeyError):
+            model.rollback("b")
+        model.add_filesystem(p2, "ext4")
+        model.rollback("a")
+        self.assertIsNone(p2._fs)
+
+    def test_rollback_index(self):
+        model, disk = self.make_model()
+        model.checkpoint("start")
+        model.remove_partition(disk.partitions()[1])
+        disk.serial = "new-serial"
+        model.rollback("start")
+        self.assertIs(disk, model._one(type="disk", serial=disk.serial))
+        self.assertIsNone(model._one(type="disk", serial="new-serial"))
+        self.assertEqual(disk.partitions(), model._all(type="partition", device=disk))
+
+    def test_copies_not_logged(self):
+        model, disk = self.make_model()
+        model.checkpoint("start")
+        disk._reformatted()
+        self.assertEqual([], model._undo_log)
+
+    def test_discard_checkpoint(self):
+        model, disk = self.make_model()
+        model.checkpoint("start")
+        model.add_filesystem(disk.partitions()[0], "ext4")
+        model.discard_checkpoint("start")
+        self.assertEqual([], model._undo_log)
+
+    def load_model(self):
+        with open("examples/machines/existing-partitions.json") as fp:
+            probe_data = json.load(fp)["storage"]
+        model = make_model()
+        model.target = "/target"
+        model.load_probe_data(probe_data)
+        return model
+
+    def remove_partitions(self, model):
+        disk = model.all_disks()[0]
+        for p in list(disk.partitions()):
+            if p._fs is not None:
+                model.remove_filesystem(p._fs)
+            model.remove_partition(p)
+
+    def test_reset_rolls_back(self):
+        model = self.load_model()
+        expected = model._render_actions(ActionRenderMode.FOR_API)
+        model.start_transaction()
+        self.remove_partitions(model)
+        with mock.patch.object(_ProbeSnapshot, "restore") as restore:
+            model.reset()
+        restore.assert_not_called()
+        self.assertEqual(expected, model._render_actions(ActionRenderMode.FOR_API))
+        # The transaction goes on after a reset.
+        self.assertTrue(model.has_checkpoint(PROBE_CHECKPOINT))
+
+    def test_nothing_recorded_outside_transaction(self):
+        model = self.load_model()
+        self.remove_partitions(model)
+        self.assertEqual([], model._undo_log)
+        expected = model._render_actions(ActionRenderMode.FOR_API)
+        # The model is no longer as probed, so reset() could not roll back
+        # to a checkpoint taken now.
+        model.start_transaction()
+        self.assertFalse(model.has_checkpoint(PROBE_CHECKPOINT))
+        model.reset()
+        self.assertNotEqual(expected, model._render_actions(ActionRenderMode.FOR_API))
+
+    def test_end_transaction(self):
+        model = self.load_model()
+        model.start_transaction()
+        self.remove_partitions(model)
+        self.assertNotEqual([], model._undo_log)
+        model.end_transaction()
+        self.assertFalse(model.has_checkpoint(PROBE_CHECKPOINT))
+        self.assertEqual([], model._undo_log)
+        with mock.patch.object(
+            _ProbeSnapshot, "restore", wraps=model._probe_snapshot.restore
+        ) as restore:
+            model.reset()
+        restore.assert_called_once_with(model)
+
+
 class TestPartitionNumbering(unittest.TestCase):
     def setUp(self):
         self.cur_idx = 1
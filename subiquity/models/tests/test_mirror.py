@@ -23,6 +23,7 @@ from subiquity.models.mirror import (
     LegacyPrimaryEntry,
     MirrorModel,
     MirrorSelectionFallback,
+    MirrorSelectionStrategy,
     PrimaryEntry,
     countrify_uri,
 )
@@ -207,6 +208,20 @@ class TestMirrorModel(unittest.TestCase):
             ],
         )
 
+    def test_from_autoinstall_strategy(self):
+        model = MirrorModel()
+        model.load_autoinstall_data({})
+        self.assertEqual(model.selection_strategy, MirrorSelectionStrategy.CONCURRENT)
+        self.assertNotIn("strategy", model.make_autoinstall()["mirror-selection"])
+
+        data = {"mirror-selection": {"strategy": "sequential"}}
+        model = MirrorModel()
+        model.load_autoinstall_data(data)
+        self.assertEqual(model.selection_strategy, MirrorSelectionStrategy.SEQUENTIAL)
+        self.assertEqual(model.primary_candidates, model._default_primary_entries())
+        cfg = model.make_autoinstall()
+        self.assertEqual(cfg["mirror-selection"]["strategy"], "sequential")
+
     def test_disable_add(self):
         def do_test(model, candidate):
             expected = ["things", "stuff"]
@@ -0,0 +1,119 @@
+# Copyright 2025 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from subiquity.common.serialize import to_json
+from subiquity.common.types import Histogram, RouteMetrics
+from subiquitycore.file_util import write_file
+
+log = logging.getLogger("subiquity.server.api_metrics")
+
+# From a millisecond to a minute.
+TIME_BOUNDS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 60.0]
+# From 256 bytes to 16MiB.
+SIZE_BOUNDS = [float(1 << i) for i in range(8, 25, 2)]
+
+
+class _Histogram:
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        value = float(value)
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def snapshot(self) -> Histogram:
+        return Histogram(
+            bounds=self.bounds,
+            counts=self.counts[:],
+            count=self.count,
+            total=self.total,
+            max=self.max,
+        )
+
+
+class _Route:
+    def __init__(self):
+        self.wait_for_start = _Histogram(TIME_BOUNDS)
+        self.implementation = _Histogram(TIME_BOUNDS)
+        self.serialization = _Histogram(TIME_BOUNDS)
+        self.response_size = _Histogram(SIZE_BOUNDS)
+
+
+class APIMetrics:
+    """Keep histograms of how API requests went, for each route.
+
+    The handlers made by subiquity.common.api.server.bind() note how long
+    each part of handling a request took in resp["timings"]; record() is
+    called with every response and adds those to the histograms, along
+    with the size of the response. The time spent in a part of handling
+    a request that was not reached, like serializing the result of an
+    implementation that failed, is not counted.
+    """
+
+    def __init__(self):
+        self._routes: Dict[Tuple[str, str], _Route] = {}
+
+    def record(
+        self,
+        request: web.Request,
+        resp: web.StreamResponse,
+        match_info: Optional[web.UrlMappingMatchInfo] = None,
+    ) -> None:
+        """Add how handling request went. match_info is what the request
+        was routed to, if that is not request.match_info (as for the calls
+        in a batch)."""
+        timings = resp.get("timings")
+        if timings is None:
+            return
+        if match_info is None:
+            match_info = request.match_info
+        key = (request.method, match_info.route.resource.canonical)
+        route = self._routes.get(key)
+        if route is None:
+            route = self._routes[key] = _Route()
+        for name, elapsed in timings.items():
+            getattr(route, name).add(elapsed)
+        # A 304 Not Modified has no body at all.
+        route.response_size.add(len(resp.body or b""))
+
+    def snapshot(self) -> List[RouteMetrics]:
+        return [
+            RouteMetrics(
+                method=method,
+                path=path,
+                wait_for_start=route.wait_for_start.snapshot(),
+                implementation=route.implementation.snapshot(),
+                serialization=route.serialization.snapshot(),
+                response_size=route.response_size.snapshot(),
+            )
+            for (method, path), route in sorted(self._routes.items())
+        ]
+
+    def dump(self, path: str) -> None:
+        log.debug("writing API metrics to %s", path)
+        write_file(path, to_json(List[RouteMetrics], self.snapshot()))
@@ -17,6 +17,7 @@ import asyncio
 import contextlib
 import enum
 import io
+import json
 import logging
 import pathlib
 import random
@@ -24,13 +25,14 @@ import re
 import shutil
 import subprocess
 import tempfile
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 import apt_pkg
 from curtin.commands.extract import AbstractSourceHandler
 from curtin.config import merge_config
 
 from subiquity.server.curtin import run_curtin_command
+from subiquity.server.mirror_probe import MirrorProbeResult, probe_mirrors
 from subiquity.server.mounter import (
     DryRunMounter,
     Mounter,
@@ -38,6 +40,7 @@ from subiquity.server.mounter import (
     OverlayCleanupError,
     OverlayMountpoint,
 )
+from subiquitycore.async_helpers import run_in_thread
 from subiquitycore.file_util import generate_config_yaml, write_file
 from subiquitycore.lsb_release import lsb_release
 from subiquitycore.utils import astart_command, orig_environ
@@ -45,6 +48,11 @@ from subiquitycore.utils import astart_command, orig_environ
 log = logging.getLogger("subiquity.server.apt")
 
 
+# Stands in for the URI of the primary mirror while preparing the apt
+# configuration for mirror testing.
+PRIMARY_URI_PLACEHOLDER = "http://primary-mirror.subiquity.invalid/ubuntu"
+
+
 class AptConfigCheckError(Exception):
     """Error to raise when apt-get update fails with the currently applied
     configuration."""
@@ -122,6 +130,11 @@ class AptConfigurer:
         self.configured_tree: Optional[OverlayMountpoint] = None
         self.install_tree: Optional[OverlayMountpoint] = None
         self.install_mount = None
+        # The apt configuration, minus the primary URI, that configured_tree
+        # was set up with when testing mirrors, and the files in it that
+        # mention the primary URI.
+        self._base_config: Optional[str] = None
+        self._sources_templates: Dict[str, str] = {}
 
     @property
     def source_path(self):
@@ -144,13 +157,49 @@ class AptConfigurer:
         return {"apt": cfg}
 
     async def apply_apt_config(self, context, final: bool):
+        if final:
+            await self._apply_apt_config(context, self.apt_config(final))
+            return
+
+        # When testing mirrors, the configuration only changes in the primary
+        # URI from one candidate to the next, so set up the overlay and run
+        # curtin once with a placeholder URI and then only rewrite the files
+        # the placeholder ended up in for each candidate.
+        config = self.apt_config(final)
+        config["apt"]["primary"] = [
+            {"uri": PRIMARY_URI_PLACEHOLDER, "arches": ["default"]}
+        ]
+        base_config = json.dumps(config, sort_keys=True, default=str)
+        if base_config != self._base_config:
+            await self._apply_apt_config(context, config)
+            self._base_config = base_config
+            self._sources_templates = {}
+            for relpath in ["etc/apt/sources.list"] + apt_sourceparts_files(
+                self.configured_tree
+            ):
+                with contextlib.suppress(FileNotFoundError):
+                    content = self.configured_tree.pp(relpath).read_text()
+                    if PRIMARY_URI_PLACEHOLDER in content:
+                        self._sources_templates[relpath] = content
+        else:
+            log.debug("reusing the apt configuration of the previous candidate")
+
+        uri = self.app.base_model.mirror.primary_staged.uri.rstrip("/")
+        for relpath, template in self._sources_templates.items():
+            write_file(
+                self.configured_tree.p(relpath),
+                template.replace(PRIMARY_URI_PLACEHOLDER, uri),
+                mode=0o644,
+            )
+
+    async def _apply_apt_config(self, context, config) -> None:
         self.configured_tree = await self.mounter.setup_overlay([self.source_path])
 
         config_location = pathlib.Path(self.app.root).joinpath(
             "var/log/installer/curtin-install/subiquity-curtin-apt.conf"
         )
 
-        generate_config_yaml(str(config_location), self.apt_config(final))
+        generate_config_yaml(str(config_location), config)
         self.app.note_data_for_apport("CurtinAptConfig", str(config_location))
 
         await run_curtin_command(
@@ -163,6 +212,46 @@ class AptConfigurer:
             private_mounts=True,
         )
 
+    async def _seed_apt_cache(self, root: str) -> None:
+        if self.app.apt_cache is None:
+            return
+        try:
+            await run_in_thread(self.app.apt_cache.seed, root)
+        except OSError as exc:
+            log.warning("could not seed %s from the apt cache: %r", root, exc)
+
+    async def _store_apt_cache(self, root: str) -> None:
+        if self.app.apt_cache is None:
+            return
+        try:
+            await run_in_thread(self.app.apt_cache.store, root)
+        except OSError as exc:
+            log.warning("could not store %s in the apt cache: %r", root, exc)
+
+    async def probe_mirrors(
+        self, uris: List[str], timeout: float
+    ) -> List[MirrorProbeResult]:
+        """Check which of the mirrors respond, without involving apt."""
+        codename = lsb_release(dry_run=self.app.opts.dry_run)["codename"]
+        keyrings = self.trusted_keyrings()
+        if not keyrings:
+            log.debug("no keyrings found, not checking InRelease signatures")
+        return await probe_mirrors(
+            uris,
+            codename,
+            proxy=self.app.base_model.proxy.proxy or None,
+            timeout=timeout,
+            keyrings=keyrings,
+        )
+
+    def trusted_keyrings(self) -> List[str]:
+        """Return the keyrings that apt in the source trusts by default."""
+        root = pathlib.Path(self.source_path)
+        keyrings = sorted(map(str, root.glob("etc/apt/trusted.gpg.d/*.gpg")))
+        if root.joinpath("etc/apt/trusted.gpg").exists():
+            keyrings.append(str(root.joinpath("etc/apt/trusted.gpg")))
+        return keyrings
+
     async def run_apt_config_check(self, output: io.StringIO) -> None:
         """Run apt-get update (with various options limiting the amount of
         data donwloaded) in the overlay where the apt configuration was
@@ -233,6 +322,7 @@ class AptConfigurer:
 
         if returncode != 0:
             raise AptConfigCheckError
+        await self._store_apt_cache(self.configured_tree.p())
 
     async def configure_for_install(self, context):
         assert self.configured_tree is not None
@@ -263,6 +353,7 @@ class AptConfigurer:
             mode=0o644,
         )
 
+        await self._seed_apt_cache(self.install_tree.p())
         await run_curtin_command(
             self.app,
             context,
@@ -274,6 +365,7 @@ class AptConfigurer:
             "update",
             private_mounts=True,
         )
+        await self._store_apt_cache(self.install_tree.p())
 
         return self.install_tree.p()
 
@@ -346,6 +438,7 @@ class AptConfigurer:
                 "update",
                 private_mounts=True,
             )
+            await self._store_apt_cache(target_mnt.p())
         else:
             for relpath in apt_sourceparts_files(self.configured_tree):
                 _restore_file(relpath)
@@ -363,6 +456,7 @@ class AptConfigurer:
         # system but before any configuration is applied to it.
         target_mnt = Mountpoint(mountpoint=target)
         await self.mounter.mount("/cdrom", target_mnt.p("cdrom"), options="bind")
+        await self._seed_apt_cache(target_mnt.p())
 
 
 class DryRunAptConfigurer(AptConfigurer):
@@ -399,6 +493,35 @@ class DryRunAptConfigurer(AptConfigurer):
             self.app.dr_cfg.apt_mirror_check_default_strategy
         )
 
+    async def probe_mirrors(
+        self, uris: List[str], timeout: float
+    ) -> List[MirrorProbeResult]:
+        """Dry-run implementation of the mirror probing, following the same
+        strategies as run_apt_config_check."""
+        results = {}
+        on_host = []
+        for uri in uris:
+            strategy = self.get_mirror_check_strategy(uri)
+            if strategy == self.MirrorCheckStrategy.RUN_ON_HOST:
+                on_host.append(uri)
+                continue
+            if strategy == self.MirrorCheckStrategy.RANDOM:
+                ok = random.choice([False, True])
+            else:
+                ok = strategy == self.MirrorCheckStrategy.SUCCESS
+            if ok:
+                results[uri] = MirrorProbeResult(
+                    uri=uri, ok=True, ttfb=random.uniform(0.01, 0.1)
+                )
+            else:
+                results[uri] = MirrorProbeResult(
+                    uri=uri, ok=False, error="Temporary failure resolving"
+                )
+        if on_host:
+            for result in await super().probe_mirrors(on_host, timeout):
+                results[result.uri] = result
+        return [results[uri] for uri in uris]
+
     async def apt_config_check_failure(self, output: io.StringIO) -> None:
         """Pretend that the execution of the apt-get update command results in
         a failure."""
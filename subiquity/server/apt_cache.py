@@ -0,0 +1,150 @@
+# Copyright 2025 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Dict, List
+
+from subiquitycore.file_util import write_file
+
+log = logging.getLogger("subiquity.server.apt_cache")
+
+# Where apt keeps the index files, relative to the root of a system.
+APT_LISTS_DIR = "var/lib/apt/lists"
+
+DEFAULT_MAX_SIZE = 256 << 20
+# Never use more than this fraction of the free space left where the cache is.
+FREE_SPACE_FRACTION = 4
+
+
+class AptCache:
+    """Share the index files apt downloads between the trees it runs in.
+
+    apt-get update runs in the overlay used to check a mirror, again in
+    the overlay the system is installed from, and again in the target, and
+    each time starts from nothing unless it finds the files from the time
+    before. store() copies the index files apt downloaded in a tree to the
+    cache and seed() puts the files that the cache has and a tree does not
+    into that tree, so apt finds them there and does not download them
+    again. apt checks index files against the signed InRelease file before
+    using them, so a file that is out of date is just downloaded as if it
+    was not there.
+
+    Each file is stored once, named after the SHA-256 of its content,
+    and hard-linked into place when it is on the same filesystem as the
+    cache, or copied otherwise. The time the files were modified is kept,
+    as apt uses it to ask the mirror whether they have changed. The cache
+    stops storing files once it holds max_size bytes, or would take more
+    than a quarter of the space left on its filesystem.
+
+    store() and seed() are called in threads, so may run at the same time.
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self._index_path = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+        # Maps file name -> digest.
+        self._index: Dict[str, str] = {}
+        with contextlib.suppress(FileNotFoundError, ValueError):
+            with open(self._index_path) as fp:
+                self._index.update(json.load(fp))
+        self._size = sum(
+            entry.stat().st_size
+            for entry in _scandir(os.path.join(directory, "objects"))
+        )
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "objects", digest)
+
+    def _cacheable(self, entry: os.DirEntry) -> bool:
+        return entry.is_file(follow_symlinks=False) and entry.name != "lock"
+
+    def _place(self, src: str, dst: str) -> None:
+        # Hard-link if possible, and fall back to copying when src and dst
+        # are not on the same filesystem.
+        try:
+            os.link(src, dst)
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise
+            shutil.copy2(src, dst)
+
+    def store(self, root: str) -> None:
+        """Add the index files apt downloaded in the system at root."""
+        with self._lock:
+            os.makedirs(os.path.join(self.directory, "objects"), exist_ok=True)
+            # The cache usually lives on a tmpfs, so leave most of it free.
+            budget = min(
+                self.max_size - self._size,
+                shutil.disk_usage(self.directory).free // FREE_SPACE_FRACTION,
+            )
+            added = 0
+            for entry in _scandir(os.path.join(root, APT_LISTS_DIR)):
+                if not self._cacheable(entry):
+                    continue
+                digest = _file_digest(entry.path)
+                obj = self._object_path(digest)
+                if not os.path.exists(obj):
+                    size = entry.stat().st_size
+                    if size > budget:
+                        log.debug("apt cache full, not storing %s", entry.path)
+                        continue
+                    self._place(entry.path, obj)
+                    self._size += size
+                    budget -= size
+                    added += 1
+                self._index[entry.name] = digest
+            write_file(self._index_path, json.dumps(self._index))
+        log.debug("stored %d new files from %s in the apt cache", added, root)
+
+    def seed(self, root: str) -> None:
+        """Put the index files the cache has that are missing from the
+        system at root in place."""
+        with self._lock:
+            files = list(self._index.items())
+        directory = os.path.join(root, APT_LISTS_DIR)
+        seeded = 0
+        for name, digest in files:
+            dst = os.path.join(directory, name)
+            obj = self._object_path(digest)
+            if os.path.exists(dst) or not os.path.exists(obj):
+                continue
+            os.makedirs(directory, exist_ok=True)
+            self._place(obj, dst)
+            seeded += 1
+        log.debug("seeded %d files from the apt cache into %s", seeded, root)
+
+
+def _scandir(path: str) -> List[os.DirEntry]:
+    try:
+        return list(os.scandir(path))
+    except FileNotFoundError:
+        return []
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
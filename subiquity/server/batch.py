@@ -0,0 +1,153 @@
+# Copyright 2025 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Make several API calls in one request.
+
+POST /batch takes a JSON list of calls, each an object like:
+
+    {"method": "GET", "path": "/storage/v2", "query": {"wait": "true"},
+     "payload": ...}
+
+where "query" and "payload" are optional, and returns a JSON list with
+the result of each call, in the same order:
+
+    {"status": 200, "headers": {"x-status": "ok", ...}, "body": ...}
+
+Only the endpoints bound with subiquity.common.api.server.bind can be
+called. Each call is routed to the handler of its endpoint, which is
+given the payload as already decoded from the batch, and goes through
+the call function the batch handler was made with. The server passes
+the function its middleware uses, so "headers" has the same x-status,
+x-error-* and x-updated headers as a request for that call would get.
+"body" is the JSON response, or the text of the traceback for an error.
+Query values are strings, as they would be in a URL, and a call with no
+payload is made as if its payload was null.
+
+Runs of GET calls are made concurrently, other calls one at a time in
+order, so a GET after a POST sees what the POST did.
+"""
+
+import asyncio
+import json
+from typing import Any, Awaitable, Callable
+
+from aiohttp import web
+from yarl import URL
+
+# Headers of the batch request that make no sense for the calls in it.
+_BODY_HEADERS = {
+    "accept",
+    "content-length",
+    "content-type",
+    "if-none-match",
+    "transfer-encoding",
+}
+
+CallHandler = Callable[..., Awaitable[web.StreamResponse]]
+
+
+async def call_handler(request: web.Request, handler, **bind_kw) -> web.StreamResponse:
+    """Call handler for request without any middleware."""
+    return await handler(request, **bind_kw)
+
+
+def _call_json(resp: web.Response) -> str:
+    headers = {k: v for k, v in resp.headers.items() if k.lower().startswith("x-")}
+    if not resp.body:
+        body = "null"
+    elif resp.content_type == "application/json":
+        # Already JSON, so avoid parsing it just to encode it again.
+        body = resp.text
+    else:
+        body = json.dumps(resp.text)
+    status = json.dumps(resp.status)
+    headers = json.dumps(headers)
+    return f'{{"status": {status}, "headers": {headers}, "body": {body}}}'
+
+
+class _Call:
+    def __init__(self, template: web.Request, call):
+        if not isinstance(call, dict):
+            raise web.HTTPBadRequest(text=f"call {call!r} is not an object")
+        try:
+            self.method = call["method"].upper()
+            url = URL(call["path"]).update_query(call.get("query", {}))
+        except (AttributeError, KeyError, TypeError, ValueError) as exc:
+            raise web.HTTPBadRequest(text=f"bad call {call!r}: {exc}")
+        self.payload: Any = call.get("payload")
+        headers = {
+            k: v for k, v in template.headers.items() if k.lower() not in _BODY_HEADERS
+        }
+        self.request = template.clone(method=self.method, rel_url=url, headers=headers)
+        self.match_info = None
+
+    async def resolve(self, app: web.Application) -> None:
+        self.match_info = await app.router.resolve(self.request)
+        if self.match_info.http_exception is not None:
+            # Not found or method not allowed, which is the call's result.
+            return
+        if not hasattr(self.match_info.handler, "controller"):
+            raise web.HTTPBadRequest(
+                text=f"{self.method} {self.request.path} cannot be batched"
+            )
+
+    async def run(self, call: CallHandler) -> str:
+        resp = self.match_info.http_exception
+        if resp is None:
+            resp = await call(
+                self.request,
+                self.match_info.handler,
+                payload=self.payload,
+                match_info=self.match_info,
+            )
+        return _call_json(resp)
+
+
+def make_batch_handler(call: CallHandler = call_handler):
+    """Return a handler for POST /batch that makes each call in the batch
+    with call(request, handler, payload=..., match_info=...)."""
+
+    async def handle_batch(request: web.Request) -> web.Response:
+        # A request cannot be cloned once its body has been read.
+        template = request.clone()
+        try:
+            calls = await request.json()
+        except ValueError as exc:
+            raise web.HTTPBadRequest(text=f"body is not JSON: {exc}")
+        if not isinstance(calls, list):
+            raise web.HTTPBadRequest(text="body must be a list of calls")
+        calls = [_Call(template, c) for c in calls]
+        for c in calls:
+            await c.resolve(request.app)
+
+        results = []
+        i = 0
+        while i < len(calls):
+            if calls[i].method != "GET":
+                results.append(await calls[i].run(call))
+                i += 1
+                continue
+            j = i
+            while j < len(calls) and calls[j].method == "GET":
+                j += 1
+            results.extend(await asyncio.gather(*(c.run(call) for c in calls[i:j])))
+            i = j
+        return web.Response(
+            text="[" + ", ".join(results) + "]",
+            content_type="application/json",
+            headers={"x-status": "ok"},
+        )
+
+    return handle_batch
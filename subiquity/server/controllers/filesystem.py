@@ -23,7 +23,18 @@ import pathlib
 import shutil
 import subprocess
 import time
-from typing import Any, Callable, Dict, List, Optional, Sequence, Type, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 
 import attr
 import pyudev
@@ -58,6 +69,7 @@ from subiquity.common.types.storage import (
     ProbeStatus,
     RecoveryKey,
     ReformatDisk,
+    RenderCacheStats,
     SizingPolicy,
     StorageResponse,
     StorageResponseV2,
@@ -80,6 +92,7 @@ from subiquity.models.filesystem import (
     align_down,
     align_up,
     humanize_size,
+    merge_device_probe_data,
 )
 from subiquity.server.autoinstall import AutoinstallError
 from subiquity.server.controller import SubiquityController
@@ -97,11 +110,12 @@ from subiquity.server.types import InstallerChannels
 from subiquitycore.async_helpers import (
     SingleInstanceTask,
     TaskAlreadyRunningError,
+    run_in_thread,
     schedule_task,
 )
 from subiquitycore.context import with_context
 from subiquitycore.lsb_release import lsb_release
-from subiquitycore.utils import arun_command, gen_zsys_uuid, run_command
+from subiquitycore.utils import arun_command, gen_zsys_uuid
 
 log = logging.getLogger("subiquity.server.controllers.filesystem")
 block_discover_log = logging.getLogger("block-discover")
@@ -286,6 +300,149 @@ def validate_pin_pass(
         raise StorageRecoverableError("pin is a string of digits")
 
 
+@attr.s(auto_attribs=True)
+class ScenarioResult:
+    # The first capability the scenario could be applied with, if any.
+    capability: Optional[GuidedCapability]
+    # Seconds it took to try the scenario.
+    elapsed: float
+    # Why applying the scenario failed with each capability, if it did.
+    error: Optional[str] = None
+
+
+class ScenarioEvaluator:
+    """Check that guided scenarios can actually be applied.
+
+    Anticipating everything that can make guided() fail for a scenario
+    (such as "Exceeded number of available partitions") is hard, so this
+    applies each scenario to a scratch copy of the storage model and
+    records whether it worked and how long it took. A scenario is tried
+    with each of its allowed capabilities in turn until one works.
+
+    Trying every scenario takes a while on a machine with many disks, so
+    evaluate() never waits for it: it returns what is already known and
+    tries the rest in the background. The scenarios are shared out
+    between at most max_workers threads, each applying its share to a
+    clone of the model of its own, rolled back to a checkpoint between
+    scenarios. When they are done, the storage state is marked as
+    changed so that the guided response is recomputed with the results
+    and clients following the event stream hear about it. Results are
+    kept until the storage state changes otherwise.
+    """
+
+    CHECKPOINT = "scenario"
+
+    def __init__(
+        self, controller: "FilesystemController", max_workers: Optional[int] = None
+    ):
+        self.controller = controller
+        if max_workers is None:
+            # guided() is mostly Python code, so more threads than this
+            # only cost more clones of the model.
+            max_workers = min(4, os.cpu_count() or 1)
+        self.max_workers = max_workers
+        self._state: Optional[tuple] = None
+        self._results: Dict[str, ScenarioResult] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def capabilities_for(target: GuidedStorageTarget) -> List[GuidedCapability]:
+        """The capabilities to try target with, in order.
+
+        Core boot scenarios need snapd to be applied, so they are not
+        tried."""
+        return [
+            capability
+            for capability in target.allowed
+            if not capability.is_core_boot() and capability != GuidedCapability.MANUAL
+        ]
+
+    async def _try_all(self, scratch: "_ScratchFilesystemController", todo):
+        results = {}
+        scratch.model.checkpoint(self.CHECKPOINT)
+        for key, target, capabilities in todo:
+            start = time.perf_counter()
+            errors = []
+            for capability in capabilities:
+                choice = GuidedChoiceV2(target=target, capability=capability)
+                try:
+                    await scratch.guided(choice)
+                except Exception as exc:
+                    errors.append(f"{capability.name}: {type(exc).__name__}: {exc}")
+                else:
+                    break
+                finally:
+                    scratch.model.rollback(self.CHECKPOINT)
+            else:
+                capability = None
+            results[key] = ScenarioResult(
+                capability=capability,
+                elapsed=time.perf_counter() - start,
+                error="; ".join(errors) if capability is None else None,
+            )
+            log.debug("tried guided scenario %s: %s", key, results[key])
+        return results
+
+    def _run(self, scratch, todo) -> Dict[str, ScenarioResult]:
+        # guided() is a coroutine, but only awaits anything for the reset
+        # partition, which is never part of a target, so a loop private to
+        # the thread is enough to run it.
+        return asyncio.run(self._try_all(scratch, todo))
+
+    async def _evaluate(self, state: tuple, todo) -> None:
+        workers = min(self.max_workers, len(todo))
+        # The clones are made here, on the loop, so that they are consistent.
+        scratches = [
+            _ScratchFilesystemController(self.controller) for _ in range(workers)
+        ]
+        shares = await asyncio.gather(
+            *(
+                run_in_thread(self._run, scratch, todo[i::workers])
+                for i, scratch in enumerate(scratches)
+            )
+        )
+        self._task = None
+        if state != self.controller._response_state():
+            return
+        for results in shares:
+            self._results.update(results)
+        self.controller.storage_changed()
+        self._state = self.controller._response_state()
+
+    def evaluate(
+        self, targets: Sequence[GuidedStorageTarget]
+    ) -> Dict[str, ScenarioResult]:
+        """Return the results known for targets, keyed by repr(target).
+
+        Targets not tried yet are left out and tried in the background, as
+        are targets that cannot be tried (see capabilities_for)."""
+        state = self.controller._response_state()
+        if state != self._state:
+            self._state = state
+            self._results = {}
+            if self._task is not None:
+                self._task.cancel()
+                self._task = None
+        results = {}
+        todo = []
+        for target in targets:
+            key = repr(target)
+            if key in self._results:
+                results[key] = self._results[key]
+                continue
+            capabilities = self.capabilities_for(target)
+            if capabilities:
+                todo.append((key, target, capabilities))
+        if todo and self._task is None:
+            self._task = schedule_task(self._evaluate(state, todo))
+        return results
+
+    async def wait(self) -> None:
+        """Wait for the scenarios being tried, if any."""
+        if self._task is not None:
+            await self._task
+
+
 class FilesystemController(SubiquityController, FilesystemManipulator):
     endpoint = API.storage
 
@@ -326,8 +483,22 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         self._role_to_device: Dict[Union[str, snapdtypes.Role], _Device] = {}
         self._device_to_structure: Dict[_Device, snapdtypes.OnVolume] = {}
         self._pyudev_context: Optional[pyudev.Context] = None
+        # Maps the device node of each block device udev has told us about
+        # since the last probe started to the most recent action for it.
+        self._udev_changes: Dict[str, str] = {}
+        self._udev_timer: Optional[asyncio.TimerHandle] = None
+        self._udev_settle_task = SingleInstanceTask(self._udev_settle)
         self.use_tpm: bool = False
         self.locked_probe_data: bool = False
+        self._scenario_evaluator = ScenarioEvaluator(self)
+        # Bumped whenever something other than the model's actions that
+        # the v2 GET responses depend on may have changed.
+        self._storage_generation = 0
+        # Maps a GET method to the state it was computed in and the
+        # response, see _cached_response.
+        self._response_cache: Dict[str, Tuple[tuple, Any]] = {}
+        # Let clients of the event stream know when to GET again.
+        self.app.event_stream.watch("storage", self._response_state)
         # If probe data come in while we are doing partitioning, store it in
         # this variable. It will be picked up on next reset.
         self.queued_probe_data: Optional[Dict[str, Any]] = None
@@ -360,6 +531,9 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
 
     async def configured(self):
         self._configured = True
+        # Stop recording changes for v2_reset_POST. A reset after this
+        # restores the probe snapshot instead.
+        self.model.end_transaction()
         if self._info is None:
             self.set_info_for_capability(GuidedCapability.DIRECT)
         if (
@@ -458,6 +632,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
                 )
 
     async def _examine_systems(self):
+        self.storage_changed()
         self._variation_info.clear()
         catalog_entry = self.app.base_model.source.current
         for name, variation in catalog_entry.variations.items():
@@ -508,6 +683,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
             else:
                 info = VariationInfo.classic(name=name, min_size=variation.size)
             self._variation_info[name] = info
+            self.storage_changed()
 
     @with_context()
     async def apply_autoinstall_config(self, context=None):
@@ -771,6 +947,13 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
     ) -> None:
         choice.validate()
 
+        self.storage_changed()
+        try:
+            await self._guided(choice, reset_partition_only)
+        finally:
+            self.storage_changed()
+
+    async def _guided(self, choice: GuidedChoiceV2, reset_partition_only: bool):
         self.model.dd_target = None
         if choice.capability == GuidedCapability.MANUAL:
             return
@@ -864,7 +1047,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
             status=ProbeStatus.DONE,
             bootloader=self.model.bootloader,
             error_report=self.full_probe_error(),
-            orig_config=self.model._orig_config,
+            orig_config=list(self.model._orig_config),
             config=self.model._render_actions(mode=ActionRenderMode.FOR_API),
             dasd=self.model._probe_data.get("dasd", {}),
             storage_version=self.model.storage_version,
@@ -881,6 +1064,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
 
     async def POST(self, config: list):
         log.debug(config)
+        self.storage_changed()
         self.model._actions = self.model._actions_from_config(
             config, blockdevs=self.model._probe_data["blockdev"], is_probe_data=False
         )
@@ -999,7 +1183,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
                 self._role_to_device[structure.role] = part
             self._device_to_structure[part] = structure
 
-        disk._partitions.sort(key=lambda p: p.number)
+        disk._partitions = sorted(disk._partitions, key=lambda p: p.number)
 
     def _on_volumes(self) -> Dict[str, snapdtypes.OnVolume]:
         # Return a value suitable for use as the 'on-volumes' part of a
@@ -1127,6 +1311,12 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
     async def generate_recovery_key_GET(self) -> str:
         return self.model.generate_recovery_key()
 
+    async def render_cache_GET(self) -> RenderCacheStats:
+        return RenderCacheStats(
+            hits=self.model.render_cache_hits,
+            misses=self.model.render_cache_misses,
+        )
+
     async def supports_nvme_tcp_booting_GET(self, wait: bool = False) -> Optional[bool]:
         if self.model.opt_supports_nvme_tcp_booting is not None:
             # No need to wait for the task to finish if the CLI arg is present.
@@ -1140,12 +1330,46 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
 
         return self.model.supports_nvme_tcp_booting
 
+    def storage_changed(self) -> None:
+        """Note that the responses of the v2 GET methods may have changed.
+
+        Changes to the model's actions are noticed anyway, through
+        model.generation; this is for everything else."""
+        self._storage_generation += 1
+        self.app.event_stream.changed()
+
+    def _response_state(self) -> tuple:
+        return (id(self.model), self.model.generation, self._storage_generation)
+
+    def _cached_response(self, name: str):
+        entry = self._response_cache.get(name)
+        if entry is not None and entry[0] == self._response_state():
+            return entry[1]
+        return None
+
+    def _cache_response(self, name: str, state: tuple, response) -> None:
+        # Only keep the response if nothing changed while computing it.
+        if state == self._response_state():
+            self._response_cache[name] = (state, response)
+
     async def v2_GET(
         self,
         wait: bool = False,
         include_raid: bool = False,
     ) -> StorageResponseV2:
-        return await self.get_v2_storage_response(self.model, wait, include_raid)
+        probe_resp = await self._probe_response(wait, StorageResponseV2)
+        if probe_resp is not None:
+            return probe_resp
+        # The response is shared between calls, so must not be modified.
+        name = f"v2_GET(include_raid={include_raid})"
+        response = self._cached_response(name)
+        if response is None:
+            state = self._response_state()
+            response = await self.get_v2_storage_response(
+                self.model, wait, include_raid
+            )
+            self._cache_response(name, state, response)
+        return response
 
     async def v2_POST(self) -> StorageResponseV2:
         await self.configured()
@@ -1157,6 +1381,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
 
     async def v2_reset_POST(self) -> StorageResponseV2:
         log.info("Resetting Filesystem model")
+        self.storage_changed()
         # From the API standpoint, it seems sound to set locked_probe_data back
         # to False after a reset. But in practise, v2_reset_POST can be called
         # during manual partitioning ; and we don't want to reenable automatic
@@ -1172,6 +1397,9 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
 
     async def v2_ensure_transaction_POST(self) -> None:
         self.locked_probe_data = True
+        # From here on the changes are recorded so that v2_reset_POST can
+        # roll back to the start of the transaction by undoing them.
+        self.model.start_transaction()
 
     def get_classic_capabilities(self):
         classic_capabilities = set()
@@ -1375,12 +1603,15 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         probe_resp = await self._probe_response(wait, GuidedStorageResponseV2)
         if probe_resp is not None:
             return probe_resp
-
-        # TODO We should probably use temporary copies of the storage model and
-        # try to apply each scenario that we want to return. If an error is
-        # encountered when applying a scenario, we should skip it and log why.
-        # This should avoid problems such as "Exceeded number of available
-        # partitions" that we struggle to manually anticipate.
+        # The response is shared between calls, so must not be modified.
+        response = self._cached_response("v2_guided_GET")
+        if response is None:
+            state = self._response_state()
+            response = await self._v2_guided_response()
+            self._cache_response("v2_guided_GET", state, response)
+        return response
+
+    async def _v2_guided_response(self) -> GuidedStorageResponseV2:
         scenarios = []
         install_min = self.calculate_suggested_install_min()
 
@@ -1407,6 +1638,23 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         scenarios.extend(self.available_target_resize_scenarios(install_min))
         scenarios.extend(self.available_erase_install_scenarios(install_min))
 
+        # Skip any scenario that fails when applied to a scratch copy of
+        # the model, rather than offering something that cannot work. Until
+        # the scenarios have been tried, they are all offered.
+        results = self._scenario_evaluator.evaluate([s[1] for s in scenarios])
+        usable = []
+        for size, target in scenarios:
+            result = results.get(repr(target))
+            if result is not None and result.error is not None:
+                log.warning(
+                    "skipping guided scenario %s, applying it failed: %s",
+                    target,
+                    result.error,
+                )
+                continue
+            usable.append((size, target))
+        scenarios = usable
+
         scenarios.sort(reverse=True, key=lambda x: x[0])
         return GuidedStorageResponseV2(
             status=ProbeStatus.DONE,
@@ -1428,12 +1676,14 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
 
     async def v2_reformat_disk_POST(self, data: ReformatDisk) -> StorageResponseV2:
         self.locked_probe_data = True
+        self.storage_changed()
         self.reformat(self.model._one(id=data.disk_id), data.ptable)
         return await self.v2_GET()
 
     async def v2_add_boot_partition_POST(self, disk_id: str) -> StorageResponseV2:
         log.debug("v2_add_boot_partition: disk-id: %s", disk_id)
         self.locked_probe_data = True
+        self.storage_changed()
         disk = self.model._one(id=disk_id)
         if disk.ptable == "unsupported":
             raise StorageRecoverableError(
@@ -1449,6 +1699,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
     async def v2_add_partition_POST(self, data: AddPartitionV2) -> StorageResponseV2:
         log.debug(data)
         self.locked_probe_data = True
+        self.storage_changed()
         if data.partition.boot is not None:
             raise ValueError("add_partition does not support changing boot")
         disk = self.model._one(id=data.disk_id)
@@ -1483,6 +1734,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
     ) -> StorageResponseV2:
         log.debug(data)
         self.locked_probe_data = True
+        self.storage_changed()
         disk = self.model._one(id=data.disk_id)
         if disk.ptable == "unsupported":
             raise StorageRecoverableError(
@@ -1497,6 +1749,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
     ) -> StorageResponseV2:
         log.debug(data)
         self.locked_probe_data = True
+        self.storage_changed()
         disk = self.model._one(id=data.disk_id)
         if disk.ptable == "unsupported":
             raise StorageRecoverableError(
@@ -1545,6 +1798,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         """Delete the VG specified by its ID. Any associated LV will be deleted
         as well."""
         self.locked_probe_data = True
+        self.storage_changed()
 
         if (vg := self.model._one(type="lvm_volgroup", id=id)) is None:
             raise StorageRecoverableError(f"could not find existing VG '{id}'")
@@ -1556,6 +1810,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
     async def v2_logical_volume_DELETE(self, id: str) -> StorageResponseV2:
         """Delete the LV specified by its ID."""
         self.locked_probe_data = True
+        self.storage_changed()
 
         if (lv := self.model._one(type="lvm_partition", id=id)) is None:
             raise StorageRecoverableError(f"could not find existing LV '{id}'")
@@ -1568,6 +1823,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         """Delete the Raid specified by its ID. Any associated partition will
         be deleted as well."""
         self.locked_probe_data = True
+        self.storage_changed()
 
         if (raid := self.model._one(type="raid", id=id)) is None:
             raise StorageRecoverableError(f"could not find existing RAID '{id}'")
@@ -1626,18 +1882,73 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         # https://bugs.launchpad.net/bugs/1954848).
         if self._configured:
             return
+        self._load_probe_data(storage, fname, key)
+
+    def _load_probe_data(self, storage, fname, key, **kw):
         fpath = os.path.join(self.app.block_log_dir, fname)
         with open(fpath, "w") as fp:
             json.dump(storage, fp, indent=4)
         self.app.note_file_for_apport(key, fpath)
         if not self.locked_probe_data:
             self.queued_probe_data = None
-            self.model.load_probe_data(storage)
+            self.model.load_probe_data(storage, **kw)
+            self.storage_changed()
         else:
             self.queued_probe_data = storage
 
+    @with_context()
+    async def _probe_devices(self, *, context, paths: Set[str]) -> bool:
+        """Probe only the block devices in paths (and the partitions on
+        them) and merge the results into the existing probe data.
+
+        Returns False if everything needs to be probed instead.
+        """
+        if self._errors or self.app.opts.use_os_prober:
+            # There is nothing complete to merge into after a failed
+            # probe, and os-prober looks at every device anyway.
+            return False
+        probe_data = self.model._probe_data
+        if self.queued_probe_data is not None:
+            probe_data = self.queued_probe_data
+        if probe_data is None:
+            return False
+        probe_types = {"blockdev", "filesystem", "filesystem_sizing", "mount"}
+        start = time.time()
+        try:
+            partial = await asyncio.wait_for(
+                self.app.prober.get_storage_for_devices(paths, probe_types),
+                self.app.opts.block_probing_timeout,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            block_discover_log.exception("probing %s failed", sorted(paths))
+            return False
+        finally:
+            elapsed = time.time() - start
+            log.debug(f"probing {len(paths)} devices took {elapsed:.1f} seconds")
+        if self._configured:
+            return True
+        merged = merge_device_probe_data(probe_data, partial, paths)
+        if merged is None:
+            log.debug("changed devices are not all plain disks, probing everything")
+            return False
+        storage, disks = merged
+        kw = {}
+        if probe_data is self.model._probe_data:
+            # Otherwise the model has not seen the queued probe data yet.
+            kw["disks"] = disks
+        self._load_probe_data(storage, "probe-data.json", "ProbeData", **kw)
+        return True
+
     @with_context()
     async def _probe(self, *, context=None):
+        changes, self._udev_changes = self._udev_changes, {}
+        if changes:
+            log.debug("probing after udev events for %s", sorted(changes))
+            if await self._probe_devices(context=context, paths=set(changes)):
+                self.start_monitor()
+                return
         self._errors = {}
         for restricted, kind, short_label in [
             (False, ErrorReportKind.BLOCK_PROBE_FAIL, "block"),
@@ -1718,6 +2029,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
             log.debug("but CLI argument states otherwise, so ignoring")
 
         self.model.detected_supports_nvme_tcp_booting = assume_supported
+        self.storage_changed()
 
     def get_bootable_matching_disks(
         self, match: MatchDirective | Sequence[MatchDirective]
@@ -1930,7 +2242,7 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         await self._probe_firmware_task.start()
 
     def start_monitor(self):
-        if self._configured:
+        if self._configured or self._monitor is not None:
             return
 
         log.debug("start_monitor")
@@ -1943,6 +2255,10 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         loop.add_reader(self._monitor.fileno(), self._udev_event)
 
     def stop_monitor(self):
+        if self._udev_timer is not None:
+            self._udev_timer.cancel()
+            self._udev_timer = None
+
         if self._monitor is None:
             return
 
@@ -1960,21 +2276,50 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         else:
             log.debug("Triggered Probert run on udev event")
 
+    def _drain_udev_events(self):
+        while True:
+            device = self._monitor.poll(timeout=0)
+            if device is None:
+                return
+            if device.device_node is not None:
+                self._udev_changes[device.device_node] = device.action
+
     def _udev_event(self):
-        # We outright stop monitoring because we're not super concerned about
-        # the specifics of the udev event, only that one happened and that when
-        # the events settle, we want to reprobe.  This is significantly faster
-        # than keeping a monitor around and draining the event queue.
+        # A hotplug storm (say a SAN rescan adding hundreds of LUNs) delivers
+        # a great many events in quick succession.  Drain whatever is queued
+        # without blocking, note which devices changed and push back the
+        # reprobe until no new event has arrived for a quiet window.
         # LP: #2009141
-        self.stop_monitor()
+        self._drain_udev_events()
+        if (
+            self._udev_settle_task.task is not None
+            and not self._udev_settle_task.done()
+        ):
+            # The window has already closed, the settle picks these up.
+            return
+        if self._udev_timer is not None:
+            self._udev_timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._udev_timer = loop.call_later(
+            self.app.opts.udev_quiet_window, self._udev_quiet
+        )
 
-        cp = run_command(["udevadm", "settle", "-t", "0"])
+    def _udev_quiet(self):
+        self._udev_timer = None
+        self._udev_settle_task.start_sync()
 
-        if cp.returncode != 0:
+    async def _udev_settle(self):
+        while True:
+            cp = await arun_command(["udevadm", "settle", "-t", "0"])
+            if cp.returncode == 0:
+                break
             log.debug("waiting 0.1 to let udev event queue settle")
-            loop = asyncio.get_running_loop()
-            loop.call_later(0.1, self._udev_event)
+            await asyncio.sleep(0.1)
+        if self._monitor is None:
             return
+        self._drain_udev_events()
+        # The probe restarts the monitor once it is done.
+        self.stop_monitor()
         self.ensure_probing()
 
     def make_autoinstall(self):
@@ -2025,3 +2370,31 @@ class FilesystemController(SubiquityController, FilesystemManipulator):
         # needed.
         if shutil.which("zpool") is not None:
             await self.app.command_runner.run(["zpool", "export", "-a"])
+
+
+class _ScratchFilesystemController(FilesystemController):
+    """A controller that applies guided scenarios to a clone of the model
+    of another one, for ScenarioEvaluator.
+
+    It has its own copy of the state guided() uses, and none of the
+    tasks, subscriptions or caches a real controller has."""
+
+    def __init__(self, controller: FilesystemController):
+        # Not calling super().__init__(), which sets all of that up.
+        self.app = controller.app
+        self.opts = controller.opts
+        self.context = controller.context
+        self.model = controller.model.clone()
+        self._variation_info = dict(controller._variation_info)
+        self._info = None
+        self._on_volume = None
+        self._volumes_auth = None
+        self._role_to_device = {}
+        self._device_to_structure = {}
+        self.supports_resilient_boot = controller.supports_resilient_boot
+        self.use_tpm = False
+        self.locked_probe_data = True
+        self.reset_partition_only = False
+
+    def storage_changed(self) -> None:
+        pass
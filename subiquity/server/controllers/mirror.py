@@ -16,6 +16,7 @@
 import asyncio
 import io
 import logging
+import time
 from typing import List, Optional
 
 import attr
@@ -28,10 +29,13 @@ from subiquity.common.types import (
     MirrorPost,
     MirrorPostResponse,
     MirrorSelectionFallback,
+    MirrorSelectionStrategy,
 )
-from subiquity.models.mirror import filter_candidates
+from subiquity.models.mirror import BasePrimaryEntry, filter_candidates
 from subiquity.server.apt import AptConfigCheckError, AptConfigurer, get_apt_configurer
 from subiquity.server.controller import SubiquityController
+from subiquity.server.mirror_cache import CachedMirrorCheck, MirrorCheckCache
+from subiquity.server.mirror_probe import PROBE_TIMEOUT, rank_probe_results
 from subiquity.server.types import InstallerChannels
 from subiquitycore.context import with_context
 
@@ -50,10 +54,14 @@ class MirrorCheckNotStartedError(Exception):
 
 @attr.s(auto_attribs=True)
 class MirrorCheck:
-    task: asyncio.Task
+    # None if the result of an earlier check was reused.
+    task: Optional[asyncio.Task]
     output: io.StringIO
     uri: str
 
+    def done(self) -> bool:
+        return self.task is None or self.task.done()
+
 
 class MirrorController(SubiquityController):
     endpoint = API.mirror
@@ -89,6 +97,10 @@ class MirrorController(SubiquityController):
                             ],
                         },
                     },
+                    "strategy": {
+                        "type": "string",
+                        "enum": [st.value for st in MirrorSelectionStrategy],
+                    },
                 },
             },
             "geoip": {"type": "boolean"},
@@ -155,8 +167,12 @@ class MirrorController(SubiquityController):
         self.test_apt_configurer: Optional[AptConfigurer] = None
         self.final_apt_configurer: Optional[AptConfigurer] = None
         self.mirror_check: Optional[MirrorCheck] = None
+        self.mirror_check_cache: Optional[MirrorCheckCache] = None
         self.autoinstall_apply_started = False
 
+    def start(self):
+        self.mirror_check_cache = MirrorCheckCache(self.app.state_path("mirror-checks"))
+
     def load_autoinstall_data(self, data):
         if data is None:
             return
@@ -196,6 +212,50 @@ class MirrorController(SubiquityController):
             log.debug("Skipping mirror check since network is not available.")
             return
 
+        if self.model.selection_strategy == MirrorSelectionStrategy.CONCURRENT:
+            candidate = await self.find_candidate_mirror_concurrently(context)
+            if candidate is not None:
+                candidate.elect()
+                return
+            log.debug("Falling back to checking the candidate mirrors in turn.")
+
+        await self.find_and_elect_candidate_mirror_sequentially()
+
+    async def find_candidate_mirror_concurrently(
+        self, context
+    ) -> Optional[BasePrimaryEntry]:
+        """Probe all the candidates at once and run the full mirror check
+        on the ones that responded, best first. Return the first one that
+        passes, or None."""
+        await self.source_configured_event.wait()
+        configurer = self.test_apt_configurer
+        if configurer is None:
+            # i.e. core, where there is nothing to probe.
+            return None
+        candidates = {}
+        for candidate in self.model.compatible_primary_candidates():
+            if candidate.uri is None:
+                log.debug("Skipping unresolved country mirror")
+                continue
+            candidates.setdefault(candidate.uri, candidate)
+        if not candidates:
+            return None
+
+        with context.child("probing"):
+            results = await configurer.probe_mirrors(list(candidates), PROBE_TIMEOUT)
+        for result in rank_probe_results(results):
+            candidate = candidates[result.uri]
+            log.debug("Checking %s", candidate.serialize_for_ai())
+            candidate.stage()
+            try:
+                await self.try_mirror_checking_once()
+            except AptConfigCheckError:
+                log.debug("Mirror is not usable.")
+            else:
+                return candidate
+        return None
+
+    async def find_and_elect_candidate_mirror_sequentially(self):
         # Try each mirror one after another.
         compatibles = self.model.compatible_primary_candidates()
         for idx, candidate in enumerate(compatibles):
@@ -339,8 +399,44 @@ class MirrorController(SubiquityController):
         if configurer is None:
             # i.e. core
             return
+        key = self._mirror_check_key(configurer)
+        cached = self._cached_mirror_check(key)
+        if cached is not None:
+            output.write(cached.output)
+            return
+        start = time.monotonic()
         await configurer.apply_apt_config(self.context, final=False)
         await configurer.run_apt_config_check(output)
+        if key is not None:
+            staged = self.model.primary_staged
+            check = CachedMirrorCheck(
+                uri=staged.uri if staged is not None else None,
+                output=output.getvalue(),
+                elapsed=time.monotonic() - start,
+                checked_at=time.time(),
+            )
+            self.mirror_check_cache.put(key, check)
+
+    def _mirror_check_key(self, configurer: AptConfigurer) -> Optional[str]:
+        if self.mirror_check_cache is None:
+            return None
+        return self.mirror_check_cache.key(
+            configurer.apt_config(final=False),
+            self.app.base_model.proxy.proxy,
+            self.app.base_model.source.current.id,
+        )
+
+    def _cached_mirror_check(self, key: Optional[str]) -> Optional[CachedMirrorCheck]:
+        if key is None:
+            return None
+        cached = self.mirror_check_cache.get(key)
+        if cached is not None:
+            log.debug(
+                "mirror check of %s passed %ds ago, not running it again",
+                cached.uri,
+                time.time() - cached.checked_at,
+            )
+        return cached
 
     async def wait_config(self, variation_name: str) -> AptConfigurer:
         self.final_apt_configurer = get_apt_configurer(
@@ -438,14 +534,23 @@ class MirrorController(SubiquityController):
         self.model.disabled_components = set(data)
 
     async def check_mirror_start_POST(self, cancel_ongoing: bool = False) -> None:
-        if self.mirror_check is not None and not self.mirror_check.task.done():
+        if self.mirror_check is not None and not self.mirror_check.done():
             if cancel_ongoing:
                 await self.check_mirror_abort_POST()
             else:
                 assert False
         output = io.StringIO()
+        uri = self.model.primary_staged.uri
+        configurer = self.test_apt_configurer
+        if self.source_configured_event.is_set() and configurer is not None:
+            cached = self._cached_mirror_check(self._mirror_check_key(configurer))
+            if cached is not None:
+                # Nothing to run, so the check is already done.
+                output.write(cached.output)
+                self.mirror_check = MirrorCheck(task=None, output=output, uri=uri)
+                return
         self.mirror_check = MirrorCheck(
-            uri=self.model.primary_staged.uri,
+            uri=uri,
             task=asyncio.create_task(self.run_mirror_testing(output)),
             output=output,
         )
@@ -453,11 +558,10 @@ class MirrorController(SubiquityController):
     async def check_mirror_progress_GET(self) -> Optional[MirrorCheckResponse]:
         if self.mirror_check is None:
             return None
-        if self.mirror_check.task.done():
-            if self.mirror_check.task.exception():
-                log.warning(
-                    "Mirror check failed: %r", self.mirror_check.task.exception()
-                )
+        task = self.mirror_check.task
+        if self.mirror_check.done():
+            if task is not None and task.exception():
+                log.warning("Mirror check failed: %r", task.exception())
                 status = MirrorCheckStatus.FAILED
             else:
                 status = MirrorCheckStatus.OK
@@ -473,7 +577,8 @@ class MirrorController(SubiquityController):
     async def check_mirror_abort_POST(self) -> None:
         if self.mirror_check is None:
             raise MirrorCheckNotStartedError
-        self.mirror_check.task.cancel()
+        if self.mirror_check.task is not None:
+            self.mirror_check.task.cancel()
         self.mirror_check = None
 
     async def fallback_GET(self) -> MirrorSelectionFallback:
@@ -105,6 +105,7 @@ class ShutdownController(SubiquityController):
         if self.app.base_model.source.current.variant == "core":
             # Possibly should copy logs somewhere else in this case?
             return
+        self.app.dump_api_metrics()
         target_logs = os.path.join(self.app.base_model.target, "var/log/installer")
         if self.opts.dry_run:
             os.makedirs(target_logs, exist_ok=True)
@@ -13,9 +13,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import contextlib
 import copy
+import os
 import subprocess
+import threading
 import uuid
 from pathlib import Path
 from unittest import IsolatedAsyncioTestCase, mock
@@ -48,6 +51,7 @@ from subiquity.common.types.storage import (
     Partition,
     ProbeStatus,
     ReformatDisk,
+    RenderCacheStats,
     SizingPolicy,
 )
 from subiquity.models.filesystem import dehumanize_size
@@ -76,6 +80,7 @@ from subiquity.server.snapd import api as snapdapi
 from subiquity.server.snapd import types as snapdtypes
 from subiquity.server.snapd.system_getter import SystemGetter
 from subiquity.server.snapd.types import VolumesAuth, VolumesAuthMode
+from subiquitycore.prober import Prober
 from subiquitycore.snapd import AsyncSnapd, SnapdConnection, get_fake_connection
 from subiquitycore.tests.mocks import make_app
 from subiquitycore.tests.parameterized import parameterized
@@ -216,6 +221,13 @@ class TestSubiquityControllerFilesystem(IsolatedAsyncioTestCase):
         self.assertNotIn("grub", curtin_cfg)
         self.assertNotIn("swap", curtin_cfg)
 
+    async def test_render_cache_GET(self):
+        self.fsc.model = model = make_model(Bootloader.UEFI)
+        model.render()
+        model.render()
+        stats = await self.fsc.render_cache_GET()
+        self.assertEqual(RenderCacheStats(hits=1, misses=1), stats)
+
     @parameterized.expand(((True,), (False,)))
     async def test_layout_plus_grub(self, reorder_uefi):
         self.fsc.model = model = make_model(Bootloader.UEFI)
@@ -277,8 +289,10 @@ class TestSubiquityControllerFilesystem(IsolatedAsyncioTestCase):
 
     async def test_v2_ensure_transaction_POST(self):
         self.fsc.locked_probe_data = False
-        await self.fsc.v2_ensure_transaction_POST()
+        with mock.patch.object(self.fsc.model, "start_transaction") as start:
+            await self.fsc.v2_ensure_transaction_POST()
         self.assertTrue(self.fsc.locked_probe_data)
+        start.assert_called_once_with()
 
     async def test_v2_reformat_disk_POST(self):
         self.fsc.locked_probe_data = False
@@ -1009,6 +1023,152 @@ class TestRunAutoinstallGuided(IsolatedAsyncioTestCase):
         )
 
 
+class TestUdevEvents(IsolatedAsyncioTestCase):
+    MOCK_PREFIX = "subiquity.server.controllers.filesystem."
+
+    def setUp(self):
+        self.app = make_app()
+        self.app.opts.bootloader = "UEFI"
+        self.app.opts.udev_quiet_window = 0.01
+        self.fsc = FilesystemController(app=self.app)
+        self.fsc._monitor = mock.Mock()
+        r, w = os.pipe()
+        self.addCleanup(os.close, r)
+        self.addCleanup(os.close, w)
+        self.fsc._monitor.fileno.return_value = r
+        self.fsc.ensure_probing = mock.Mock()
+        p = mock.patch(
+            self.MOCK_PREFIX + "arun_command",
+            return_value=subprocess.CompletedProcess([], 0),
+        )
+        self.arun_command = p.start()
+        self.addCleanup(p.stop)
+
+    def event(self, *devices):
+        events = iter(
+            [mock.Mock(device_node=node, action=action) for node, action in devices]
+        )
+        self.fsc._monitor.poll.side_effect = lambda timeout: next(events, None)
+        self.fsc._udev_event()
+
+    async def quiet(self):
+        await asyncio.sleep(self.app.opts.udev_quiet_window + 0.05)
+        if self.fsc._udev_settle_task.task is not None:
+            await self.fsc._udev_settle_task.wait()
+
+    async def test_events_coalesced(self):
+        self.event(("/dev/sda", "add"), ("/dev/sdb", "add"))
+        self.event(("/dev/sda", "change"), (None, "add"))
+        await self.quiet()
+        self.fsc.ensure_probing.assert_called_once_with()
+        self.arun_command.assert_called_once_with(["udevadm", "settle", "-t", "0"])
+        self.assertEqual(
+            {"/dev/sda": "change", "/dev/sdb": "add"}, self.fsc._udev_changes
+        )
+        self.assertIsNone(self.fsc._monitor)
+
+    async def test_events_extend_window(self):
+        self.app.opts.udev_quiet_window = 0.2
+        self.event(("/dev/sda", "add"))
+        await asyncio.sleep(0.12)
+        self.event(("/dev/sdb", "add"))
+        await asyncio.sleep(0.12)
+        self.fsc.ensure_probing.assert_not_called()
+        await self.quiet()
+        self.fsc.ensure_probing.assert_called_once_with()
+
+    async def test_waits_for_settle(self):
+        self.arun_command.side_effect = [
+            subprocess.CompletedProcess([], 1),
+            subprocess.CompletedProcess([], 0),
+        ]
+        self.event(("/dev/sda", "remove"))
+        await self.quiet()
+        self.assertEqual(2, self.arun_command.call_count)
+        self.fsc.ensure_probing.assert_called_once_with()
+
+    async def test_stop_monitor_cancels_reprobe(self):
+        self.event(("/dev/sda", "add"))
+        self.fsc.stop_monitor()
+        await self.quiet()
+        self.arun_command.assert_not_called()
+        self.fsc.ensure_probing.assert_not_called()
+
+    async def test_probe_clears_changes(self):
+        self.fsc._udev_changes = {"/dev/sda": "add"}
+        self.fsc._configured = True
+        self.app.opts.block_probing_timeout = None
+        self.app.prober = mock.Mock()
+        self.app.prober.get_storage = mock.AsyncMock()
+        await self.fsc._probe(context=None)
+        self.assertEqual({}, self.fsc._udev_changes)
+
+
+class TestProbeDevices(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.app = make_app()
+        self.app.opts.bootloader = "UEFI"
+        self.app.opts.block_probing_timeout = None
+        self.app.opts.use_os_prober = False
+        self.app.block_log_dir = "/inexistent"
+        self.app.note_file_for_apport = mock.Mock()
+        with open("examples/machines/existing-partitions.json") as fp:
+            self.app.prober = Prober(machine_config=fp, debug_flags=())
+        self.probe_data = self.app.prober.saved_config["storage"]
+        self.fsc = FilesystemController(app=self.app)
+        self.fsc._configured = False
+        self.fsc.model._probe_data = self.probe_data
+        p = mock.patch("subiquity.server.controllers.filesystem.open", mock.mock_open())
+        p.start()
+        self.addCleanup(p.stop)
+
+    async def probe(self, *paths):
+        self.fsc._udev_changes = {path: "change" for path in paths}
+        with mock.patch.object(
+            self.app.prober, "get_storage", wraps=self.app.prober.get_storage
+        ) as get_storage:
+            with mock.patch.object(self.fsc.model, "load_probe_data") as load:
+                await self.fsc._probe(context=None)
+        return get_storage, load
+
+    async def test_only_changed_disks_probed(self):
+        get_storage, load = await self.probe("/dev/vdb5", "/dev/vdb6")
+        get_storage.assert_not_called()
+        [storage] = load.call_args.args
+        self.assertEqual({"disks": {"/dev/vdb"}}, load.call_args.kwargs)
+        self.assertEqual(list(self.probe_data["blockdev"]), list(storage["blockdev"]))
+        self.assertEqual({}, self.fsc._udev_changes)
+
+    async def test_removed_device(self):
+        del self.app.prober.saved_config["storage"]["blockdev"]["/dev/vdb6"]
+        self.probe_data = copy.deepcopy(self.probe_data)
+        self.probe_data["blockdev"]["/dev/vdb6"] = {"DEVTYPE": "partition"}
+        self.fsc.model._probe_data = self.probe_data
+        get_storage, load = await self.probe("/dev/vdb6")
+        get_storage.assert_not_called()
+        [storage] = load.call_args.args
+        self.assertNotIn("/dev/vdb6", storage["blockdev"])
+
+    async def test_stacked_devices_probe_everything(self):
+        get_storage, load = await self.probe("/dev/vdc1")
+        get_storage.assert_called()
+        load.assert_called_with(self.app.prober.saved_config["storage"])
+
+    async def test_os_prober_probes_everything(self):
+        self.app.opts.use_os_prober = True
+        get_storage, load = await self.probe("/dev/vdb")
+        get_storage.assert_called()
+
+    async def test_locked_probe_data(self):
+        self.fsc.locked_probe_data = True
+        get_storage, load = await self.probe("/dev/vdb")
+        get_storage.assert_not_called()
+        load.assert_not_called()
+        self.assertEqual(
+            self.probe_data["blockdev"], self.fsc.queued_probe_data["blockdev"]
+        )
+
+
 class TestGuided(IsolatedAsyncioTestCase):
     boot_expectations = [
         (Bootloader.UEFI, "gpt", "/boot/efi"),
@@ -2151,6 +2311,188 @@ class TestGuidedV2(IsolatedAsyncioTestCase):
         self.assertTrue(self.fsc.resize_has_enough_room_for_partitions(disk, p5))
         self.assertTrue(self.fsc.resize_has_enough_room_for_partitions(disk, p6))
 
+    async def guided_GET_tried(self):
+        """v2_guided_GET, once the scenarios have been tried."""
+        await self.fsc.v2_guided_GET()
+        await self.fsc._scenario_evaluator.wait()
+        return await self.fsc.v2_guided_GET()
+
+    async def test_scenarios_tried_on_copy(self):
+        await self._setup(Bootloader.UEFI, "gpt")
+        make_partition(self.model, self.disk, preserve=True, size=10 << 30)
+        actions = list(self.model._actions)
+        generation = self.model.generation
+        with mock.patch.object(
+            FilesystemController,
+            "guided",
+            autospec=True,
+            side_effect=FilesystemController.guided,
+        ) as guided:
+            resp = await self.guided_GET_tried()
+        self.assertEqual(generation, self.model.generation)
+        self.assertEqual(actions, list(self.model._actions))
+        # One call for each of the reformat and use gap scenarios.
+        self.assertEqual(2, guided.call_count)
+        for call in guided.call_args_list:
+            self.assertIsNot(self.fsc, call.args[0])
+            self.assertIsNot(self.model, call.args[0].model)
+        self.assertEqual(3, len(resp.targets))
+
+    async def test_failing_scenario_skipped(self):
+        await self._setup(Bootloader.UEFI, "gpt")
+        make_partition(self.model, self.disk, preserve=True, size=10 << 30)
+
+        async def guided(fsc, choice):
+            if isinstance(choice.target, GuidedStorageTargetUseGap):
+                raise Exception("Exceeded number of available partitions")
+
+        with mock.patch.object(FilesystemController, "guided", guided):
+            resp = await self.guided_GET_tried()
+        [reformat, manual] = resp.targets
+        self.assertIsInstance(reformat, GuidedStorageTargetReformat)
+        self.assertIsInstance(manual, GuidedStorageTargetManual)
+
+    async def test_scenarios_tried_in_background(self):
+        await self._setup(Bootloader.UEFI, "gpt")
+        make_partition(self.model, self.disk, preserve=True, size=10 << 30)
+        tried = asyncio.Event()
+        storage_changed = self.fsc.storage_changed
+
+        async def guided(fsc, choice):
+            raise Exception("Exceeded number of available partitions")
+
+        def changed():
+            storage_changed()
+            tried.set()
+
+        with mock.patch.object(FilesystemController, "guided", guided):
+            with mock.patch.object(self.fsc, "storage_changed", changed):
+                # Nothing has been tried yet, so everything is offered.
+                resp = await self.fsc.v2_guided_GET()
+                self.assertEqual(3, len(resp.targets))
+                await asyncio.wait_for(tried.wait(), timeout=5)
+            resp = await self.fsc.v2_guided_GET()
+        [manual] = resp.targets
+        self.assertIsInstance(manual, GuidedStorageTargetManual)
+
+    async def test_scenario_results_dropped_on_change(self):
+        await self._setup(Bootloader.UEFI, "gpt")
+        with mock.patch.object(FilesystemController, "guided"):
+            await self.fsc.v2_guided_GET()
+            task = self.fsc._scenario_evaluator._task
+            self.model.add_partition(self.disk, size=1 << 30, offset=1 << 20)
+            await self.fsc.v2_guided_GET()
+            self.assertIsNot(task, self.fsc._scenario_evaluator._task)
+            await self.fsc._scenario_evaluator.wait()
+        self.assertTrue(task.cancelled())
+
+    async def test_scenarios_tried_off_the_loop(self):
+        await self._setup(Bootloader.UEFI, "gpt")
+        threads = []
+
+        async def guided(fsc, choice):
+            threads.append(threading.current_thread())
+            # The scratch controller has state of its own.
+            self.assertIsNot(self.fsc._variation_info, fsc._variation_info)
+            self.assertFalse(hasattr(fsc, "_response_cache"))
+
+        with mock.patch.object(FilesystemController, "guided", guided):
+            await self.guided_GET_tried()
+        self.assertTrue(threads)
+        for thread in threads:
+            self.assertIsNot(threading.main_thread(), thread)
+
+    async def test_scenario_workers_bounded(self):
+        await self._setup(Bootloader.UEFI, "gpt")
+        for _ in range(3):
+            make_partition(self.model, self.disk, preserve=True, size=10 << 30)
+        self.fsc._scenario_evaluator.max_workers = 2
+        models = set()
+
+        async def guided(fsc, choice):
+            models.add(id(fsc.model))
+
+        with mock.patch.object(FilesystemController, "guided", guided):
+            with mock.patch.object(
+                self.model, "clone", wraps=self.model.clone
+            ) as clone:
+                await self.guided_GET_tried()
+        # The reformat and use gap scenarios, shared between two clones.
+        self.assertEqual(2, clone.call_count)
+        self.assertEqual(2, len(models))
+
+    async def test_scenario_tried_with_each_capability(self):
+        await self._setup(Bootloader.UEFI, "gpt")
+        tried = []
+
+        async def guided(fsc, choice):
+            tried.append(choice.capability)
+            if choice.capability == GuidedCapability.DIRECT:
+                raise Exception("Exceeded number of available partitions")
+
+        with mock.patch.object(FilesystemController, "guided", guided):
+            resp = await self.guided_GET_tried()
+        self.assertEqual([GuidedCapability.DIRECT, GuidedCapability.LVM], tried[:2])
+        # LVM works, so the reformat scenario is still offered.
+        [reformat, manual] = resp.targets
+        self.assertIsInstance(reformat, GuidedStorageTargetReformat)
+
+    async def test_scenario_results_cached(self):
+        await self._setup(Bootloader.UEFI, "gpt")
+        with mock.patch.object(FilesystemController, "guided") as guided:
+            await self.guided_GET_tried()
+            await self.guided_GET_tried()
+            self.assertEqual(1, guided.call_count)
+            self.model.add_partition(self.disk, size=1 << 30, offset=1 << 20)
+            await self.guided_GET_tried()
+            self.assertEqual(3, guided.call_count)
+
+    async def test_guided_response_cached(self):
+        await self._setup(Bootloader.UEFI, "gpt")
+        with mock.patch.object(
+            self.fsc, "_v2_guided_response", wraps=self.fsc._v2_guided_response
+        ) as compute:
+            resp1 = await self.fsc.v2_guided_GET()
+            resp2 = await self.fsc.v2_guided_GET()
+            self.assertIs(resp1, resp2)
+            compute.assert_called_once()
+
+            self.fsc.storage_changed()
+            resp3 = await self.fsc.v2_guided_GET()
+            self.assertIsNot(resp1, resp3)
+            self.assertEqual(resp1, resp3)
+
+            self.model.add_partition(self.disk, size=1 << 30, offset=1 << 20)
+            resp4 = await self.fsc.v2_guided_GET()
+            self.assertNotEqual(resp3, resp4)
+            self.assertEqual(3, compute.call_count)
+
+    async def test_guided_response_after_guided_POST(self):
+        await self._setup(Bootloader.UEFI, "gpt")
+        resp = await self.fsc.v2_guided_GET()
+        [reformat, manual] = resp.targets
+        data = GuidedChoiceV2(target=reformat, capability=GuidedCapability.DIRECT)
+        resp = await self.fsc.v2_guided_POST(data=data)
+        self.assertEqual(data, resp.configured)
+
+    async def test_v2_response_cached(self):
+        await self._setup(Bootloader.UEFI, "gpt")
+        resp1 = await self.fsc.v2_GET()
+        self.assertIs(resp1, await self.fsc.v2_GET())
+        self.assertIsNot(resp1, await self.fsc.v2_GET(include_raid=True))
+        resp2 = await self.fsc.v2_add_boot_partition_POST(self.disk.id)
+        self.assertIsNot(resp1, resp2)
+        self.assertIs(resp2, await self.fsc.v2_GET())
+
+    async def test_cached_response_not_used_while_probing(self):
+        await self._setup(Bootloader.UEFI, "gpt")
+        await self.fsc.v2_GET()
+        await self.fsc.v2_guided_GET()
+        self.fsc._probe_task.task = None
+        self.assertEqual(ProbeStatus.PROBING, (await self.fsc.v2_GET()).status)
+        resp = await self.fsc.v2_guided_GET()
+        self.assertEqual(ProbeStatus.PROBING, resp.status)
+
 
 class TestManualBoot(IsolatedAsyncioTestCase):
     def _setup(self, bootloader, ptable, **kw):
@@ -2211,6 +2553,8 @@ class TestManualBoot(IsolatedAsyncioTestCase):
         with mock.patch.object(d, "on_remote_storage", return_value=False):
             resp = await self.fsc.v2_GET()
         self.assertTrue(resp.disks[0].can_be_boot_device)
+        # Mocking on_remote_storage is not a change the controller can see.
+        self.fsc.storage_changed()
         with mock.patch.object(d, "on_remote_storage", return_value=True):
             resp = await self.fsc.v2_GET()
         self.assertFalse(resp.disks[0].can_be_boot_device)
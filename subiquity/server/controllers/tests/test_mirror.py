@@ -15,17 +15,25 @@
 
 import contextlib
 import io
+import tempfile
+import time
 import unittest
 from unittest import mock
 
 import jsonschema
 from jsonschema.validators import validator_for
 
-from subiquity.common.types import MirrorSelectionFallback
+from subiquity.common.types import (
+    MirrorCheckStatus,
+    MirrorSelectionFallback,
+    MirrorSelectionStrategy,
+)
 from subiquity.models.mirror import MirrorModel
 from subiquity.server.apt import AptConfigCheckError
 from subiquity.server.controllers.mirror import MirrorController, NoUsableMirrorError
 from subiquity.server.controllers.mirror import log as MirrorLogger
+from subiquity.server.mirror_cache import MIRROR_CHECK_TTL, MirrorCheckCache
+from subiquity.server.mirror_probe import MirrorProbeResult
 from subiquitycore.tests.mocks import make_app
 
 
@@ -111,6 +119,51 @@ class TestMirrorController(unittest.IsolatedAsyncioTestCase):
                 await self.controller.run_mirror_testing(output)
         self.assertEqual(output.getvalue(), "Unable to download index")
 
+    async def test_run_mirror_testing_cached(self):
+        with tempfile.TemporaryDirectory() as tdir:
+            self.controller.mirror_check_cache = MirrorCheckCache(tdir)
+            self.controller.model = MirrorModel()
+            self.controller.model.create_primary_candidate("http://mirror").stage()
+            self.controller.source_configured_event.set()
+            configurer = self.controller.test_apt_configurer
+            configurer.apt_config = mock.Mock(return_value={"apt": {"a": 1}})
+
+            def check_success(output):
+                output.write("test is successful!")
+
+            configurer.run_apt_config_check.side_effect = check_success
+            for _ in range(2):
+                output = io.StringIO()
+                await self.controller.run_mirror_testing(output)
+                self.assertEqual(output.getvalue(), "test is successful!")
+            configurer.apply_apt_config.assert_called_once()
+            configurer.run_apt_config_check.assert_called_once()
+
+            # The result is available as soon as the check is started.
+            await self.controller.check_mirror_start_POST()
+            self.assertIsNone(self.controller.mirror_check.task)
+            resp = await self.controller.check_mirror_progress_GET()
+            self.assertEqual(resp.status, MirrorCheckStatus.OK)
+            self.assertEqual(resp.output, "test is successful!")
+            self.assertEqual(resp.url, "http://mirror")
+
+            # Another config, or a failed check, is not cached.
+            configurer.apt_config.return_value = {"apt": {"a": 2}}
+            configurer.run_apt_config_check.side_effect = AptConfigCheckError
+            for _ in range(2):
+                with self.assertRaises(AptConfigCheckError):
+                    await self.controller.run_mirror_testing(io.StringIO())
+            self.assertEqual(configurer.run_apt_config_check.call_count, 3)
+
+            # Successes expire.
+            configurer.apt_config.return_value = {"apt": {"a": 1}}
+            with mock.patch(
+                "subiquity.server.mirror_cache.time.time",
+                return_value=time.time() + MIRROR_CHECK_TTL + 1,
+            ):
+                with self.assertRaises(AptConfigCheckError):
+                    await self.controller.run_mirror_testing(io.StringIO())
+
     async def test_try_mirror_checking_once(self):
         run_test = mock.patch.object(self.controller, "run_mirror_testing")
         with run_test:
@@ -138,6 +191,7 @@ class TestMirrorController(unittest.IsolatedAsyncioTestCase):
         self.controller.app.context.child = contextlib.nullcontext
         self.controller.app.base_model.network.has_network = True
         self.controller.model = MirrorModel()
+        self.controller.model.selection_strategy = MirrorSelectionStrategy.SEQUENTIAL
         self.controller.network_configured_event.set()
         self.controller.proxy_configured_event.set()
         self.controller.cc_event.set()
@@ -221,6 +275,89 @@ class TestMirrorController(unittest.IsolatedAsyncioTestCase):
             )
         self.assertEqual(self.controller.model.primary_elected.uri, "http://success")
 
+    @mock.patch("subiquity.server.controllers.mirror.asyncio.sleep")
+    async def test_find_and_elect_candidate_mirror_concurrent(self, mock_sleep):
+        self.controller.app.context.child = contextlib.nullcontext
+        self.controller.app.base_model.network.has_network = True
+        self.controller.model = MirrorModel()
+        self.controller.network_configured_event.set()
+        self.controller.proxy_configured_event.set()
+        self.controller.source_configured_event.set()
+        self.controller.cc_event.set()
+        configurer = self.controller.test_apt_configurer
+        self.controller.model.primary_candidates = [
+            self.controller.model.create_primary_candidate(
+                uri=None, country_mirror=True
+            ),
+            self.controller.model.create_primary_candidate("http://slow"),
+            self.controller.model.create_primary_candidate("http://dead"),
+            self.controller.model.create_primary_candidate("http://fast"),
+        ]
+
+        # The much slower mirror is demoted and the dead one not tried.
+        configurer.probe_mirrors.return_value = [
+            MirrorProbeResult(uri="http://slow", ok=True, ttfb=3.0),
+            MirrorProbeResult(uri="http://dead", ok=False),
+            MirrorProbeResult(uri="http://fast", ok=True, ttfb=0.1),
+        ]
+        with mock.patch.object(self.controller, "try_mirror_checking_once") as check:
+            await self.controller.find_and_elect_candidate_mirror(
+                self.controller.app.context
+            )
+        configurer.probe_mirrors.assert_called_once()
+        self.assertEqual(
+            configurer.probe_mirrors.call_args.args[0],
+            ["http://slow", "http://dead", "http://fast"],
+        )
+        check.assert_called_once()
+        self.assertEqual(self.controller.model.primary_elected.uri, "http://fast")
+        mock_sleep.assert_not_called()
+
+        # The fast mirror fails the full check, so the slow one is used.
+        self.controller.model.primary_elected = None
+        with mock.patch.object(
+            self.controller,
+            "try_mirror_checking_once",
+            side_effect=(AptConfigCheckError, None),
+        ):
+            await self.controller.find_and_elect_candidate_mirror(
+                self.controller.app.context
+            )
+        self.assertEqual(self.controller.model.primary_elected.uri, "http://slow")
+        mock_sleep.assert_not_called()
+
+        # Nothing responds to the probe, so fall back to the sequential
+        # checks, which succeed with the first candidate.
+        self.controller.model.primary_elected = None
+        configurer.probe_mirrors.return_value = [
+            MirrorProbeResult(uri="http://slow", ok=False),
+            MirrorProbeResult(uri="http://dead", ok=False),
+            MirrorProbeResult(uri="http://fast", ok=False),
+        ]
+        with mock.patch.object(self.controller, "try_mirror_checking_once"):
+            await self.controller.find_and_elect_candidate_mirror(
+                self.controller.app.context
+            )
+        self.assertEqual(self.controller.model.primary_elected.uri, "http://slow")
+
+    async def test_find_and_elect_candidate_mirror_sequential(self):
+        self.controller.app.context.child = contextlib.nullcontext
+        self.controller.app.base_model.network.has_network = True
+        self.controller.model = MirrorModel()
+        self.controller.model.selection_strategy = MirrorSelectionStrategy.SEQUENTIAL
+        self.controller.network_configured_event.set()
+        self.controller.proxy_configured_event.set()
+        self.controller.cc_event.set()
+        self.controller.model.primary_candidates = [
+            self.controller.model.create_primary_candidate("http://mirror")
+        ]
+        with mock.patch.object(self.controller, "try_mirror_checking_once"):
+            await self.controller.find_and_elect_candidate_mirror(
+                self.controller.app.context
+            )
+        self.controller.test_apt_configurer.probe_mirrors.assert_not_called()
+        self.assertEqual(self.controller.model.primary_elected.uri, "http://mirror")
+
     async def test_find_and_elect_candidate_mirror_no_network(self):
         self.controller.app.context.child = contextlib.nullcontext
         self.controller.app.base_model.network.has_network = False
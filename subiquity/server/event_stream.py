@@ -0,0 +1,184 @@
+# Copyright 2025 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import logging
+from typing import Any, Callable, Dict, Optional, Set
+
+import attr
+from aiohttp import web
+
+from subiquity.common.serialize import to_json
+from subiquity.common.types import ApplicationStatus, ContextEvent
+from subiquity.server.event_listener import EventListener
+from subiquitycore.context import Context
+
+log = logging.getLogger("subiquity.server.event_stream")
+
+
+@attr.s(auto_attribs=True)
+class _Watch:
+    get_state: Callable[[], Any]
+    state: Any = None
+    generation: int = 0
+
+
+class EventStream(EventListener):
+    """Push what is happening in the server to clients.
+
+    A GET of /meta/events is answered with a stream of server-sent
+    events, so that any number of clients can follow the installer
+    without polling. The stream starts with the current state of things
+    and then carries:
+
+     * "state": the ApplicationStatus, whenever the state changes;
+     * "updated": whether the server has been updated (this is the
+       x-updated header, and only changes across restarts);
+     * "start", "finish", "info", "warning" and "error": a
+       ContextEvent, for each event reported by a context (other than
+       those handling API requests);
+     * one event for each watch, such as "storage": a number that goes
+       up when the watched state changes.
+
+    The data of each event is JSON. A client that falls too far behind
+    is disconnected, and can reconnect to start again from the current
+    state.
+    """
+
+    max_backlog = 1000
+
+    def __init__(self, app):
+        self.app = app
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._watches: Dict[str, _Watch] = {}
+        self._check_handle: Optional[asyncio.Handle] = None
+
+    def add_routes(self, app: web.Application) -> None:
+        app.router.add_get("/meta/events", self.handler)
+
+    def watch(self, name: str, get_state: Callable[[], Any]) -> None:
+        """Send a `name` event whenever get_state() returns something new.
+
+        get_state is only called while someone is listening, after each
+        API request and after changed() is called.
+        """
+        self._watches[name] = _Watch(get_state)
+
+    def changed(self) -> None:
+        """Note that something being watched may have changed."""
+        if not self._subscribers or self._check_handle is not None:
+            return
+        # Many changes tend to come together, so look once they are done.
+        self._check_handle = asyncio.get_running_loop().call_soon(self._check)
+
+    def _check(self) -> None:
+        self._check_handle = None
+        for name, watch in self._watches.items():
+            state = watch.get_state()
+            if state != watch.state:
+                watch.state = state
+                watch.generation += 1
+                self._publish(name, json.dumps(watch.generation))
+
+    def _encode(self, event: str, data: str) -> bytes:
+        return f"event: {event}\ndata: {data}\n\n".encode()
+
+    def _publish(self, event: str, data: str) -> None:
+        chunk = self._encode(event, data)
+        for queue in list(self._subscribers):
+            if queue.qsize() >= self.max_backlog:
+                log.debug("dropping event stream client that is not keeping up")
+                self._subscribers.discard(queue)
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait(chunk)
+
+    def _status_data(self) -> str:
+        return to_json(ApplicationStatus, self.app.application_status())
+
+    def state_changed(self) -> None:
+        if self._subscribers:
+            self._publish("state", self._status_data())
+
+    def _report(
+        self,
+        event_type: str,
+        context: Context,
+        description: Optional[str],
+        result: Optional[str] = None,
+    ) -> None:
+        if not self._subscribers:
+            return
+        if context.get("request", default=None) is not None:
+            return
+        if context.parent is not None:
+            parent_id = str(context.parent.id)
+        else:
+            parent_id = None
+        event = ContextEvent(
+            context_id=str(context.id),
+            parent_id=parent_id,
+            name=context.full_name(),
+            description=description,
+            level=context.level,
+            result=result,
+        )
+        self._publish(event_type, to_json(ContextEvent, event))
+
+    def report_start_event(self, context, description):
+        self._report("start", context, description)
+
+    def report_finish_event(self, context, description, result):
+        self._report("finish", context, description, result.name)
+
+    def report_info_event(self, context, message):
+        self._report("info", context, message)
+
+    def report_warning_event(self, context, message):
+        self._report("warning", context, message)
+
+    def report_error_event(self, context, message):
+        self._report("error", context, message)
+
+    async def handler(self, request: web.Request) -> web.StreamResponse:
+        resp = web.StreamResponse(
+            headers={
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+            }
+        )
+        await resp.prepare(request)
+        # Bring the watches up to date and queue up the current state of
+        # things before joining the subscribers, without awaiting in
+        # between, so that nothing is missed.
+        self._check()
+        queue: asyncio.Queue = asyncio.Queue()
+        queue.put_nowait(self._encode("state", self._status_data()))
+        queue.put_nowait(self._encode("updated", json.dumps(bool(self.app.updated))))
+        for name, watch in self._watches.items():
+            queue.put_nowait(self._encode(name, json.dumps(watch.generation)))
+        self._subscribers.add(queue)
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                await resp.write(chunk)
+        except ConnectionResetError:
+            pass
+        finally:
+            self._subscribers.discard(queue)
+        return resp
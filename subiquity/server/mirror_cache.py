@@ -0,0 +1,81 @@
+# Copyright 2025 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Optional
+
+import attr
+
+from subiquity.common.serialize import SerializationError, from_json, to_json
+from subiquitycore.file_util import write_file
+
+log = logging.getLogger("subiquity.server.mirror_cache")
+
+# How long a successful mirror check is trusted for.
+MIRROR_CHECK_TTL = 30 * 60
+
+
+@attr.s(auto_attribs=True)
+class CachedMirrorCheck:
+    uri: Optional[str]
+    # What apt-get update printed.
+    output: str
+    # How long applying the apt config and running apt-get update took.
+    elapsed: float
+    # When the check was done, as a time.time() timestamp.
+    checked_at: float
+
+
+class MirrorCheckCache:
+    """Remember which apt configurations passed the mirror check.
+
+    Entries are stored as files in a directory under the server's state
+    dir, so that they survive the server being restarted. Only successes
+    are remembered, for MIRROR_CHECK_TTL seconds, as a mirror that failed
+    may well work when tried again.
+    """
+
+    def __init__(self, directory: str, ttl: float = MIRROR_CHECK_TTL):
+        self.directory = directory
+        self.ttl = ttl
+
+    @staticmethod
+    def key(apt_config: Any, proxy: str, source: str) -> str:
+        blob = json.dumps([apt_config, proxy, source], sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key: str) -> Optional[CachedMirrorCheck]:
+        try:
+            with open(self._path(key)) as fp:
+                check = from_json(CachedMirrorCheck, fp.read())
+        except FileNotFoundError:
+            return None
+        except (SerializationError, ValueError) as exc:
+            log.debug("ignoring unreadable mirror check cache entry %s: %r", key, exc)
+            return None
+        if not 0 <= time.time() - check.checked_at <= self.ttl:
+            return None
+        return check
+
+    def put(self, key: str, check: CachedMirrorCheck) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        write_file(self._path(key), to_json(CachedMirrorCheck, check))
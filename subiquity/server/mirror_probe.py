@@ -0,0 +1,195 @@
+# Copyright 2025 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Quickly find out which candidate mirrors respond, and how fast.
+
+Running apt-get update against a mirror that is down can take a long
+time to fail, so before that, all the candidates are probed at once by
+fetching the InRelease file of the suite being installed, each with its
+own deadline. A mirror only passes if that file is signed by one of the
+keys apt trusts and has not expired, so that a mirror serving an error
+page or one that stopped syncing is rejected without running apt.
+"""
+
+import asyncio
+import datetime
+import email.utils
+import logging
+import time
+from typing import Dict, List, Optional, Sequence
+
+import aiohttp
+import attr
+
+from subiquitycore.utils import arun_command
+
+log = logging.getLogger("subiquity.server.mirror_probe")
+
+# How long a mirror gets to send the whole InRelease file.
+PROBE_TIMEOUT = 5.0
+
+# A candidate earlier in the list is preferred over the ones after it,
+# unless its first byte took more than SLOW_FACTOR times as long to
+# arrive as that of the fastest candidate (plus SLOW_SLACK seconds, so
+# that small differences between fast mirrors do not count).
+SLOW_FACTOR = 4.0
+SLOW_SLACK = 0.2
+
+
+@attr.s(auto_attribs=True)
+class MirrorProbeResult:
+    uri: str
+    ok: bool
+    # Seconds until the response headers arrived.
+    ttfb: Optional[float] = None
+    # Bytes per second while reading the body.
+    throughput: Optional[float] = None
+    error: Optional[str] = None
+
+
+class InvalidReleaseError(Exception):
+    """The InRelease file of a mirror cannot be trusted."""
+
+
+def inrelease_url(uri: str, suite: str) -> str:
+    return f"{uri.rstrip('/')}/dists/{suite}/InRelease"
+
+
+SIGNED_HEADER = "-----BEGIN PGP SIGNED MESSAGE-----"
+SIGNATURE_HEADER = "-----BEGIN PGP SIGNATURE-----"
+
+
+def release_fields(text: str) -> Dict[str, str]:
+    """Return the fields of the signed part of an InRelease file (only
+    the first line of multi-line fields, which is all that is needed)."""
+    if not text.startswith(SIGNED_HEADER) or SIGNATURE_HEADER not in text:
+        raise InvalidReleaseError("InRelease is not signed")
+    # The armor headers end at the first empty line.
+    signed = text.split(SIGNATURE_HEADER, 1)[0].split("\n\n", 1)[-1]
+    fields = {}
+    for line in signed.splitlines():
+        if line[:1].isspace() or ":" not in line:
+            continue
+        name, value = line.split(":", 1)
+        fields.setdefault(name, value.strip())
+    return fields
+
+
+async def check_inrelease(
+    text: str,
+    keyrings: Optional[Sequence[str]] = None,
+    *,
+    now: Optional[datetime.datetime] = None,
+) -> None:
+    """Raise InvalidReleaseError if the InRelease file has expired or, if
+    keyrings are given, is not signed by a key in one of them."""
+    fields = release_fields(text)
+    if "Valid-Until" in fields:
+        try:
+            valid_until = email.utils.parsedate_to_datetime(fields["Valid-Until"])
+        except (TypeError, ValueError):
+            raise InvalidReleaseError(f"bad Valid-Until: {fields['Valid-Until']}")
+        if valid_until.tzinfo is None:
+            valid_until = valid_until.replace(tzinfo=datetime.timezone.utc)
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        if valid_until < now:
+            raise InvalidReleaseError(f"InRelease expired on {fields['Valid-Until']}")
+    if keyrings:
+        cmd = ["gpgv", "--quiet"]
+        for keyring in keyrings:
+            cmd.extend(["--keyring", keyring])
+        cp = await arun_command(cmd, input=text)
+        if cp.returncode != 0:
+            raise InvalidReleaseError(f"bad signature: {cp.stderr.strip()}")
+
+
+async def probe_mirror(
+    session: aiohttp.ClientSession,
+    uri: str,
+    suite: str,
+    *,
+    proxy: Optional[str] = None,
+    timeout: float = PROBE_TIMEOUT,
+    keyrings: Optional[Sequence[str]] = None,
+) -> MirrorProbeResult:
+    url = inrelease_url(uri, suite)
+    start = time.monotonic()
+    try:
+        async with session.get(
+            url, proxy=proxy, timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as resp:
+            ttfb = time.monotonic() - start
+            if resp.status != 200:
+                return MirrorProbeResult(
+                    uri=uri, ok=False, ttfb=ttfb, error=f"HTTP {resp.status}"
+                )
+            body = await resp.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as exc:
+        return MirrorProbeResult(uri=uri, ok=False, error=repr(exc))
+    elapsed = time.monotonic() - start - ttfb
+    # Guard against a clock too coarse to see the body arrive.
+    throughput = len(body) / max(elapsed, 1e-6)
+    try:
+        await check_inrelease(body.decode("utf-8"), keyrings)
+    except (InvalidReleaseError, UnicodeDecodeError) as exc:
+        return MirrorProbeResult(
+            uri=uri, ok=False, ttfb=ttfb, throughput=throughput, error=str(exc)
+        )
+    return MirrorProbeResult(uri=uri, ok=True, ttfb=ttfb, throughput=throughput)
+
+
+async def probe_mirrors(
+    uris: List[str],
+    suite: str,
+    *,
+    proxy: Optional[str] = None,
+    timeout: float = PROBE_TIMEOUT,
+    keyrings: Optional[Sequence[str]] = None,
+) -> List[MirrorProbeResult]:
+    """Probe all the mirrors at once and return the results in the same
+    order as the URIs."""
+    async with aiohttp.ClientSession() as session:
+        results = await asyncio.gather(
+            *(
+                probe_mirror(
+                    session,
+                    uri,
+                    suite,
+                    proxy=proxy,
+                    timeout=timeout,
+                    keyrings=keyrings,
+                )
+                for uri in uris
+            )
+        )
+    for result in results:
+        log.debug("probed mirror %s", result)
+    return results
+
+
+def rank_probe_results(results: List[MirrorProbeResult]) -> List[MirrorProbeResult]:
+    """Return the results of the mirrors that responded, best first.
+
+    The results are expected in order of preference, and that order is
+    kept except for the mirrors that are much slower to respond than the
+    fastest one, which are moved to the end, fastest first."""
+    working = [result for result in results if result.ok]
+    if not working:
+        return []
+    limit = min(result.ttfb for result in working) * SLOW_FACTOR + SLOW_SLACK
+    fast = [result for result in working if result.ttfb <= limit]
+    slow = [result for result in working if result.ttfb > limit]
+    return fast + sorted(slow, key=lambda result: result.ttfb)
@@ -32,6 +32,10 @@ class PackageInstaller:
     Sometimes we need packages from the pool in the live session, for
     example to install wpasupplicant when wlan interfaces are detected
     by the server installer.
+
+    This does not use the AptCache in subiquity.server.apt_cache: apt
+    reads packages from the pool in place and no index files are
+    downloaded, so there is nothing to share.
     """
 
     def __init__(self):
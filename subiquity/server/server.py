@@ -47,13 +47,18 @@ from subiquity.common.types import (
     LiveSessionSSHInfo,
     NonReportableError,
     PasswordKind,
+    RouteMetrics,
 )
 from subiquity.models.subiquity import ModelNames, SubiquityModel
+from subiquity.server.api_metrics import APIMetrics
+from subiquity.server.apt_cache import AptCache
 from subiquity.server.autoinstall import AutoinstallError, AutoinstallValidationError
+from subiquity.server.batch import make_batch_handler
 from subiquity.server.controller import SubiquityController
 from subiquity.server.dryrun import DRConfig
 from subiquity.server.errors import ErrorController
 from subiquity.server.event_listener import EventListener
+from subiquity.server.event_stream import EventStream
 from subiquity.server.geoip import DryRunGeoIPStrategy, GeoIP, HTTPGeoIPStrategy
 from subiquity.server.nonreportable import NonReportableException
 from subiquity.server.pkghelper import get_package_installer
@@ -89,17 +94,7 @@ class MetaController:
     ) -> ApplicationStatus:
         if cur == self.app.state:
             await self.app.state_event.wait()
-        return ApplicationStatus(
-            state=self.app.state,
-            confirming_tty=self.app.confirming_tty,
-            error=self.app.fatal_error,
-            nonreportable_error=self.app.nonreportable_error,
-            cloud_init_ok=self.app.cloud_init_ok,
-            interactive=self.app.interactive,
-            echo_syslog_id=self.app.echo_syslog_id,
-            event_syslog_id=self.app.event_syslog_id,
-            log_syslog_id=self.app.log_syslog_id,
-        )
+        return self.app.application_status()
 
     async def confirm_POST(self, tty: str) -> None:
         self.app.confirming_tty = tty
@@ -181,6 +176,9 @@ class MetaController:
 
         return i_sections
 
+    async def metrics_GET(self) -> List[RouteMetrics]:
+        return self.app.api_metrics.snapshot()
+
 
 def get_installer_password_from_cloudinit_log():
     try:
@@ -309,6 +307,9 @@ class SubiquityServer(Application):
         self.block_log_dir = block_log_dir
         self.cloud_init_ok = None
         self.state_event = asyncio.Event()
+        self.event_stream = EventStream(self)
+        self.api_metrics = APIMetrics()
+        self.api_metrics_path: Optional[str] = None
         self.update_state(ApplicationState.STARTING_UP)
         self.interactive = None
         self.confirming_tty = ""
@@ -324,6 +325,7 @@ class SubiquityServer(Application):
         self.log_syslog_id = "subiquity_log.{}".format(os.getpid())
         self.command_runner = get_command_runner(self)
         self.package_installer = get_package_installer(self)
+        self.apt_cache = AptCache(self.state_path("apt-cache"))
 
         self.error_reporter = ErrorReporter(
             self.context.child("ErrorReporter"), self.opts.dry_run, self.root
@@ -346,7 +348,7 @@ class SubiquityServer(Application):
             log.info("no snapd socket found. Snap support is disabled")
             self.snapd = None
         self.note_data_for_apport("SnapUpdated", str(self.updated))
-        self.event_listeners: list[EventListener] = []
+        self.event_listeners: list[EventListener] = [self.event_stream]
         self.autoinstall_config = None
         self.hub.subscribe(InstallerChannels.NETWORK_UP, self._network_change)
         self.hub.subscribe(InstallerChannels.NETWORK_PROXY_SET, self._proxy_set)
@@ -494,6 +496,20 @@ class SubiquityServer(Application):
         write_file(self.state_path("server-state"), state.name)
         self.state_event.set()
         self.state_event.clear()
+        self.event_stream.state_changed()
+
+    def application_status(self) -> ApplicationStatus:
+        return ApplicationStatus(
+            state=self.state,
+            confirming_tty=self.confirming_tty,
+            error=self.fatal_error,
+            nonreportable_error=self.nonreportable_error,
+            cloud_init_ok=self.cloud_init_ok,
+            interactive=self.interactive,
+            echo_syslog_id=self.echo_syslog_id,
+            event_syslog_id=self.event_syslog_id,
+            log_syslog_id=self.log_syslog_id,
+        )
 
     def note_file_for_apport(self, key, path):
         self.error_reporter.note_file_for_apport(key, path)
@@ -504,6 +520,8 @@ class SubiquityServer(Application):
     def make_apport_report(
         self, kind: ErrorReportKind, thing, *, wait=False, **kw
     ) -> ErrorReport:
+        # So that the report has the metrics as they are now.
+        self.dump_api_metrics()
         return self.error_reporter.make_apport_report(kind, thing, wait=wait, **kw)
 
     async def _run_error_cmds(self, report: Optional[ErrorReport] = None) -> None:
@@ -551,6 +569,14 @@ class SubiquityServer(Application):
 
     @web.middleware
     async def middleware(self, request, handler):
+        return await self.call_handler(request, handler)
+
+    async def call_handler(self, request, handler, **bind_kw):
+        """Call handler for request, then add the headers all responses
+        get and report any error.
+
+        This is what the middleware does for every request, and what a
+        /batch request does for each call in it."""
         override_status = None
         controller = await controller_for_request(request)
         if isinstance(controller, SubiquityController):
@@ -563,13 +589,20 @@ class SubiquityServer(Application):
         if override_status is not None:
             resp = web.Response(headers={"x-status": override_status})
         else:
-            resp = await handler(request)
-        if self.updated:
-            resp.headers["x-updated"] = "yes"
-        else:
-            resp.headers["x-updated"] = "no"
-        if resp.get("exception"):
-            exc = resp["exception"]
+            resp = await handler(request, **bind_kw)
+        if not resp.prepared:
+            if self.updated:
+                resp.headers["x-updated"] = "yes"
+            else:
+                resp.headers["x-updated"] = "no"
+        # The request may have changed something being watched.
+        self.event_stream.changed()
+        self.api_metrics.record(request, resp, bind_kw.get("match_info"))
+        exc = resp.get("exception")
+        # Coalesced requests share the failure of the request that started
+        # the call, which is only reported once.
+        shared = resp.get("shared_error")
+        if exc is not None:
             log.debug(
                 "request to %s failed with status %d: %s",
                 request.raw_path,
@@ -577,13 +610,20 @@ class SubiquityServer(Application):
                 resp.headers["x-error-msg"],
                 exc_info=exc,
             )
-            if not isinstance(exc, NonReportableException):
+        elif shared is not None:
+            exc = shared.exception
+        if exc is not None and not isinstance(exc, NonReportableException):
+            ref = shared.report_ref if shared is not None else None
+            if ref is None:
                 report = self.make_apport_report(
                     ErrorReportKind.SERVER_REQUEST_FAIL,
                     "request to {}".format(request.raw_path),
                     exc=exc,
                 )
-                resp.headers["x-error-report"] = to_json(ErrorReportRef, report.ref())
+                ref = to_json(ErrorReportRef, report.ref())
+                if shared is not None:
+                    shared.report_ref = ref
+            resp.headers["x-error-report"] = ref
         return resp
 
     @with_context()
@@ -783,6 +823,8 @@ class SubiquityServer(Application):
         app = web.Application(middlewares=[self.middleware])
         bind(app.router, API.meta, MetaController(self))
         bind(app.router, API.errors, ErrorController(self))
+        self.event_stream.add_routes(app)
+        app.router.add_post("/batch", make_batch_handler(self.call_handler))
         if self.opts.dry_run:
             from .dryrun import DryRunController
 
@@ -1043,8 +1085,17 @@ class SubiquityServer(Application):
         await super().start()
         await self.apply_autoinstall_config()
 
+    def dump_api_metrics(self):
+        if self.api_metrics_path is None:
+            return
+        try:
+            self.api_metrics.dump(self.api_metrics_path)
+        except OSError:
+            log.exception("saving API metrics failed")
+
     def exit(self):
         self.update_state(ApplicationState.EXITED)
+        self.dump_api_metrics()
         super().exit()
 
     def _network_change(self):
@@ -0,0 +1,118 @@
+# Copyright 2025 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+import unittest
+from typing import List
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from subiquity.common.api.defs import api, path_parameter
+from subiquity.common.api.server import bind
+from subiquity.server.api_metrics import SIZE_BOUNDS, TIME_BOUNDS, APIMetrics
+from subiquitycore.context import Context
+
+
+class TestApp:
+    def report_start_event(self, context, description):
+        pass
+
+    def report_finish_event(self, context, description, result):
+        pass
+
+    project = "test"
+
+
+@api
+class API:
+    class things:
+        @path_parameter
+        class thing:
+            def GET() -> List[int]:
+                ...
+
+    class fails:
+        def GET() -> None:
+            ...
+
+
+class Impl:
+    def __init__(self):
+        self.context = Context.new(TestApp())
+        self.app = mock.Mock()
+        self.app.controllers_have_started = mock.MagicMock(return_value=True)
+
+    async def things_thing_GET(self, thing: str) -> List[int]:
+        return list(range(int(thing)))
+
+    async def fails_GET(self) -> None:
+        raise Exception("broken")
+
+
+class TestAPIMetrics(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.metrics = APIMetrics()
+
+        @web.middleware
+        async def middleware(request, handler):
+            resp = await handler(request)
+            self.metrics.record(request, resp)
+            return resp
+
+        app = web.Application(middlewares=[middleware])
+        bind(app.router, API, Impl())
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def test_record(self):
+        for count in 1, 1000:
+            resp = await self.client.get(f"/things/{count}")
+            self.assertEqual(resp.status, 200)
+        [route] = self.metrics.snapshot()
+        self.assertEqual((route.method, route.path), ("GET", "/things/{thing}"))
+        for hist in route.wait_for_start, route.implementation, route.serialization:
+            self.assertEqual(hist.bounds, TIME_BOUNDS)
+            self.assertEqual(hist.count, 2)
+            self.assertEqual(sum(hist.counts), 2)
+        sizes = route.response_size
+        self.assertEqual(sizes.bounds, SIZE_BOUNDS)
+        self.assertEqual(sizes.count, 2)
+        self.assertEqual(sizes.max, len(json.dumps(list(range(1000)))))
+        # "[0]" fits in the smallest bucket, the longer list does not.
+        self.assertEqual(sizes.counts[0], 1)
+
+    async def test_failure(self):
+        resp = await self.client.get("/fails")
+        self.assertEqual(resp.status, 500)
+        [route] = self.metrics.snapshot()
+        self.assertEqual(route.implementation.count, 0)
+        self.assertEqual(route.serialization.count, 0)
+        self.assertEqual(route.wait_for_start.count, 1)
+        self.assertEqual(route.response_size.count, 1)
+
+    async def test_dump(self):
+        await self.client.get("/things/3")
+        with tempfile.TemporaryDirectory() as tdir:
+            path = os.path.join(tdir, "api-metrics.json")
+            self.metrics.dump(path)
+            with open(path) as fp:
+                [route] = json.load(fp)
+        self.assertEqual(route["path"], "/things/{thing}")
+        self.assertEqual(route["implementation"]["count"], 1)
@@ -20,6 +20,7 @@ import subprocess
 import tempfile
 from unittest.mock import AsyncMock, Mock, patch
 
+import yaml
 from curtin.commands.extract import TrivialSourceHandler
 
 from subiquity.models.mirror import MirrorModel
@@ -32,6 +33,7 @@ from subiquity.server.apt import (
     OverlayMountpoint,
 )
 from subiquity.server.dryrun import DRConfig
+from subiquity.server.mirror_probe import MirrorProbeResult
 from subiquitycore.tests import SubiTestCase
 from subiquitycore.tests.mocks import make_app
 from subiquitycore.tests.parameterized import parameterized
@@ -88,6 +90,61 @@ class TestAptConfigurer(SubiTestCase):
         self.assertEqual(proxy, config["apt"]["http_proxy"])
         self.assertEqual(proxy, config["apt"]["https_proxy"])
 
+    async def test_apply_apt_config_reuses_overlay(self):
+        self.app.root = self.tmp_dir()
+        self.app.note_data_for_apport = Mock()
+        trees = []
+
+        async def setup_overlay(lowers):
+            tree = self.tmp_dir()
+            pathlib.Path(tree, "etc/apt/sources.list.d").mkdir(parents=True)
+            trees.append(tree)
+            return OverlayMountpoint(lowers=lowers, upperdir=None, mountpoint=tree)
+
+        async def curtin_apt_config(app, context, *args, config, **kw):
+            with open(config) as fp:
+                uri = yaml.safe_load(fp)["apt"]["primary"][0]["uri"]
+            sources = pathlib.Path(trees[-1], "etc/apt/sources.list.d")
+            sources.joinpath("ubuntu.sources").write_text(f"URIs: {uri}\n")
+            sources.joinpath("other.list").write_text("deb http://other/ noble\n")
+
+        def sources():
+            return self.configurer.configured_tree.pp(
+                "etc/apt/sources.list.d/ubuntu.sources"
+            ).read_text()
+
+        self.configurer.mounter.setup_overlay.side_effect = setup_overlay
+        mirror = self.model.mirror
+        with patch(
+            "subiquity.server.apt.run_curtin_command", side_effect=curtin_apt_config
+        ) as curtin:
+            mirror.create_primary_candidate("http://mirror-a/ubuntu").stage()
+            await self.configurer.apply_apt_config(self.app.context, final=False)
+            self.assertEqual(sources(), "URIs: http://mirror-a/ubuntu\n")
+
+            mirror.create_primary_candidate("http://mirror-b/ubuntu/").stage()
+            await self.configurer.apply_apt_config(self.app.context, final=False)
+            self.assertEqual(sources(), "URIs: http://mirror-b/ubuntu\n")
+            self.assertEqual(len(trees), 1)
+            curtin.assert_called_once()
+
+            # Any other change needs a new overlay.
+            mirror.disabled_components = {"universe"}
+            await self.configurer.apply_apt_config(self.app.context, final=False)
+            self.assertEqual(sources(), "URIs: http://mirror-b/ubuntu\n")
+            self.assertEqual(len(trees), 2)
+
+            # The final configuration is applied as is.
+            await self.configurer.apply_apt_config(self.app.context, final=True)
+            self.assertEqual(sources(), "URIs: http://mymirror\n")
+            self.assertEqual(len(trees), 3)
+        self.assertEqual(
+            self.configurer.configured_tree.pp(
+                "etc/apt/sources.list.d/other.list"
+            ).read_text(),
+            "deb http://other/ noble\n",
+        )
+
     async def test_overlay(self):
         self.configurer.install_tree = OverlayMountpoint(
             upperdir="upperdir-install-tree",
@@ -133,15 +190,23 @@ class TestAptConfigurer(SubiTestCase):
                 proc.stdin.write_eof()
                 return proc
 
+            self.app.apt_cache = Mock()
+
             output = io.StringIO()
             with patch(self.astart_sym, side_effect=astart_success):
                 await self.configurer.run_apt_config_check(output)
                 self.assertEqual(output.getvalue(), APT_UPDATE_SUCCESS)
+            # What apt downloaded is kept for the next runs.
+            self.app.apt_cache.store.assert_called_once_with(
+                self.configurer.configured_tree.p()
+            )
 
+            self.app.apt_cache.store.reset_mock()
             output = io.StringIO()
             with patch(self.astart_sym, side_effect=astart_failure):
                 with self.assertRaises(AptConfigCheckError):
                     await self.configurer.run_apt_config_check(output)
+            self.app.apt_cache.store.assert_not_called()
 
     @staticmethod
     @contextlib.contextmanager
@@ -308,3 +373,28 @@ class TestDRAptConfigurer(SubiTestCase):
         ):
             with self.assertRaises(AptConfigCheckError):
                 await self.configurer.run_apt_config_check(output)
+
+    async def test_probe_mirrors(self):
+        self.configurer._source_path = self.tmp_dir()
+        keyring = pathlib.Path(
+            self.configurer._source_path,
+            "etc/apt/trusted.gpg.d/ubuntu-keyring-2018-archive.gpg",
+        )
+        keyring.parent.mkdir(parents=True)
+        keyring.touch()
+        host_result = MirrorProbeResult(uri="http://run-on-host", ok=True, ttfb=0.5)
+        with patch(
+            "subiquity.server.apt.probe_mirrors", return_value=[host_result]
+        ) as probe:
+            results = await self.configurer.probe_mirrors(
+                ["http://failure", "http://run-on-host", "http://success"], 1
+            )
+        probe.assert_called_once()
+        self.assertEqual(probe.call_args.args[0], ["http://run-on-host"])
+        self.assertEqual(probe.call_args.kwargs["keyrings"], [str(keyring)])
+        self.assertEqual(
+            [result.uri for result in results],
+            ["http://failure", "http://run-on-host", "http://success"],
+        )
+        self.assertEqual([result.ok for result in results], [False, True, True])
+        self.assertIs(results[1], host_result)
@@ -0,0 +1,118 @@
+# Copyright 2025 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import threading
+from unittest.mock import patch
+
+from subiquity.server.apt_cache import AptCache
+from subiquitycore.tests import SubiTestCase, populate_dir
+
+LISTS = "var/lib/apt/lists"
+
+
+class TestAptCache(SubiTestCase):
+    def setUp(self):
+        self.cache = AptCache(os.path.join(self.tmp_dir(), "apt-cache"))
+
+    def make_root(self, files):
+        root = self.tmp_dir()
+        populate_dir(root, files)
+        return root
+
+    def test_store_seed(self):
+        src = self.make_root(
+            {
+                f"{LISTS}/archive_dists_noble_InRelease": "release",
+                f"{LISTS}/lock": "",
+                "var/cache/apt/archives/hello_2.10_amd64.deb": "deb",
+            }
+        )
+        os.mkdir(os.path.join(src, LISTS, "partial"))
+        release = os.path.join(src, LISTS, "archive_dists_noble_InRelease")
+        os.utime(release, (1000000000, 1000000000))
+        self.cache.store(src)
+
+        dst = self.tmp_dir()
+        self.cache.seed(dst)
+        # Only the index files are shared, packages are left alone.
+        self.assertEqual(os.listdir(dst), ["var"])
+        self.assertEqual(os.listdir(os.path.join(dst, "var")), ["lib"])
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(dst, LISTS))),
+            ["archive_dists_noble_InRelease"],
+        )
+        seeded = os.path.join(dst, LISTS, "archive_dists_noble_InRelease")
+        self.assert_contents(seeded, "release")
+        # apt uses the mtime to ask the mirror whether the file changed.
+        self.assertEqual(os.stat(seeded).st_mtime, 1000000000)
+
+    def test_seed_keeps_existing(self):
+        self.cache.store(self.make_root({f"{LISTS}/a_InRelease": "old"}))
+        dst = self.make_root({f"{LISTS}/a_InRelease": "new"})
+        self.cache.seed(dst)
+        self.assert_contents(os.path.join(dst, LISTS, "a_InRelease"), "new")
+
+    def test_same_content_stored_once(self):
+        self.cache.store(self.make_root({f"{LISTS}/a": "same", f"{LISTS}/b": "same"}))
+        objects = os.path.join(self.cache.directory, "objects")
+        self.assertEqual(len(os.listdir(objects)), 1)
+        dst = self.tmp_dir()
+        self.cache.seed(dst)
+        self.assertEqual(sorted(os.listdir(os.path.join(dst, LISTS))), ["a", "b"])
+
+    def test_restart(self):
+        self.cache.store(self.make_root({f"{LISTS}/a_InRelease": "abc"}))
+        # A new instance, as after a restart, has the same files.
+        cache = AptCache(self.cache.directory)
+        self.assertEqual(cache._size, 3)
+        dst = self.tmp_dir()
+        cache.seed(dst)
+        self.assert_contents(os.path.join(dst, LISTS, "a_InRelease"), "abc")
+
+    def test_max_size(self):
+        self.cache.max_size = 10
+        self.cache.store(
+            self.make_root({f"{LISTS}/small": "small", f"{LISTS}/big": "x" * 20})
+        )
+        dst = self.tmp_dir()
+        self.cache.seed(dst)
+        self.assertEqual(os.listdir(os.path.join(dst, LISTS)), ["small"])
+
+    def test_empty_root(self):
+        self.cache.store(self.tmp_dir())
+        dst = self.tmp_dir()
+        self.cache.seed(dst)
+        self.assertEqual(os.listdir(dst), [])
+
+    def test_store_while_seeding(self):
+        self.cache.store(self.make_root({f"{LISTS}/a": "a", f"{LISTS}/b": "b"}))
+        src = self.make_root({f"{LISTS}/c": "c"})
+        dst = self.tmp_dir()
+        place = self.cache._place
+        storing = []
+
+        def place_and_store(obj, path):
+            # Store more files while the seed is half way through.
+            place(obj, path)
+            if path.startswith(dst) and not storing:
+                storing.append(threading.Thread(target=self.cache.store, args=(src,)))
+                storing[0].start()
+                storing[0].join()
+
+        with patch.object(self.cache, "_place", side_effect=place_and_store):
+            self.cache.seed(dst)
+        self.assertEqual(sorted(os.listdir(os.path.join(dst, LISTS))), ["a", "b"])
+        self.assertEqual(sorted(self.cache._index), ["a", "b", "c"])
@@ -0,0 +1,214 @@
+# Copyright 2025 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import contextlib
+import unittest
+from typing import List
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from subiquity.common.api.defs import Payload, api, path_parameter
+from subiquity.common.api.recoverable_error import RecoverableError
+from subiquity.common.api.server import bind
+from subiquity.server.batch import make_batch_handler
+from subiquitycore.context import Context
+
+
+@api
+class API:
+    class items:
+        def GET() -> List[str]:
+            ...
+
+        def POST(item: Payload[str]) -> None:
+            ...
+
+    class count:
+        def GET(prefix: str = "") -> int:
+            ...
+
+    class fail:
+        def GET(recoverable: bool = False) -> None:
+            ...
+
+    class wait:
+        def GET() -> str:
+            ...
+
+    class notify:
+        def GET() -> str:
+            ...
+
+    class things:
+        @path_parameter
+        class thing:
+            def POST(value: Payload[int]) -> str:
+                ...
+
+
+class Controller:
+    def __init__(self):
+        self.app = mock.Mock()
+        self.app.report_start_event = mock.Mock()
+        self.app.report_finish_event = mock.Mock()
+        self.app.project = "test"
+        self.context = Context.new(self.app)
+        self.items = []
+        self.event = asyncio.Event()
+
+    async def items_GET(self) -> List[str]:
+        return self.items
+
+    async def items_POST(self, item: str) -> None:
+        self.items.append(item)
+
+    async def count_GET(self, prefix: str = "") -> int:
+        return len([i for i in self.items if i.startswith(prefix)])
+
+    async def fail_GET(self, recoverable: bool = False) -> None:
+        if recoverable:
+            raise RecoverableError("try again")
+        raise Exception("broken")
+
+    async def wait_GET(self) -> str:
+        await self.event.wait()
+        return "waited"
+
+    async def notify_GET(self) -> str:
+        self.event.set()
+        return "notified"
+
+    async def things_thing_POST(self, thing: str, value: int) -> str:
+        return f"{thing}={value}"
+
+
+async def call(request, handler, **bind_kw):
+    # What the server's middleware does, in miniature.
+    resp = await handler(request, **bind_kw)
+    resp.headers["x-updated"] = "no"
+    return resp
+
+
+async def stream(request):
+    raise AssertionError("should not be called")
+
+
+class TestBatch(unittest.IsolatedAsyncioTestCase):
+    @contextlib.asynccontextmanager
+    async def client(self):
+        self.controller = Controller()
+        app = web.Application()
+        bind(app.router, API, self.controller)
+        app.router.add_post("/batch", make_batch_handler(call))
+        app.router.add_get("/stream", stream)
+        async with TestClient(TestServer(app)) as client:
+            yield client
+
+    async def batch(self, calls):
+        async with self.client() as client:
+            resp = await client.post("/batch", json=calls)
+            self.assertEqual(resp.status, 200)
+            return await resp.json()
+
+    async def test_calls(self):
+        results = await self.batch(
+            [
+                {"method": "GET", "path": "/items"},
+                {"method": "POST", "path": "/items", "payload": "apple"},
+                {"method": "POST", "path": "/items", "payload": "banana"},
+                {"method": "GET", "path": "/items"},
+                {"method": "GET", "path": "/count", "query": {"prefix": '"b"'}},
+            ]
+        )
+        self.assertEqual(
+            [r["body"] for r in results],
+            [[], None, None, ["apple", "banana"], 1],
+        )
+        for result in results:
+            self.assertEqual(result["status"], 200)
+            self.assertEqual(result["headers"]["x-status"], "ok")
+            self.assertEqual(result["headers"]["x-updated"], "no")
+
+    async def test_payload_and_path_params(self):
+        [result] = await self.batch(
+            [
+                {
+                    "method": "POST",
+                    "path": "/things/answer",
+                    "payload": 42,
+                }
+            ]
+        )
+        self.assertEqual(result["status"], 200)
+        self.assertEqual(result["body"], "answer=42")
+
+    async def test_errors(self):
+        results = await self.batch(
+            [
+                {"method": "GET", "path": "/fail"},
+                {"method": "GET", "path": "/fail", "query": {"recoverable": "true"}},
+                {"method": "GET", "path": "/missing"},
+                {"method": "GET", "path": "/items"},
+            ]
+        )
+        [fail, recoverable, missing, items] = results
+        self.assertEqual(fail["status"], 500)
+        self.assertEqual(fail["headers"]["x-status"], "error")
+        self.assertEqual(fail["headers"]["x-error-type"], "Exception")
+        self.assertEqual(fail["headers"]["x-error-msg"], '"broken"')
+        self.assertIn("Traceback", fail["body"])
+        self.assertEqual(recoverable["status"], 422)
+        self.assertEqual(recoverable["headers"]["x-error-type"], "RecoverableError")
+        self.assertEqual(missing["status"], 404)
+        self.assertEqual(items["status"], 200)
+
+    async def test_gets_concurrent(self):
+        # wait only returns once notify has been called, which would never
+        # happen if the GETs were made one after the other.
+        results = await asyncio.wait_for(
+            self.batch(
+                [
+                    {"method": "GET", "path": "/wait"},
+                    {"method": "GET", "path": "/notify"},
+                ]
+            ),
+            5,
+        )
+        self.assertEqual([r["body"] for r in results], ["waited", "notified"])
+
+    async def test_not_batchable(self):
+        async with self.client() as client:
+            for path in "/batch", "/stream":
+                resp = await client.post(
+                    "/batch",
+                    json=[
+                        {"method": "GET", "path": "/items"},
+                        {
+                            "method": "POST" if path == "/batch" else "GET",
+                            "path": path,
+                        },
+                    ],
+                )
+                self.assertEqual(resp.status, 400)
+            self.assertEqual(self.controller.items, [])
+
+    async def test_bad_request(self):
+        async with self.client() as client:
+            for body in {"method": "GET"}, [{"path": "/items"}], ["/items"]:
+                resp = await client.post("/batch", json=body)
+                self.assertEqual(resp.status, 400)
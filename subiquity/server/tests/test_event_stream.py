@@ -0,0 +1,157 @@
+# Copyright 2025 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import contextlib
+import json
+import unittest
+from unittest.mock import Mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from subiquity.common.types import ApplicationState, ApplicationStatus
+from subiquity.server.event_stream import EventStream
+from subiquitycore.context import Context, Status
+
+
+def make_status(state):
+    return ApplicationStatus(
+        state=state,
+        confirming_tty="",
+        error=None,
+        nonreportable_error=None,
+        cloud_init_ok=True,
+        interactive=True,
+        echo_syslog_id="echo",
+        log_syslog_id="log",
+        event_syslog_id="event",
+    )
+
+
+class TestEventStream(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.app = Mock()
+        self.app.updated = False
+        self.app.application_status.return_value = make_status(ApplicationState.WAITING)
+        self.app.project = "subiquity"
+        self.stream = EventStream(self.app)
+        self.storage_state = 0
+        self.stream.watch("storage", lambda: self.storage_state)
+
+    @contextlib.asynccontextmanager
+    async def connect(self):
+        app = web.Application()
+        self.stream.add_routes(app)
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get("/meta/events")
+            self.assertEqual(resp.content_type, "text/event-stream")
+            yield resp
+
+    async def next_event(self, resp):
+        chunk = await asyncio.wait_for(resp.content.readuntil(b"\n\n"), 1)
+        event, data = chunk.decode().strip().split("\n")
+        return event.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+    async def initial_events(self, resp):
+        return [await self.next_event(resp) for _ in range(3)]
+
+    async def test_initial_state(self):
+        async with self.connect() as resp:
+            [state, updated, storage] = await self.initial_events(resp)
+        self.assertEqual(state[0], "state")
+        self.assertEqual(state[1]["state"], "WAITING")
+        self.assertEqual(updated, ("updated", False))
+        self.assertEqual(storage, ("storage", 1))
+
+    async def test_state_changed(self):
+        async with self.connect() as resp:
+            await self.initial_events(resp)
+            self.app.application_status.return_value = make_status(
+                ApplicationState.RUNNING
+            )
+            self.stream.state_changed()
+            event, data = await self.next_event(resp)
+        self.assertEqual(event, "state")
+        self.assertEqual(data["state"], "RUNNING")
+
+    async def test_context_events(self):
+        root = Context.new(self.app)
+        async with self.connect() as resp:
+            await self.initial_events(resp)
+            request = root.child("request")
+            request.set("request", object())
+            self.stream.report_start_event(request.child("handler"), "")
+            child = root.child("child", level="DEBUG")
+            self.stream.report_start_event(child, "starting")
+            self.stream.report_finish_event(child, "done", Status.SUCCESS)
+            start = await self.next_event(resp)
+            finish = await self.next_event(resp)
+        self.assertEqual(
+            start,
+            (
+                "start",
+                {
+                    "context_id": str(child.id),
+                    "parent_id": str(root.id),
+                    "name": "subiquity/child",
+                    "description": "starting",
+                    "level": "DEBUG",
+                    "result": None,
+                },
+            ),
+        )
+        self.assertEqual(finish[0], "finish")
+        self.assertEqual(finish[1]["result"], "SUCCESS")
+
+    async def test_watch(self):
+        async with self.connect() as resp:
+            await self.initial_events(resp)
+            # Several changes before the loop comes round are sent once.
+            self.storage_state = 1
+            self.stream.changed()
+            self.storage_state = 2
+            self.stream.changed()
+            self.assertEqual(await self.next_event(resp), ("storage", 2))
+            # No change, no event.
+            self.stream.changed()
+            self.stream.state_changed()
+            event, data = await self.next_event(resp)
+        self.assertEqual(event, "state")
+
+    async def test_watch_not_checked_without_clients(self):
+        get_state = Mock(return_value=0)
+        self.stream.watch("other", get_state)
+        self.stream.changed()
+        await asyncio.sleep(0)
+        get_state.assert_not_called()
+
+    async def test_slow_client_dropped(self):
+        self.stream.max_backlog = 5
+        async with self.connect() as resp:
+            await self.initial_events(resp)
+            # Wait for the handler to catch up before flooding it.
+            self.stream.state_changed()
+            await self.next_event(resp)
+            for _ in range(10):
+                self.stream.state_changed()
+            events = []
+            while True:
+                chunk = await asyncio.wait_for(resp.content.readuntil(b"\n\n"), 1)
+                if not chunk:
+                    break
+                events.append(chunk)
+        self.assertEqual(len(events), 5)
+        self.assertEqual(self.stream._subscribers, set())
@@ -0,0 +1,71 @@
+# Copyright 2025 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+
+from subiquity.server.mirror_cache import CachedMirrorCheck, MirrorCheckCache
+from subiquitycore.tests import SubiTestCase
+
+
+class TestMirrorCheckCache(SubiTestCase):
+    def setUp(self):
+        self.cache = MirrorCheckCache(os.path.join(self.tmp_dir(), "mirror-checks"))
+
+    def test_key(self):
+        key = MirrorCheckCache.key({"apt": {"a": 1, "b": 2}}, "", "ubuntu-server")
+        self.assertEqual(
+            key, MirrorCheckCache.key({"apt": {"b": 2, "a": 1}}, "", "ubuntu-server")
+        )
+        for other in (
+            MirrorCheckCache.key({"apt": {"a": 1}}, "", "ubuntu-server"),
+            MirrorCheckCache.key(
+                {"apt": {"a": 1, "b": 2}}, "http://proxy", "ubuntu-server"
+            ),
+            MirrorCheckCache.key({"apt": {"a": 1, "b": 2}}, "", "ubuntu-desktop"),
+        ):
+            self.assertNotEqual(key, other)
+
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get("key"))
+        check = CachedMirrorCheck(
+            uri="http://mirror",
+            output="Reading package lists...\n",
+            elapsed=1.5,
+            checked_at=time.time(),
+        )
+        self.cache.put("key", check)
+        self.assertEqual(self.cache.get("key"), check)
+        # A new instance, as after a restart, sees the same entries.
+        self.assertEqual(MirrorCheckCache(self.cache.directory).get("key"), check)
+
+    def test_expired(self):
+        check = CachedMirrorCheck(
+            uri=None, output="", elapsed=1.0, checked_at=time.time() - 10
+        )
+        self.cache.put("key", check)
+        self.assertIsNotNone(self.cache.get("key"))
+        self.cache.ttl = 5
+        self.assertIsNone(self.cache.get("key"))
+        # Nor is an entry from the future trusted.
+        check.checked_at = time.time() + 60
+        self.cache.put("key", check)
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_unreadable(self):
+        os.makedirs(self.cache.directory)
+        with open(os.path.join(self.cache.directory, "key.json"), "w") as fp:
+            fp.write("{not json")
+        self.assertIsNone(self.cache.get("key"))
@@ -0,0 +1,204 @@
+# Copyright 2025 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import datetime
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from subiquity.server.mirror_probe import (
+    InvalidReleaseError,
+    MirrorProbeResult,
+    check_inrelease,
+    inrelease_url,
+    probe_mirrors,
+    rank_probe_results,
+)
+
+RELEASE = """\
+Origin: Ubuntu
+Label: Ubuntu
+Suite: noble
+Codename: noble
+Date: Thu, 25 Apr 2024 15:10:33 UTC
+Valid-Until: {valid_until}
+SHA256:
+ 0123456789abcdef 1024 main/binary-amd64/Packages.gz
+"""
+
+FUTURE = "Fri, 01 Jan 2100 00:00:00 UTC"
+PAST = "Sat, 01 Jan 2000 00:00:00 UTC"
+
+
+@unittest.skipIf(shutil.which("gpg") is None, "needs gpg")
+class TestProbeMirrors(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Sign the InRelease files served below with a throwaway key.
+        cls.gnupghome = tempfile.mkdtemp()
+        env = dict(os.environ, GNUPGHOME=cls.gnupghome)
+
+        def gpg(*args, input=None):
+            return subprocess.run(
+                ["gpg", "--batch", "--passphrase", ""] + list(args),
+                input=input,
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+
+        gpg("--quick-gen-key", "Test Archive <archive@example.com>", "ed25519")
+        cls.keyring = os.path.join(cls.gnupghome, "archive.gpg")
+        gpg("--output", cls.keyring, "--export")
+        cls.good = gpg("--clearsign", input=RELEASE.format(valid_until=FUTURE))
+        cls.stale = gpg("--clearsign", input=RELEASE.format(valid_until=PAST))
+        subprocess.run(["gpgconf", "--kill", "gpg-agent"], env=env)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.gnupghome)
+
+    async def asyncSetUp(self):
+        def serve(text):
+            async def handler(request):
+                return web.Response(text=text)
+
+            return handler
+
+        async def slow(request):
+            await asyncio.sleep(10)
+            return web.Response(body=b"")
+
+        tampered = self.good.replace("main/binary-amd64", "evil/binary-amd64")
+        app = web.Application()
+        for name, text in (
+            ("ubuntu", self.good),
+            ("stale", self.stale),
+            ("tampered", tampered),
+            ("captive", "<html>Please log in</html>"),
+        ):
+            app.router.add_get(f"/{name}/dists/noble/InRelease", serve(text))
+        app.router.add_get("/slow/dists/noble/InRelease", slow)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.addAsyncCleanup(self.server.close)
+
+    def uri(self, path):
+        return str(self.server.make_url(path))
+
+    async def test_probe(self):
+        uris = [self.uri("/ubuntu/"), self.uri("/missing"), self.uri("/slow")]
+        ok, missing, slow = await probe_mirrors(
+            uris, "noble", timeout=0.5, keyrings=[self.keyring]
+        )
+
+        self.assertEqual(ok.uri, uris[0])
+        self.assertTrue(ok.ok, ok.error)
+        self.assertGreater(ok.ttfb, 0)
+        self.assertGreater(ok.throughput, 0)
+
+        self.assertFalse(missing.ok)
+        self.assertEqual(missing.error, "HTTP 404")
+
+        self.assertFalse(slow.ok)
+        self.assertIsNone(slow.ttfb)
+        self.assertIn("Timeout", slow.error)
+
+    async def test_untrusted(self):
+        uris = [self.uri(f"/{name}") for name in ("stale", "tampered", "captive")]
+        stale, tampered, captive = await probe_mirrors(
+            uris, "noble", keyrings=[self.keyring]
+        )
+        self.assertFalse(stale.ok)
+        self.assertIn("expired", stale.error)
+        self.assertFalse(tampered.ok)
+        self.assertIn("bad signature", tampered.error)
+        self.assertFalse(captive.ok)
+        self.assertIn("not signed", captive.error)
+
+    async def test_no_keyrings(self):
+        # Without keyrings, only the expiry is checked.
+        ok, stale = await probe_mirrors(
+            [self.uri("/tampered"), self.uri("/stale")], "noble"
+        )
+        self.assertTrue(ok.ok, ok.error)
+        self.assertFalse(stale.ok)
+
+    async def test_unreachable(self):
+        [result] = await probe_mirrors(["http://localhost:1/ubuntu"], "noble")
+        self.assertFalse(result.ok)
+        self.assertIsNotNone(result.error)
+
+
+class TestCheckInRelease(unittest.IsolatedAsyncioTestCase):
+    def signed(self, release):
+        return (
+            "-----BEGIN PGP SIGNED MESSAGE-----\nHash: SHA256\n\n"
+            + release
+            + "-----BEGIN PGP SIGNATURE-----\n\nabc\n-----END PGP SIGNATURE-----\n"
+        )
+
+    async def test_valid_until(self):
+        now = datetime.datetime(2024, 5, 1, tzinfo=datetime.timezone.utc)
+        text = self.signed(RELEASE.format(valid_until="Wed, 01 May 2024 01:00:00 UTC"))
+        await check_inrelease(text, now=now)
+        with self.assertRaises(InvalidReleaseError):
+            await check_inrelease(text, now=now + datetime.timedelta(hours=2))
+
+    async def test_bad_valid_until(self):
+        text = self.signed(RELEASE.format(valid_until="whenever"))
+        with self.assertRaises(InvalidReleaseError):
+            await check_inrelease(text)
+
+    async def test_no_valid_until(self):
+        # Ubuntu's archive does not set Valid-Until.
+        await check_inrelease(self.signed("Suite: noble\n"))
+
+
+class TestRankProbeResults(unittest.TestCase):
+    def test_inrelease_url(self):
+        self.assertEqual(
+            inrelease_url("http://archive.ubuntu.com/ubuntu/", "noble"),
+            "http://archive.ubuntu.com/ubuntu/dists/noble/InRelease",
+        )
+
+    def test_keeps_preference_order(self):
+        results = [
+            MirrorProbeResult(uri="a", ok=True, ttfb=0.3),
+            MirrorProbeResult(uri="b", ok=False),
+            MirrorProbeResult(uri="c", ok=True, ttfb=0.1),
+        ]
+        ranked = rank_probe_results(results)
+        self.assertEqual([r.uri for r in ranked], ["a", "c"])
+
+    def test_demotes_slow(self):
+        results = [
+            MirrorProbeResult(uri="a", ok=True, ttfb=3.0),
+            MirrorProbeResult(uri="b", ok=True, ttfb=2.0),
+            MirrorProbeResult(uri="c", ok=True, ttfb=0.1),
+            MirrorProbeResult(uri="d", ok=True, ttfb=0.2),
+        ]
+        ranked = rank_probe_results(results)
+        self.assertEqual([r.uri for r in ranked], ["c", "d", "b", "a"])
+
+    def test_none_working(self):
+        self.assertEqual(rank_probe_results([MirrorProbeResult("a", ok=False)]), [])
@@ -13,19 +13,31 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import copy
 import os
 import shlex
-from typing import Any
+from typing import Any, List
 from unittest.mock import AsyncMock, Mock, patch
 
 import jsonschema
 import yaml
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
 from jsonschema.validators import validator_for
 
 from subiquity.cloudinit import CloudInitSchemaTopLevelKeyError
-from subiquity.common.types import NonReportableError, PasswordKind
+from subiquity.common.api.defs import Payload, api
+from subiquity.common.api.server import bind
+from subiquity.common.types import (
+    ErrorReportKind,
+    ErrorReportRef,
+    ErrorReportState,
+    NonReportableError,
+    PasswordKind,
+)
 from subiquity.server.autoinstall import AutoinstallError, AutoinstallValidationError
+from subiquity.server.batch import make_batch_handler
 from subiquity.server.nonreportable import NonReportableException
 from subiquity.server.server import (
     NOPROBERARG,
@@ -759,3 +771,107 @@ class TestVariantHandling(SubiTestCase):
         self.server.set_source_variant("mock-variant")
         self.assertEqual(self.server.variant, "mock-variant")
         self.server.base_model.set_source_variant.assert_called_with("mock-variant")
+
+
+@api
+class MiddlewareAPI:
+    class things:
+        def GET() -> List[str]:
+            ...
+
+        def POST(thing: Payload[str]) -> None:
+            ...
+
+    class fail:
+        def GET() -> None:
+            ...
+
+    class slow_fail:
+        def GET() -> None:
+            ...
+
+
+class MiddlewareController:
+    def __init__(self):
+        self.app = Mock()
+        self.context = Context.new(self.app)
+        self.things = []
+
+    async def things_GET(self) -> List[str]:
+        return self.things
+
+    async def things_POST(self, thing: str) -> None:
+        self.things.append(thing)
+
+    async def fail_GET(self) -> None:
+        raise Exception("broken")
+
+    async def slow_fail_GET(self) -> None:
+        await asyncio.sleep(0.05)
+        raise Exception("broken")
+
+
+class TestMiddleware(SubiTestCase):
+    async def asyncSetUp(self):
+        opts = Mock()
+        opts.dry_run = True
+        opts.output_base = self.tmp_dir()
+        opts.machine_config = NOPROBERARG
+        self.server = SubiquityServer(opts, None)
+        self.server.make_apport_report = Mock()
+        self.server.make_apport_report.return_value.ref.return_value = ErrorReportRef(
+            state=ErrorReportState.DONE,
+            base="1",
+            kind=ErrorReportKind.SERVER_REQUEST_FAIL,
+            seen=False,
+            oops_id=None,
+        )
+        self.controller = MiddlewareController()
+        app = web.Application(middlewares=[self.server.middleware])
+        bind(app.router, MiddlewareAPI, self.controller)
+        app.router.add_post("/batch", make_batch_handler(self.server.call_handler))
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def test_batch(self):
+        resp = await self.client.post(
+            "/batch",
+            json=[
+                {"method": "POST", "path": "/things", "payload": "apple"},
+                {"method": "GET", "path": "/things"},
+                {"method": "GET", "path": "/fail"},
+            ],
+        )
+        self.assertEqual(resp.status, 200)
+        [post, get, fail] = await resp.json()
+        self.assertEqual(["apple"], get["body"])
+        for result in post, get, fail:
+            self.assertEqual("no", result["headers"]["x-updated"])
+        self.assertEqual(500, fail["status"])
+        self.assertIn("x-error-report", fail["headers"])
+        self.server.make_apport_report.assert_called_once()
+        # The calls are counted against their own routes.
+        self.assertEqual(
+            {"/things", "/fail"},
+            {route.path for route in self.server.api_metrics.snapshot()},
+        )
+
+    async def test_coalesced_failure_reported_once(self):
+        resps = await asyncio.gather(*(self.client.get("/slow_fail") for _ in range(3)))
+        self.server.make_apport_report.assert_called_once()
+        refs = {resp.headers["x-error-report"] for resp in resps}
+        self.assertEqual(1, len(refs))
+        for resp in resps:
+            self.assertEqual(500, resp.status)
+
+    async def test_not_modified(self):
+        resp = await self.client.get("/things")
+        self.assertEqual(200, resp.status)
+        etag = resp.headers["etag"]
+        resp = await self.client.get("/things", headers={"If-None-Match": etag})
+        self.assertEqual(304, resp.status)
+        self.assertEqual("ok", resp.headers["x-status"])
+        self.assertEqual("no", resp.headers["x-updated"])
+        [route] = self.server.api_metrics.snapshot()
+        self.assertEqual(2, route.response_size.count)
@@ -24,6 +24,44 @@ from subiquitycore.async_helpers import run_in_thread
 log = logging.getLogger("subiquitycore.prober")
 
 
+class _BlockDeviceSubsetContext:
+    """A pyudev context that only lists some block devices.
+
+    Only the disks with the given device nodes, the disks of the
+    partitions with the given device nodes and all partitions on those
+    disks are listed, which makes probert's block device probes skip all
+    the others.
+    """
+
+    def __init__(self, context, paths):
+        self._context = context
+        self._paths = paths
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+    @staticmethod
+    def _disk(device):
+        if device.device_type == "partition" and device.parent is not None:
+            return device.parent
+        return device
+
+    def list_devices(self, **kw):
+        devices = list(self._context.list_devices(**kw))
+        disks = {
+            self._disk(device).device_node
+            for device in devices
+            if device.subsystem == "block" and device.device_node in self._paths
+        }
+        return [
+            device
+            for device in devices
+            if device.subsystem != "block"
+            or self._disk(device).device_node in disks
+            or device.device_node in self._paths
+        ]
+
+
 class Prober:
     def __init__(self, machine_config, debug_flags):
         self.saved_config = None
@@ -69,6 +107,51 @@ class Prober:
 
         return await run_in_thread(run_probert, probe_types)
 
+    async def get_storage_for_devices(self, paths, probe_types):
+        """Probe only the disks in paths, the disks of the partitions in
+        paths and the partitions on all those disks.
+
+        Probes that do not look at individual block devices, like "mount",
+        still cover the whole system.
+        """
+        if self.saved_config is not None:
+            storage = self.saved_config["storage"]
+            blockdev = storage["blockdev"]
+            majmins = set()
+            for path in paths:
+                data = blockdev.get(path)
+                if data is None:
+                    continue
+                if data.get("DEVTYPE") == "partition":
+                    majmins.add(data["ID_PART_ENTRY_DISK"])
+                else:
+                    majmins.add("{MAJOR}:{MINOR}".format(**data))
+            wanted = {
+                path
+                for path, data in blockdev.items()
+                if path in paths
+                or "{MAJOR}:{MINOR}".format(**data) in majmins
+                or data.get("ID_PART_ENTRY_DISK") in majmins
+            }
+            r = {}
+            for k in probe_types:
+                if k not in storage:
+                    continue
+                if isinstance(storage[k], dict):
+                    r[k] = {p: v for p, v in storage[k].items() if p in wanted}
+                else:
+                    r[k] = storage[k]
+            return r
+
+        from probert.storage import Storage
+
+        def run_probert(paths, probe_types):
+            storage = Storage()
+            storage.context = _BlockDeviceSubsetContext(storage.context, paths)
+            return asyncio.run(storage.probe(probe_types=probe_types, parallelize=True))
+
+        return await run_in_thread(run_probert, paths, probe_types)
+
     async def get_firmware(self) -> dict[str, Any]:
         from probert.firmware import FirmwareProber
 
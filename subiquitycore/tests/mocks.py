@@ -36,6 +36,8 @@ def make_app(model=None):
     else:
         app.base_model = mock.Mock()
     app.add_event_listener = mock.Mock()
+    app.event_stream = mock.Mock()
+    app.apt_cache = None
     app.controllers = mock.Mock()
     app.context = Context.new(app)
     app.exit = mock.Mock()
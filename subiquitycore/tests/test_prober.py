@@ -12,7 +12,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from subiquitycore.prober import Prober
+from unittest import mock
+
+from subiquitycore.prober import Prober, _BlockDeviceSubsetContext
 from subiquitycore.tests import SubiTestCase
 
 
@@ -23,3 +25,44 @@ class TestProber(SubiTestCase):
         none_storage = await prober.get_storage(probe_types=None)
         defaults_storage = await prober.get_storage(probe_types={"defaults"})
         self.assertEqual(defaults_storage, none_storage)
+
+    async def test_storage_for_devices(self):
+        with open("examples/machines/existing-partitions.json", "r") as fp:
+            prober = Prober(machine_config=fp, debug_flags=())
+        storage = await prober.get_storage_for_devices(
+            {"/dev/vdb", "/dev/vdc1"}, {"blockdev", "filesystem", "mount"}
+        )
+        self.assertEqual(
+            [f"/dev/vdb{n}" for n in ["", 1, 2, 3, 4, 5, 6]]
+            + ["/dev/vdc", "/dev/vdc1"],
+            sorted(storage["blockdev"]),
+        )
+        self.assertEqual(
+            ["/dev/vdb2", "/dev/vdb4", "/dev/vdb5", "/dev/vdb6"],
+            sorted(storage["filesystem"]),
+        )
+        full = await prober.get_storage()
+        self.assertEqual(full["mount"], storage["mount"])
+
+
+class TestBlockDeviceSubsetContext(SubiTestCase):
+    def test_list_devices(self):
+        sda = mock.Mock(subsystem="block", device_node="/dev/sda", device_type="disk")
+        # parent means something else to Mock's constructor.
+        sda1 = mock.Mock(
+            subsystem="block", device_node="/dev/sda1", device_type="partition"
+        )
+        sda1.parent = sda
+        sda2 = mock.Mock(
+            subsystem="block", device_node="/dev/sda2", device_type="partition"
+        )
+        sda2.parent = sda
+        sdb = mock.Mock(subsystem="block", device_node="/dev/sdb", device_type="disk")
+        nvme0 = mock.Mock(subsystem="nvme", device_node="/dev/nvme0")
+        context = mock.Mock()
+        context.list_devices.return_value = [sda, sda1, sda2, sdb, nvme0]
+        subset = _BlockDeviceSubsetContext(context, {"/dev/sda"})
+        self.assertEqual([sda, sda1, sda2, nvme0], list(subset.list_devices()))
+        subset = _BlockDeviceSubsetContext(context, {"/dev/sda2", "/dev/sdc"})
+        self.assertEqual([sda, sda1, sda2, nvme0], list(subset.list_devices()))
+        self.assertIs(context.device_path, subset.device_path)